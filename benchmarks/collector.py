@@ -0,0 +1,64 @@
+"""Compare the CPU cost of a monitor sweep, psutil oneshot() per task against the batch /proc collector.
+
+Usage:
+    PYTHONPATH=src python benchmarks/collector.py [ <number-of-processes> [ <rounds> ] ]
+"""
+import sys
+import time
+import subprocess
+from psutil import Process
+from osmon.common.interfaces import IProcessStatistics, IProcessCpuTimes, IProcessMemInfo
+from osmon.system.linux.collector import ProcStatCollector
+
+
+def sweep_psutil( processes ):
+    result = {}
+    for process in processes:
+        with process.oneshot():
+            cpu = IProcessCpuTimes( **process.cpu_times()._asdict() )     # noqa
+            mem = IProcessMemInfo( **process.memory_info()._asdict() )    # noqa
+            result[ process.pid ] = IProcessStatistics( cpu = process.cpu_num(),
+                                                        status = process.status(),
+                                                        cpu_percent = process.cpu_percent(),
+                                                        cpu_times = cpu,
+                                                        memory = mem )
+
+    return result
+
+
+def measure( name, function, rounds ):
+    function()
+    started_cpu = time.process_time()
+    started = time.perf_counter()
+    for _ in range( rounds ):
+        function()
+
+    cpu = ( time.process_time() - started_cpu ) / rounds
+    wall = ( time.perf_counter() - started ) / rounds
+    print( f"{ name:10} cpu { cpu * 1000:8.2f} ms/sweep   wall { wall * 1000:8.2f} ms/sweep" )
+    return cpu
+
+
+def main():
+    count = int( sys.argv[ 1 ] ) if len( sys.argv ) > 1 else 500
+    rounds = int( sys.argv[ 2 ] ) if len( sys.argv ) > 2 else 20
+    children = [ subprocess.Popen( [ 'sleep', '600' ] ) for _ in range( count ) ]
+    try:
+        processes = [ Process( child.pid ) for child in children ]
+        pids = [ child.pid for child in children ]
+        collector = ProcStatCollector()
+        print( f"Sweep over { count } processes, { rounds } rounds" )
+        slow = measure( 'psutil', lambda: sweep_psutil( processes ), rounds )
+        fast = measure( 'batch', lambda: collector.collect( pids ), rounds )
+        print( f"Speed-up (cpu): { slow / fast:.1f}x" )
+
+    finally:
+        for child in children:
+            child.kill()
+            child.wait()
+
+    return
+
+
+if __name__ == '__main__':
+    main()
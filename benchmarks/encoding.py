@@ -0,0 +1,65 @@
+"""Micro-benchmark of the codecs of the control protocol; the size of the status response
+of a number of tasks and the time to encode and decode it, JSON against msgpack.
+
+The encode time is that of a status snapshot, serialized once per sweep. The decode time
+is that of the client, from the frame payload to the response model. Then the size of the
+frames with zlib compression; the first status on a connection and the next one, that
+refers to the first in the deflate stream of the connection.
+
+Usage:
+    PYTHONPATH=src python benchmarks/encoding.py [ <count> [ <tasks> ] ]
+"""
+import sys
+import time
+from osmon.common.interfaces import IMessageResponse, ITaskProcessInfo, IProcessInfo
+from osmon.common.json_protocol import JsonProtocol, CODECS
+
+
+def measure( name, method, count ):
+    started = time.perf_counter()
+    for _ in range( count ):
+        method()
+
+    elapsed = time.perf_counter() - started
+    print( f"{ name:28} { 1000000 * elapsed / count:10.1f} us" )
+    return
+
+
+def main():
+    count = int( sys.argv[ 1 ] ) if len( sys.argv ) > 1 else 200
+    tasks = int( sys.argv[ 2 ] ) if len( sys.argv ) > 2 else 200
+    process = IProcessInfo( pid = 1234, ppid = 1, name = 'task', exe = '/usr/bin/task', cmdline = [ '/usr/bin/task', '-d' ],
+                            status = 'sleeping', cwd = '/var/lib/task', username = 'task', create_time = time.time(),
+                            cpu_num = 3, cpu_percent = 1.25, cpu_times = [ 12.5, 3.25, 0.0, 0.0, 0.0 ],
+                            memory_percent = 0.75, memory_info = [ 52428800, 268435456, 8388608, 4096, 0, 41943040, 0 ],
+                            num_ctx_switches = [ 12000, 340 ], num_threads = 4, num_fds = 12,
+                            environ = { 'PATH': '/usr/bin:/bin', 'HOME': '/var/lib/task', 'LANG': 'C.UTF-8' } )
+    status = IMessageResponse( status = True, message = '', generation = 1,
+                               parameters = [ ITaskProcessInfo( name = f"task-{ idx }", pid = f"/run/task-{ idx }.pid",
+                                                                status = 'running', restarts = 0,
+                                                                process = process.model_copy(
+                                                                    update = { 'pid': 1234 + idx,
+                                                                               'cpu_percent': idx % 7 * 0.37,
+                                                                               'create_time': process.create_time + idx * 1.7,
+                                                                               'memory_info': [ 52428800 + idx * 4096 ] * 7 } ) )
+                                              for idx in range( tasks ) ] )
+    for codec in CODECS:
+        protocol = JsonProtocol( 4, codec )
+        data = protocol.encode( status )
+        print( f"{ codec }: status of { tasks } tasks in { len( data ) } bytes" )
+        measure( f"{ codec } encode", lambda: protocol.encode( status ), count )
+        measure( f"{ codec } decode", lambda: protocol.decode( memoryview( data ), IMessageResponse ), count )
+
+    for codec in CODECS:
+        protocol = JsonProtocol( 4, codec, 'zlib' )
+        first = len( protocol.frame( status ) )
+        status.parameters[ 0 ].process.cpu_percent += 1.0
+        second = len( protocol.frame( status ) )
+        print( f"{ codec } + zlib: first status { first } bytes, next status { second } bytes" )
+        measure( f"{ codec } + zlib frame", lambda: protocol.frame( status ), count )
+
+    return
+
+
+if __name__ == '__main__':
+    main()
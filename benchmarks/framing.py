@@ -0,0 +1,110 @@
+"""Micro-benchmark of the frame reading; recv() per header and payload with a decode to str
+(JsonProtocol.deserialize) against recv_into() a reused buffer (FrameReader).
+
+Frames of a small request and a large status response are read from a socket pair, the
+other end is written by a thread. Reported are the frames per second and the peak of the
+memory allocated while reading one frame. Then the writing of the status frame, joined
+with its header into one buffer against scatter-gather with sendmsg().
+
+Usage:
+    PYTHONPATH=src python benchmarks/framing.py [ <frames> [ <tasks> ] ]
+"""
+import sys
+import time
+import socket
+import tracemalloc
+from threading import Thread
+from osmon.common.interfaces import IMessageRequest, IMessageResponse, ITaskProcessInfo
+from osmon.common.json_protocol import JsonProtocol, FrameReader, send_parts
+
+
+def writer( sock, frame: bytes, count: int ):
+    for _ in range( count ):
+        sock.sendall( frame )
+
+    return
+
+
+def deserialize( protocol, sock, return_type ):
+    return lambda: protocol.deserialize( sock.recv, return_type )
+
+
+def frame_reader( protocol, sock, return_type ):
+    reader = FrameReader( sock )
+    return lambda: protocol.decode( reader.read( protocol ), return_type )
+
+
+def measure( name, method, data, return_type, count ):
+    protocol = JsonProtocol( 4 )
+    frame = protocol.frame( data )
+    left, right = socket.socketpair()
+    thread = Thread( target = writer, args = ( left, frame, count + 1 ) )
+    thread.start()
+    read = method( protocol, right, return_type )
+    tracemalloc.start()
+    read()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[ 0 ]
+    read()
+    peak = tracemalloc.get_traced_memory()[ 1 ] - base
+    tracemalloc.stop()
+    started = time.perf_counter()
+    for _ in range( count - 1 ):
+        read()
+
+    elapsed = time.perf_counter() - started
+    thread.join()
+    left.close()
+    right.close()
+    print( f"{ name:28} { ( count - 1 ) / elapsed:10.0f} frames/sec   peak { peak / 1024:8.1f} kB/frame" )
+    return
+
+
+def drain( sock ):
+    buffer = bytearray( 1 << 20 )
+    while sock.recv_into( buffer ) > 0:
+        pass
+
+    return
+
+
+def measure_write( name, parts_writer, data: bytes, count: int ):
+    protocol = JsonProtocol( 4 )
+    left, right = socket.socketpair()
+    thread = Thread( target = drain, args = ( right, ) )
+    thread.start()
+    started = time.perf_counter()
+    for _ in range( count ):
+        parts_writer( left, protocol.parts( data ) )
+
+    elapsed = time.perf_counter() - started
+    left.close()
+    thread.join()
+    right.close()
+    print( f"{ name:28} { count / elapsed:10.0f} frames/sec" )
+    return
+
+
+def main():
+    count = int( sys.argv[ 1 ] ) if len( sys.argv ) > 1 else 20000
+    tasks = int( sys.argv[ 2 ] ) if len( sys.argv ) > 2 else 200
+    request = IMessageRequest( action = 'status', id = 1 )
+    status = IMessageResponse( status = True, message = '',
+                               parameters = [ ITaskProcessInfo( name = f"task-{ idx }", pid = f"/run/task-{ idx }.pid",
+                                                                status = 'running', restarts = 0 )
+                                              for idx in range( tasks ) ] )
+    print( f"Request frame of { len( request.model_dump_json( exclude_none = True ) ) } bytes" )
+    measure( "recv + deserialize", deserialize, request, IMessageRequest, count )
+    measure( "recv_into + FrameReader", frame_reader, request, IMessageRequest, count )
+    size = len( status.model_dump_json( exclude_none = True ) )
+    print( f"Status frame of { size } bytes" )
+    measure( "recv + deserialize", deserialize, status, IMessageResponse, count // 10 )
+    measure( "recv_into + FrameReader", frame_reader, status, IMessageResponse, count // 10 )
+    data = status.model_dump_json( exclude_none = True ).encode()
+    measure_write( "sendall of joined frame", lambda sock, parts: sock.sendall( b''.join( parts ) ), data, count )
+    measure_write( "sendmsg of header and data", send_parts, data, count )
+    return
+
+
+if __name__ == '__main__':
+    main()
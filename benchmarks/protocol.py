@@ -0,0 +1,93 @@
+"""Requests per second of the control protocol; a new connection per request against one
+persistent connection, with and without pipelining. Then the number of threads of the
+server with many connections open.
+
+The servers run in this process with the request dispatcher of osmon and an empty task list.
+
+Usage:
+    PYTHONPATH=src python benchmarks/protocol.py [ <requests> [ <pipeline-depth> [ <connections> ] ] ]
+"""
+import sys
+import time
+import threading
+from threading import Thread
+from oscom.client import SimpleClient, PersistentClient
+from osmon.common.event import FlagEvent
+from osmon.common.interfaces import IConfiguration, IMessageRequest, IMessageResponse
+from osmon.common.processlist import ProcessList
+from osmon.common.dispatcher import RequestDispatcher
+from osmon.common.server import JsonServer, AsyncJsonServer
+from osmon.monitor import JsonHandler
+
+
+def measure( name, function, count ):
+    started = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - started
+    print( f"{ name:24} { count / elapsed:10.0f} requests/sec   { elapsed / count * 1e6:8.1f} us/request" )
+    return
+
+
+def run( server, count, depth, connections ):
+    host, port = server.server_address
+    thread = Thread( target = server.serve_forever )
+    thread.start()
+    request = IMessageRequest( action = 'status' )
+    try:
+        def one_shot():
+            for _ in range( count ):
+                SimpleClient( host, port, bytes ).sendReceive( request )
+
+            return
+
+        def persistent():
+            with PersistentClient( host, port, bytes ) as client:
+                for _ in range( count ):
+                    client.sendReceive( request )
+
+            return
+
+        def pipelined():
+            with PersistentClient( host, port, bytes ) as client:
+                for _ in range( count // depth ):
+                    client.pipeline( [ request ] * depth )
+
+            return
+
+        measure( "connection per request", one_shot, count )
+        measure( "persistent", persistent, count )
+        measure( f"pipelined ({ depth } deep)", pipelined, count // depth * depth )
+        clients = [ PersistentClient( host, port, bytes ) for _ in range( connections ) ]
+        for client in clients:
+            client.sendReceive( request )
+
+        print( f"{ 'threads':24} { threading.active_count():10} with { connections } connections open" )
+        for client in clients:
+            client.close()
+
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+    return
+
+
+def main():
+    count = int( sys.argv[ 1 ] ) if len( sys.argv ) > 1 else 5000
+    depth = int( sys.argv[ 2 ] ) if len( sys.argv ) > 2 else 16
+    connections = int( sys.argv[ 3 ] ) if len( sys.argv ) > 3 else 200
+    processes = ProcessList( IConfiguration( version = 1, processes = [] ) )
+    dispatcher = RequestDispatcher( processes, FlagEvent() )
+    JsonHandler.dispatcher = dispatcher
+    JsonHandler.keepalive = 60.0
+    print( f"{ count } status requests, threading server" )
+    run( JsonServer( ( 'localhost', 0 ), JsonHandler ), count, depth, connections )
+    print( f"{ count } status requests, asyncio server" )
+    run( AsyncJsonServer( ( 'localhost', 0 ), dispatcher, connections + 1 ), count, depth, connections )
+    processes.close()
+    return
+
+
+if __name__ == '__main__':
+    main()
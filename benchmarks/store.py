@@ -0,0 +1,45 @@
+"""Micro-benchmark of the on-disk metrics store; the time to append a sample, rolled up into
+all resolutions, and the time to query a day of 1 second records from the mapped segments.
+
+The store is created in a temporary directory with the default retention, the samples are
+one second apart.
+
+Usage:
+    PYTHONPATH=src python benchmarks/store.py [ <samples> ]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+from osmon.common.store import MetricsStore
+
+
+def main():
+    count = int( sys.argv[ 1 ] ) if len( sys.argv ) > 1 else 86400
+    directory = tempfile.mkdtemp()
+    store = MetricsStore( directory, { '1s': 86400, '1m': 2592000, '1h': 31536000 } )
+    series = store.series( 'task' )
+    first = time.time() - count
+    started = time.perf_counter()
+    for idx in range( count ):
+        series.append( first + idx, idx * 0.01, idx * 0.001, idx % 100 * 0.5, 52428800 + idx, 268435456, 'sleeping' )
+
+    elapsed = time.perf_counter() - started
+    print( f"append { count } samples            { 1000000 * elapsed / count:10.1f} us per sample" )
+    for resolution in ( '1s', '1m', '1h' ):
+        started = time.perf_counter()
+        result = store.query( 'task', first, None, resolution )
+        elapsed = time.perf_counter() - started
+        print( f"query { resolution } { len( result[ 'timestamp' ] ):8} records        { elapsed * 1000:10.1f} ms" )
+
+    size = sum( os.path.getsize( os.path.join( root, name ) )
+                for root, _, names in os.walk( directory ) for name in names )
+    print( f"{ size } bytes on disk" )
+    store.close()
+    shutil.rmtree( directory )
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Latency of the control protocol over TCP loopback against a unix socket, for a new
+connection per request and for one persistent connection, with both control servers.
+
+The servers run in this process with the request dispatcher of osmon and an empty task list.
+Reported are the median and the 99th percentile of the round trip of a status request.
+
+Usage:
+    PYTHONPATH=src python benchmarks/transport.py [ <requests> ]
+"""
+import os
+import sys
+import time
+import tempfile
+from threading import Thread
+from oscom.client import SimpleClient, PersistentClient
+from osmon.common.event import FlagEvent
+from osmon.common.interfaces import IConfiguration, IMessageRequest
+from osmon.common.processlist import ProcessList
+from osmon.common.dispatcher import RequestDispatcher
+from osmon.common.server import JsonServer, UnixJsonServer, AsyncJsonServer
+from osmon.monitor import JsonHandler
+
+
+def measure( name, request, count ):
+    latencies = []
+    for _ in range( count ):
+        started = time.perf_counter()
+        request()
+        latencies.append( time.perf_counter() - started )
+
+    latencies.sort()
+    print( f"{ name:36} median { latencies[ count // 2 ] * 1e6:8.1f} us   "
+           f"p99 { latencies[ count * 99 // 100 ] * 1e6:8.1f} us" )
+    return
+
+
+def run( name, server, count ):
+    address = server.server_address
+    host, port = ( address, None ) if isinstance( address, str ) else address
+    thread = Thread( target = server.serve_forever )
+    thread.start()
+    request = IMessageRequest( action = 'status' )
+    try:
+        measure( f"{ name } connection per request",
+                 lambda: SimpleClient( host, port, bytes ).sendReceive( request ), count )
+        with PersistentClient( host, port, bytes ) as client:
+            measure( f"{ name } persistent", lambda: client.sendReceive( request ), count )
+
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+    return
+
+
+def main():
+    count = int( sys.argv[ 1 ] ) if len( sys.argv ) > 1 else 5000
+    processes = ProcessList( IConfiguration( version = 1, processes = [] ) )
+    dispatcher = RequestDispatcher( processes, FlagEvent() )
+    JsonHandler.dispatcher = dispatcher
+    JsonHandler.keepalive = 60.0
+    path = os.path.join( tempfile.mkdtemp(), 'osmon.sock' )
+    print( f"{ count } status requests" )
+    run( "threading tcp", JsonServer( ( 'localhost', 0 ), JsonHandler ), count )
+    run( "threading unix", UnixJsonServer( path, JsonHandler ), count )
+    run( "asyncio tcp", AsyncJsonServer( ( 'localhost', 0 ), dispatcher ), count )
+    run( "asyncio unix", AsyncJsonServer( path, dispatcher ), count )
+    os.rmdir( os.path.dirname( path ) )
+    processes.close()
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -25,7 +25,6 @@ setup(
         "License :: OSI Approved :: GNU General Public License v2 (GPLv2)",
         "Natural Language :: English",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
         "Programming Language :: Python :: 3.9",
         "Programming Language :: Python :: 3.10",
@@ -33,7 +32,7 @@ setup(
     keywords                        = "OSMON daemon process monitor",
     package_dir                     = { "": "src"},
     packages                        = find_packages( where = "src" ),
-    python_requires                 = ">=3.7, <4",
+    python_requires                 = ">=3.8, <4",
     entry_points = {
         "console_scripts": [
             "osmon=osmon.__main__:startup",
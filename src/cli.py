@@ -7,7 +7,7 @@ import typing as t
 import yaml
 from datetime import datetime
 
-from oscom.client import SimpleClient
+from oscom.client import PersistentClient, StatusTracker
 from osmon.common.interfaces import IMessageRequest, IMessageResponse
 
 
@@ -18,30 +18,66 @@ def usage():
     print( "Bla" )
 
 
+def attribute( process, name: str ):
+    """The attribute of the process, None when the process or the attribute was not received"""
+    return None if process is None else getattr( process, name )
+
+
+def cpu_usage( process ) -> t.Optional[ str ]:
+    cpu_num = attribute( process, 'cpu_num' )
+    cpu_percent = attribute( process, 'cpu_percent' )
+    if cpu_num is None and cpu_percent is None:
+        return None
+
+    cpu_num = '--' if cpu_num is None else f"{cpu_num:02d}"
+    cpu_percent = '' if cpu_percent is None else "{:3.2f}%".format( cpu_percent )
+    return f"{cpu_num} / {cpu_percent}"
+
+
+def percent( value: t.Optional[ float ] ) -> t.Optional[ str ]:
+    return None if value is None else "{:3.2f}%".format( value )
+
+
+def timestamp( value: t.Optional[ float ] ) -> t.Optional[ str ]:
+    return None if value is None else str( datetime.fromtimestamp( value ) )
+
+
+# Title, width and value of the columns of the tasks, a column without any value is left out
+TASK_COLUMNS = [
+    ( "Task",               20, lambda task: task.name ),
+    ( "PID",                7,  lambda task: attribute( task.process, 'pid' ) ),
+    ( "Start date & time",  26, lambda task: timestamp( attribute( task.process, 'create_time' ) ) ),
+    ( "Status",             12, lambda task: attribute( task.process, 'status' ) or task.status or None ),
+    ( "Cpu / usage",        12, lambda task: cpu_usage( task.process ) ),
+    ( "Memory",             7,  lambda task: percent( attribute( task.process, 'memory_percent' ) ) ),
+    ( "Working directory",  20, lambda task: attribute( task.process, 'cwd' ) ),
+]
+
+
 def dump_txt( data: IMessageResponse, stream: io.IOBase ):
     if data.osmon is not None:
-        # Do stats of the OSMON process itself
-        start_time = datetime.fromtimestamp( data.osmon.create_time )
-        cpu_percent = "{:3.2f}%".format( data.osmon.cpu_percent )
-        mem_percent = "{:3.2f}%".format( data.osmon.memory_percent )
-        print( "OSMON" )
-        print( f"  Start date & time: {start_time}" )
-        print( f"  Status:            {data.osmon.status}" )
-        print( f"  Cpu / usage:       {data.osmon.cpu_num:02d} / { cpu_percent }" )
-        print( f"  Memory usage:      {mem_percent}" )
-        print( f"  Working directory: {data.osmon.cwd}" )
-
-    print( "+----------------------+----------------------------+--------------+--------------*---------+--------------------+" )
-    print( "| Task                 | Start date & time          | Status       | Cpu / usage  | Memory  | Working directory   ")
-    print( "+----------------------+----------------------------+--------------+--------------*---------+--------------------+" )
-    #       | 12345678901234567890 | yyyy-mm-ddThh:mm:ss.ffffff | sleeping     | 99 / 99.99%  | 99.99%  | ....
-    for task in data.parameters:
-        prcs = task.process
-        start_time = datetime.fromtimestamp( prcs.create_time )
-        cpu_percent = "{:3.2f}%".format( prcs.cpu_percent )
-        mem_percent = "{:3.2f}%".format( prcs.memory_percent )
-        print( f"| {task.name:20} | {start_time} | {prcs.status:12} | {prcs.cpu_num:02d} / {cpu_percent:7} | {mem_percent:7} | {prcs.cwd}")
-        print( "+----------------------+----------------------------+--------------+--------------*---------+--------------------+" )
+        # Do stats of the OSMON process itself, a status with selected fields has only those
+        print( "OSMON", file = stream )
+        for title, value in ( ( "Start date & time", timestamp( data.osmon.create_time ) ),
+                              ( "Status",            data.osmon.status ),
+                              ( "Cpu / usage",       cpu_usage( data.osmon ) ),
+                              ( "Memory usage",      percent( data.osmon.memory_percent ) ),
+                              ( "Working directory", data.osmon.cwd ) ):
+            if value is not None:
+                print( f"  {title + ':':18} {value}", file = stream )
+
+    rows = [ [ value( task ) for _, _, value in TASK_COLUMNS ] for task in data.parameters ]
+    columns = [ idx for idx in range( len( TASK_COLUMNS ) )
+                if idx == 0 or any( row[ idx ] is not None for row in rows ) ]
+    line = "+" + "+".join( "-" * ( TASK_COLUMNS[ idx ][ 1 ] + 2 ) for idx in columns ) + "+"
+    print( line, file = stream )
+    print( "|" + "|".join( f" {TASK_COLUMNS[ idx ][ 0 ]:{TASK_COLUMNS[ idx ][ 1 ]}} " for idx in columns ) + "|",
+           file = stream )
+    print( line, file = stream )
+    for row in rows:
+        print( "|" + "|".join( f" {'' if row[ idx ] is None else row[ idx ]:{TASK_COLUMNS[ idx ][ 1 ]}} "
+                               for idx in columns ) + "|", file = stream )
+        print( line, file = stream )
 
     return
 
@@ -49,8 +85,10 @@ def dump_txt( data: IMessageResponse, stream: io.IOBase ):
 def main():
     logging.basicConfig( stream = sys.stdout, level = logging.WARNING )
     try:
-        opts, args = getopt.getopt( sys.argv[ 1: ], "ho:f:h:p:vr:", [ "help", "output=", "format=", "host=",
-                                                                      "port=", "repeat=" ] )
+        opts, args = getopt.getopt( sys.argv[ 1: ], "ho:f:h:p:vr:e:u:z", [ "help", "output=", "format=", "host=",
+                                                                           "port=", "repeat=", "encoding=",
+                                                                           "tasks=", "fields=", "no-osmon",
+                                                                           "unix=", "compress" ] )
 
     except getopt.GetoptError as err:
         # print help information and exit:
@@ -63,6 +101,10 @@ def main():
     output = sys.stdout
     fmt = 'txt'
     repeat = None
+    encoding = 'json'
+    compression = None
+    # Selection of the status, see RequestDispatcher.selection()
+    selection = {}
     verbose = False
     for o, a in opts:
         if o == "-v":
@@ -84,33 +126,79 @@ def main():
         elif o in ("-p", "--port"):
             port = int( a )
 
+        elif o in ("-z", "--compress"):
+            compression = 'zlib'
+
+        elif o in ("-u", "--unix"):
+            # Path of the unix socket of osmon, instead of TCP
+            host = a
+            port = None
+
         elif o in ("-r", "--repeat"):
             repeat = int( a )
 
+        elif o in ("-e", "--encoding"):
+            encoding = a
+
+        elif o == "--tasks":
+            selection[ 'tasks' ] = a.split( ',' )
+
+        elif o == "--fields":
+            selection[ 'fields' ] = a.split( ',' )
+
+        elif o == "--no-osmon":
+            selection[ 'osmon' ] = False
+
         else:
             assert False, "unhandled option"  # ...
 
+    # One connection for all commands and repeats
+    client = PersistentClient( host, port, IMessageResponse, encoding = encoding, compression = compression )
+    tracker = StatusTracker()
+
+    def dump_status( received: IMessageResponse ):
+        logging.info( received.model_dump_json( indent = 4 ) )
+        # The fields that were not asked for are left out
+        exclude_none = 'fields' in selection
+        if fmt == 'json':
+            print( received.model_dump_json( indent = 4, exclude_none = exclude_none ), file = output )
+
+        elif fmt == 'yaml':
+            fp = io.StringIO()
+            yaml.dump( received.model_dump( exclude_none = exclude_none ), fp )
+            print( fp.getvalue(), file = output )
+
+        elif fmt == 'txt':
+            dump_txt( received, output )
+
+        return
+
     def process_args():
         for cmd in args:
-            client = SimpleClient( host, port, IMessageResponse )
+            if cmd == 'watch':
+                # The status after every monitor sweep, pushed by the server until interrupted
+                for received in client.watch():
+                    dump_status( received )
+
+                continue
+
             if cmd not in ( 'status', 'stop', 'restart', 'reload' ):
                 logging.error( f"Error: { cmd } not supported" )
                 continue
 
-            data = IMessageRequest( action = cmd )
-            received: IMessageResponse = client.sendReceive( data )
-            if cmd == 'status':
-                logging.info( received.model_dump_json( indent = 4 ) )
-                if fmt == 'json':
-                    print( received.model_dump_json( indent = 4 ), file = output )
+            if cmd == 'status' and len( selection ) == 0:
+                # After the first status only the changes are transferred
+                received: IMessageResponse = client.status( tracker )
 
-                elif fmt == 'yaml':
-                    fp = io.StringIO()
-                    yaml.dump( received.model_dump(), fp )
-                    print( fp.getvalue(), file = output )
+            else:
+                data = IMessageRequest( action = cmd )
+                if cmd == 'status':
+                    data.parameters = selection
+
+                received = client.sendReceive( data )
 
-                elif fmt == 'txt':
-                    dump_txt( received, output )
+            if cmd == 'status':
+                dump_status( received )
 
             else:
                 logging.info( f"{ received.status }, { received.message }" )
@@ -123,6 +211,7 @@ def main():
             process_args()
             time.sleep( repeat )
 
+    client.close()
     return
 
 
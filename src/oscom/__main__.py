@@ -5,7 +5,7 @@ import pyparsing as pp
 import random
 from oscom.command import ( OpenCommand, CloseCommand, QuitCommand, HelpCommand, ShutdownCommand,
                             RestartCommand, ReloadCommand, AddCommand, SetCommand, ShowCommand,
-                            StoreCommand )
+                            StoreCommand, ShowMetricsCommand )
 from oscom.command.status import StatusCommand
 from oscom.prompt import Prompt
 
@@ -34,6 +34,7 @@ class Parser( object ):
         showVerb            = pp.one_of( "SHOW", caseless = True )
         storeVerb           = pp.one_of( "STORE", caseless = True )
         detailsVerb         = pp.one_of( "DETAILS", caseless = True )
+        metricsVerb         = pp.one_of( "METRICS", caseless = True )
         processVerb         = pp.one_of( "PROCESS", caseless = True )
         pidfileVerb         = pp.one_of( "PID PIDFILE", caseless = True )
         cwdVerb             = pp.one_of( "CWD WORKING-DIRECTORY", caseless = True )
@@ -92,8 +93,13 @@ class Parser( object ):
         #
         statusCommand       = statusVerb
         statusCommand.set_parse_action( StatusCommand )
+        #
+        #   SHOW METRICS
+        #
+        showMetricsCommand  = showVerb + metricsVerb
+        showMetricsCommand.set_parse_action( ShowMetricsCommand )
         commands = openCommand | closeCommand | shutdownCommand | restartCommand | statusCommand | \
-                   reloadCommand | helpCommand | quitCommand
+                   reloadCommand | showMetricsCommand | helpCommand | quitCommand
 
         if self.__experimental:
             #
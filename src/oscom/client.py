@@ -1,16 +1,35 @@
 import typing as t
 import socket
-from osmon.common.json_protocol import JsonProtocol
+import itertools
+from osmon.common.delta import patch
+from osmon.common.exc import ConnectionClosed
+from osmon.common.interfaces import IMessageRequest, IMessageResponse, ITaskProcessInfo
+from osmon.common.json_protocol import JsonProtocol, FrameReader, send_parts, CODECS, COMPRESSIONS
+
+
+# Requests that change the state of osmon, these are not sent again after the connection was lost
+CONTROL_ACTIONS = ( 'stop', 'restart', 'reload' )
+
+
+def address( host: str, port: t.Optional[ int ] ) -> t.Tuple[ int, t.Union[ str, t.Tuple[ str, int ] ] ]:
+    """The address family and address of the server, host is the path of a unix socket when port is None"""
+    if port is None:
+        return socket.AF_UNIX, host
+
+    return socket.AF_INET, ( host, port )
 
 
 class SimpleClient( JsonProtocol ):
-    def __init__( self, host: str, port: int, return_type: t.Optional[ t.Any ] = str ):
+    """Client that sends one request per connection. The host is the path of a unix socket when
+    the port is None"""
+    def __init__( self, host: str, port: t.Optional[ int ], return_type: t.Optional[ t.Any ] = str ):
         super().__init__( 2 )
         self._host = host
         self._port = port
         self.__return_type = return_type
         # Create a socket (SOCK_STREAM means a TCP socket)
-        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._family, self._address = address( host, port )
+        self._sock = socket.socket( self._family, socket.SOCK_STREAM )
         return
 
     def sendReceive( self, request, return_type: t.Optional[ t.Any ] = None ) -> t.Any:
@@ -20,11 +39,245 @@ class SimpleClient( JsonProtocol ):
                 return_type = self.__return_type
 
             # Connect to server and send data
-            self._sock.connect( ( self._host, self._port ) )
-            self.serialize( self._sock.send, request )
-            received = self.deserialize( self._sock.recv, return_type )
+            self._sock.connect( self._address )
+            send_parts( self._sock, self.parts( request ) )
+            received = self.decode( FrameReader( self._sock ).read( self ), return_type )
 
         finally:
             self._sock.close()
 
         return received
+
+
+class PersistentClient( JsonProtocol ):
+    """Client that keeps one connection open for many requests.
+
+    The connection is made on the first request and made again when it was lost, the requests
+    without a response on a connection that was already open are sent once more on a new connection;
+    unless one of them is a stop, restart or reload, that may have been carried out already.
+    Requests are numbered, pipeline() sends a batch of requests before reading the responses.
+    The encoding is asked for with hello, the server answers with json when it does not have it.
+    An osmon that does not know hello gets one connection per request, without stream and watch.
+    The host is the path of a unix socket when the port is None.
+    """
+    def __init__( self, host: str, port: t.Optional[ int ], return_type: t.Optional[ t.Any ] = IMessageResponse, header: int = 4,
+                  encoding: str = 'json', compression: t.Optional[ str ] = None ):
+        super().__init__( 2 )
+        if encoding not in CODECS:
+            raise ValueError( f"Encoding { encoding } not available, one of { CODECS }" )
+
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError( f"Compression { compression } not available, one of { COMPRESSIONS }" )
+
+        self._host = host
+        self._port = port
+        # Size of the length header agreed on with hello, 2 bytes limits a response to 64 kB
+        self._header = header
+        self._encoding = encoding
+        # Deflate the larger frames, for slow networks
+        self._compression_option = compression
+        self.__return_type = return_type
+        self._sock = None
+        self._reader = None
+        self._ids = itertools.count( 1 )
+        # The server does not know hello
+        self._legacy = False
+        return
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, exc_type, exc_val, exc_tb ):
+        self.close()
+        return
+
+    def _connect( self ):
+        family, server = address( self._host, self._port )
+        if family == socket.AF_INET:
+            self._sock = socket.create_connection( server )
+            self._sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+
+        else:
+            self._sock = socket.socket( family, socket.SOCK_STREAM )
+            self._sock.connect( server )
+
+        self._reader = FrameReader( self._sock )
+        # The hello itself goes with the default 2 byte header and json
+        JsonProtocol.__init__( self, 2 )
+        self.serialize( self._sock.sendall, IMessageRequest( action = 'hello',
+                                                             parameters = { 'persistent': True,
+                                                                            'header': self._header,
+                                                                            'encoding': self._encoding,
+                                                                            'compression': self._compression_option } ) )
+        response = self.decode( self._reader.read( self ), IMessageResponse )
+        if not response.status and response.options is None:
+            # An osmon from before hello, it closes the connection after every request
+            self.close()
+            self._legacy = True
+            return
+
+        if not response.status or not ( response.options or {} ).get( 'persistent' ):
+            self.close()
+            raise ConnectionError( f"Persistent connection refused: { response.message }" )
+
+        JsonProtocol.__init__( self, response.options.get( 'header', 2 ), response.options.get( 'encoding', 'json' ),
+                               response.options.get( 'compression' ) )
+        return
+
+    def close( self ):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            self._reader = None
+
+        return
+
+    def sendReceive( self, request: IMessageRequest, return_type: t.Optional[ t.Any ] = None ) -> t.Any:
+        return self.pipeline( [ request ], return_type )[ 0 ]
+
+    def pipeline( self, requests: t.List[ IMessageRequest ], return_type: t.Optional[ t.Any ] = None ) -> t.List[ t.Any ]:
+        """Send all requests in one write and read the responses, in the order of the requests"""
+        if return_type is None:
+            return_type = self.__return_type
+
+        responses = []
+        reconnect = self._sock is not None
+        while True:
+            pending = requests[ len( responses ): ]
+            sent = False
+            try:
+                if self._sock is None and not self._legacy:
+                    self._connect()
+
+                if self._legacy:
+                    return responses + [ self._single( request, return_type ) for request in pending ]
+
+                frames = []
+                for request in pending:
+                    self.serialize( frames.append, request.model_copy( update = { 'id': next( self._ids ) } ) )
+
+                sent = True
+                self._sock.sendall( b''.join( frames ) )
+                for _ in pending:
+                    responses.append( self.decode( self._reader.read( self ), return_type ) )
+
+                return responses
+
+            except ( OSError, ConnectionClosed ):
+                self.close()
+                if not reconnect or ( sent and any( request.action in CONTROL_ACTIONS
+                                                    for request in requests[ len( responses ): ] ) ):
+                    raise
+
+                # The server may have closed the idle connection, the requests without a response
+                # are sent once more on a new one
+                reconnect = False
+
+    def _single( self, request: IMessageRequest, return_type: t.Any ) -> t.Any:
+        """One request on a connection of its own, with the 2 byte header and json"""
+        family, server = address( self._host, self._port )
+        sock = socket.socket( family, socket.SOCK_STREAM )
+        try:
+            sock.connect( server )
+            JsonProtocol.__init__( self, 2 )
+            send_parts( sock, self.parts( request ) )
+            return self.decode( FrameReader( sock ).read( self ), return_type )
+
+        finally:
+            sock.close()
+
+    def stream( self, request: IMessageRequest ) -> t.Iterator[ t.Union[ IMessageResponse, ITaskProcessInfo ] ]:
+        """Status as a stream; the response without the tasks first, then the tasks one by one.
+        The stream must be read to the end before the next request"""
+        request = request.model_copy( update = { 'id': next( self._ids ),
+                                                 'parameters': { **( request.parameters or {} ), 'stream': True } } )
+        if self._sock is None and not self._legacy:
+            self._connect()
+
+        if self._legacy:
+            raise ConnectionError( "This osmon does not support a persistent connection" )
+
+        try:
+            self.serialize( self._sock.sendall, request )
+            yield self.decode( self._reader.read( self ), IMessageResponse )
+            while True:
+                data = self._reader.read( self )
+                if len( data ) == 0:
+                    break
+
+                yield self.decode( data, ITaskProcessInfo )
+
+        except BaseException:
+            # Closed halfway the stream, the rest of it can not be skipped
+            self.close()
+            raise
+
+        return
+
+    def status( self, tracker: 'StatusTracker' ) -> IMessageResponse:
+        """The status, only the changes since the status of tracker are transferred"""
+        parameters = {} if tracker.Generation is None else { 'generation': tracker.Generation }
+        return tracker.update( self.sendReceive( IMessageRequest( action = 'status', parameters = parameters ), dict ) )
+
+    def watch( self, keyframe: t.Optional[ int ] = None ) -> t.Iterator[ IMessageResponse ]:
+        """The status after every monitor sweep. The server pushes the full status now and then
+        and otherwise the changes, these are applied to the last status. The connection belongs to
+        the watch until the iterator is closed, then it is closed too"""
+        request = IMessageRequest( action = 'watch', id = next( self._ids ),
+                                   parameters = {} if keyframe is None else { 'keyframe': keyframe } )
+        if self._sock is None and not self._legacy:
+            self._connect()
+
+        if self._legacy:
+            raise ConnectionError( "This osmon does not support a persistent connection" )
+
+        tracker = StatusTracker()
+        try:
+            self.serialize( self._sock.sendall, request )
+            while True:
+                response = tracker.update( self.decode( self._reader.read( self ), dict ) )
+                yield response
+                if not response.status:
+                    break
+
+        finally:
+            self.close()
+
+        return
+
+
+class StatusTracker( object ):
+    """The last status of the server, kept up to date with the full status and the changes
+    the server sends. The changes are since the generation of the last status"""
+    def __init__( self ):
+        self._state         = None
+        self._generation    = None
+        return
+
+    @property
+    def Generation( self ) -> t.Optional[ int ]:
+        return self._generation
+
+    def update( self, data: dict ) -> IMessageResponse:
+        """The status after a response, decoded as dict"""
+        if not data.get( 'status' ):
+            return IMessageResponse.model_validate( data )
+
+        if data.get( 'delta' ) is None:
+            self._state = { 'osmon': data.get( 'osmon', {} ),
+                            'tasks': { task[ 'name' ]: task for task in data.get( 'parameters', [] ) } }
+
+        else:
+            delta = data[ 'delta' ]
+            previous = delta.pop( 'previous', None )
+            if previous != self._generation:
+                raise ValueError( f"Changes since generation { previous }, the status is of generation "
+                                  f"{ self._generation }" )
+
+            patch( self._state, delta )
+
+        self._generation = data.get( 'generation' )
+        return IMessageResponse( status = True, message = data.get( 'message', '' ), id = data.get( 'id' ),
+                                 generation = self._generation,
+                                 osmon = self._state[ 'osmon' ] or None,
+                                 parameters = list( self._state[ 'tasks' ].values() ) )
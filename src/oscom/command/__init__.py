@@ -1,5 +1,6 @@
 from oscom.command.add import AddCommand
 from oscom.command.close import CloseCommand
+from oscom.command.metrics import ShowMetricsCommand
 from oscom.command.open import OpenCommand
 from oscom.command.quit import QuitCommand
 from oscom.command.reload import ReloadCommand
@@ -11,4 +12,4 @@ from oscom.command.store import StoreCommand
 from oscom.command.help import HelpCommand
 
 __all__ = [ 'AddCommand', 'CloseCommand', 'OpenCommand', 'QuitCommand', 'ReloadCommand', 'RestartCommand',
-            'SetCommand', 'ShowCommand', 'ShutdownCommand', 'StoreCommand', 'HelpCommand' ]
\ No newline at end of file
+            'SetCommand', 'ShowCommand', 'ShowMetricsCommand', 'ShutdownCommand', 'StoreCommand', 'HelpCommand' ]
\ No newline at end of file
@@ -1,7 +1,7 @@
 import typing as t
 import pyparsing as pp
 import oscom.color as con
-from oscom.client import SimpleClient
+from oscom.client import PersistentClient
 from osmon.common.interfaces import IMessageResponse, IMessageRequest
 
 
@@ -42,8 +42,11 @@ class Command( object ):
             elif not isinstance( request, IMessageRequest ):
                 raise ValueError( 'request must be str or IMessageRequest')
 
-            client = SimpleClient( session.host, session.port, response_cls )
-            return client.sendReceive( request )
+            # Agrees on a 4 byte length header, the status of many tasks exceeds 64 kB, and
+            # on compression with a remote host
+            compression = None if session.host in ( 'localhost', '127.0.0.1', '::1' ) else 'zlib'
+            with PersistentClient( session.host, session.port, response_cls, compression = compression ) as client:
+                return client.sendReceive( request )
 
         self.print_error( con.BG_RED << con.FG_YELLOW_LIGHT << "Session not opened" << con.FG_WHITE << con.BG_BLACK )
         return
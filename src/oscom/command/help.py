@@ -1,6 +1,7 @@
 from oscom.command.add import AddCommand
 from oscom.command.base import Command
 from oscom.command.close import CloseCommand
+from oscom.command.metrics import ShowMetricsCommand
 from oscom.command.open import OpenCommand
 from oscom.command.quit import QuitCommand
 from oscom.command.reload import ReloadCommand
@@ -27,6 +28,7 @@ class HelpCommand( Command ):
             "RELOAD":   ReloadCommand,
             "RESTART":  RestartCommand,
             "SHUTDOWN": ShutdownCommand,
+            "METRICS":  ShowMetricsCommand,
             "QUIT":     QuitCommand,
             "HELP":     HelpCommand
         }
@@ -0,0 +1,65 @@
+from oscom.command.base import Command
+from osmon.common.interfaces import IMessageResponse
+
+
+class ShowMetricsCommand( Command ):
+    def __init__( self, quals ):
+        super().__init__( "SHOW METRICS", quals )
+        return
+
+    @staticmethod
+    def help_description() -> tuple:
+        return "SHOW METRICS", "Show the latency of the monitor sweep, requests and task starts of OSMON."
+
+    def _do_command( self, session ):
+        response = self._do_osmon_request( session, 'metrics' )
+        if not isinstance( response, IMessageResponse ):
+            return
+
+        if response.status:
+            print( "+----------------------+----------+------------+------------+------------+------------+------------+------------+" )
+            print( "| Path                 | Count    | Mean ms    | p50 ms     | p90 ms     | p99 ms     | p99.9 ms   | Max ms     |" )
+            print( "+----------------------+----------+------------+------------+------------+------------+------------+------------+" )
+            for name, latency in ( response.metrics or {} ).items():
+                print( f"| {name:20} | {latency.count:8} | {latency.mean * 1000:10.3f} | {latency.p50 * 1000:10.3f} | "
+                       f"{latency.p90 * 1000:10.3f} | {latency.p99 * 1000:10.3f} | {latency.p999 * 1000:10.3f} | "
+                       f"{latency.max * 1000:10.3f} |" )
+
+            print( "+----------------------+----------+------------+------------+------------+------------+------------+------------+" )
+
+        else:
+            self.print_warning( response.message )
+
+        return
+
+    @staticmethod
+    def detail_help( self ):
+        return """Request the latency histograms of the OSMON daemon.
+
+For every hot path of the OSMON daemon the number of times it ran since the start of the daemon, the
+mean, the percentiles and the maximum of its wall time in milliseconds. The percentiles are precise
+to about 6%.
+
+    sweep                   the monitor sweep over all tasks that are due
+    sweep.collector         sampling all due tasks at once by the batch collector
+    sweep.tree              the process trees of the tasks from the scan of /proc
+    task.monitor            sampling one task, without the batch collector
+    task.start              starting one task, up to its PID file
+    request.<action>        handling one request of the control protocol
+    request.status.stream   streaming the status, up to the last frame; a watch is not recorded
+    protocol.serialize      encoding and compressing one frame
+    protocol.deserialize    decompressing and decoding one frame
+
+Example:
+
+    >SHOW METRICS
+    +----------------------+----------+------------+------------+------------+------------+------------+------------+
+    | Path                 | Count    | Mean ms    | p50 ms     | p90 ms     | p99 ms     | p99.9 ms   | Max ms     |
+    +----------------------+----------+------------+------------+------------+------------+------------+------------+
+    | protocol.deserialize |      812 |      0.021 |      0.019 |      0.031 |      0.063 |      0.127 |      0.140 |
+    | protocol.serialize   |      812 |      0.009 |      0.008 |      0.012 |      0.031 |      0.047 |      0.052 |
+    | request.status       |      806 |      0.034 |      0.031 |      0.047 |      0.095 |      0.191 |      0.203 |
+    | sweep                |     5760 |      1.873 |      1.791 |      2.303 |      3.583 |      6.143 |      7.412 |
+    | sweep.collector      |     5760 |      1.412 |      1.343 |      1.727 |      2.815 |      4.863 |      5.904 |
+    | task.start           |       12 |     52.114 |     50.175 |     61.439 |     63.487 |     63.487 |     63.912 |
+    +----------------------+----------+------------+------------+------------+------------+------------+------------+"""
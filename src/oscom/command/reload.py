@@ -27,11 +27,13 @@ class ReloadCommand(Command):
     def detail_help( self ):
         return """Reload the OSMON daemon.
 
-On the reload of the OSMON daemon, the configuration is re-read and the process that 
-where already running are monitored again. New processes are started and monitored.
+On the reload of the OSMON daemon, the configuration is re-read and compared with the
+running configuration. Processes that did not change keep running and are monitored as
+before. New processes are started and monitored.
 
-{0}Note: when a process is removed from the configuration the process and it daemonized
-      is NOT killed, this needs to be done manually.{1}     
+{0}Note: when a process is removed from the configuration the process is stopped, a process
+      of which the program, arguments, pid-file, working directory, user or group changed
+      is restarted.{1}     
 
 Example:
 
@@ -44,6 +44,14 @@ class StatusCommand( Command ):
                 mem_percent = "{:3.2f}%".format( prcs.memory_percent )
                 print( f"| {task.name:20} | {start_time} | {prcs.status:12} | {prcs.cpu_num:02d} / {cpu_percent:7} | {mem_percent:7} | {prcs.cwd}" )
                 print( f"| {' '*20} | {str(elapsed_time):26} | {' '*12} | {' '*12} | {' '*7} |" )
+                tree = task.tree
+                if tree is not None:
+                    # The task with all its descendants
+                    processes = f"{tree.processes} processes"
+                    cpu_percent = "{:3.2f}%".format( tree.cpu_percent )
+                    rss = "{:.0f}M".format( tree.rss / 1048576 )
+                    print( f"| {' '*20} | {processes:26} | {' '*12} | {' '*4} {cpu_percent:7} | {rss:>7} | {tree.num_threads} threads, {tree.num_fds} files" )
+
                 print( "+----------------------+----------------------------+--------------+--------------*---------+--------------------+" )
 
         else:
@@ -57,7 +65,8 @@ class StatusCommand( Command ):
 
 It provides information about the OSMON daemon it self and the processes that are running under the OSMON daemon.
 Information provided are start time of the process / running time, its status, CPU and memory usage and the 
-current working directory of the process. 
+current working directory of the process. For a task that forks workers the totals of the task with all its
+processes follow; the number of processes, CPU usage, resident memory, threads and open files.
 
 Example:
 
@@ -73,4 +82,5 @@ Example:
     +----------------------+----------------------------+--------------+--------------*---------+--------------------+
     | TEST                 | 2024-12-15 16:56:35.550000 | sleeping     | 00 / 0.00%   | 0.06%   | /
     |                      | 14:42:21.846702            |              |              |         |
+    |                      | 5 processes                |              |      1.25%   |     84M | 9 threads, 31 files
     +----------------------+----------------------------+--------------+--------------*---------+--------------------+"""
\ No newline at end of file
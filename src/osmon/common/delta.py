@@ -0,0 +1,41 @@
+import typing as t
+
+
+__all__ = [ 'diff', 'patch' ]
+
+
+def diff( old: dict, new: dict ) -> dict:
+    """The entries of new that are not in old or differ from it, nested dicts are compared
+    entry by entry. An entry of old that is not in new is None in the result, the dicts are
+    dumped without None values so None only means removed"""
+    result = {}
+    for key, value in new.items():
+        previous = old.get( key )
+        if previous == value:
+            continue
+
+        if isinstance( value, dict ) and isinstance( previous, dict ):
+            result[ key ] = diff( previous, value )
+
+        else:
+            result[ key ] = value
+
+    for key in old.keys() - new.keys():
+        result[ key ] = None
+
+    return result
+
+
+def patch( state: dict, delta: t.Optional[ dict ] ) -> dict:
+    """Apply the result of diff() to state, in place"""
+    for key, value in ( delta or {} ).items():
+        if value is None:
+            state.pop( key, None )
+
+        elif isinstance( value, dict ) and isinstance( state.get( key ), dict ):
+            patch( state[ key ], value )
+
+        else:
+            state[ key ] = value
+
+    return state
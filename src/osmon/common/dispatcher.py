@@ -0,0 +1,365 @@
+import typing as t
+import os
+import time
+import queue
+import select
+import socket
+import logging
+from osmon.common.event import FlagEvent, STOP_EVENT, RESTART_EVENT, RELOAD_EVENT
+from osmon.common.exc import FrameTooLarge
+from osmon.common.interfaces import IMessageRequest, IMessageResponse, ITaskHistory
+from osmon.common.json_protocol import JsonProtocol, CODECS, COMPRESSIONS, MAX_REQUEST_FRAME
+from osmon.common.metrics import histogram, histograms
+from osmon.common.server import peer_credentials
+from osmon.common.snapshot import projection
+from osmon.common.watch import Watcher
+
+
+__all__ = [ 'RequestDispatcher' ]
+
+
+logger = logging.getLogger( 'OSMON' )
+
+
+class RequestDispatcher( object ):
+    """Handles the requests of the control protocol, shared by the control servers.
+
+    The session dict belongs to the connection and holds the options agreed on by hello,
+    and the user id of the peer of a unix socket. A response is a model, or bytes when it
+    was serialized in advance.
+    """
+    # Sizes of the length header that can be agreed on by hello
+    HEADER_SIZES = ( 2, 4, 8 )
+    # Frames pushed by watch between two full status frames
+    KEYFRAME = 30
+    # Seconds a threaded watch waits for a snapshot before it checks the client and the process list
+    WATCH_POLL = 5.0
+    # Selection of the complete status
+    ALL = { 'osmon': True, 'tasks': None, 'fields': None }
+
+    # Requests that change the state of osmon, over a unix socket only for the admins
+    CONTROL_ACTIONS = ( 'stop', 'restart', 'reload' )
+    # Requests with a latency histogram of their own, the others share one
+    ACTIONS = ( 'hello', 'stop', 'restart', 'reload', 'status', 'history', 'query', 'metrics' )
+
+    def __init__( self, processes, event: FlagEvent, admins: t.Iterable[ int ] = (), tcp_control: bool = True ):
+        self._processes     = processes
+        self._event         = event
+        # Root and the user of osmon itself are admins
+        self._admins        = { 0, os.getuid() if hasattr( os, 'getuid' ) else 0, *admins }
+        # Control requests over TCP, where the user is not known
+        self._tcp_control   = tcp_control
+        return
+
+    @staticmethod
+    def session( sock = None ) -> dict:
+        """Session of a new connection on sock, a request per connection with the 2 byte length header"""
+        session = { 'persistent': False, 'protocol': JsonProtocol( 2, limit = MAX_REQUEST_FRAME ), 'socket': sock }
+        if sock is not None and sock.family == getattr( socket, 'AF_UNIX', None ):
+            credentials = peer_credentials( sock )
+            session[ 'uid' ] = None if credentials is None else credentials[ 1 ]
+
+        return session
+
+    def authorized( self, text: IMessageRequest, session: dict ) -> bool:
+        """Over a unix socket the control requests are for the admins, the peer of a TCP
+        connection is not known; over TCP they are refused when tcp_control is off"""
+        if text.action not in self.CONTROL_ACTIONS:
+            return True
+
+        if 'uid' not in session:
+            return self._tcp_control
+
+        return session[ 'uid' ] in self._admins
+
+    def respond( self, text: IMessageRequest, session: dict ) -> t.Iterator[ t.List[ bytes ] ]:
+        """The frames of the response as header and data parts, with the framing of the session.
+        Options agreed on by hello apply from the next request on"""
+        protocol = session[ 'protocol' ]
+        if text.action == 'status' and ( text.parameters or {} ).get( 'stream' ):
+            yield from self._recorded( 'status.stream', self._stream( text, protocol ) )
+            return
+
+        if text.action == 'watch':
+            # Not recorded, a watch lasts until the connection is closed
+            yield from self._watch( text, session )
+            return
+
+        response = self.dispatch( text, session )
+        try:
+            yield protocol.parts( response )
+
+        except FrameTooLarge as exc:
+            logger.error( f"Response to { text.action }: { exc }" )
+            yield protocol.parts( IMessageResponse( status = False, id = text.id,
+                                                    message = f"{ exc }, agree on a larger header with hello "
+                                                              f"or request a stream" ) )
+
+        if text.action == 'hello' and response.status:
+            # A new deflate stream as well, the client starts one after the hello
+            session[ 'protocol' ] = JsonProtocol( session[ 'header' ], session[ 'codec' ], session[ 'compression' ],
+                                                  limit = MAX_REQUEST_FRAME )
+
+        return
+
+    @staticmethod
+    def selection( parameters: t.Optional[ dict ] ) -> dict:
+        """The selection of a status request, as keyword arguments of StatusSnapshot.encoded().
+        parameters: tasks, names or glob patterns of the tasks (default all tasks)
+                    fields, fields of the tasks and their processes (default all fields)
+                    osmon, False to leave out the status of osmon itself"""
+        parameters = parameters or {}
+        selection = { 'osmon': bool( parameters.get( 'osmon', True ) ) }
+        for name in ( 'tasks', 'fields' ):
+            value = parameters.get( name )
+            if isinstance( value, str ):
+                value = [ value ]
+
+            # Sorted, the same selection in another order is served from the same cache entry
+            selection[ name ] = None if value is None else tuple( sorted( set( value ) ) )
+
+        # Unknown fields are refused
+        projection( selection[ 'fields' ] )
+        return selection
+
+    def watcher( self, text: IMessageRequest, session: dict ) -> Watcher:
+        """The watcher of a watch request.
+        parameters: keyframe, frames between two full status frames"""
+        return Watcher( session[ 'protocol' ], text.id, ( text.parameters or {} ).get( 'keyframe', self.KEYFRAME ) )
+
+    @property
+    def Snapshot( self ):
+        """Status of the last monitor sweep"""
+        return self._processes.Snapshot
+
+    def subscribe( self, subscriber: t.Callable ):
+        self._processes.subscribe( subscriber )
+        return
+
+    def unsubscribe( self, subscriber: t.Callable ):
+        self._processes.unsubscribe( subscriber )
+        return
+
+    @staticmethod
+    def _recorded( action: str, frames: t.Iterator[ t.List[ bytes ] ] ) -> t.Iterator[ t.List[ bytes ] ]:
+        """The frames of a streamed response, its wall time up to the last frame is recorded when
+        the stream is complete; a stream the client did not read to the end is not recorded"""
+        started = time.perf_counter()
+        yield from frames
+        histogram( f"request.{ action }" ).record( time.perf_counter() - started )
+        return
+
+    def _stream( self, text: IMessageRequest, protocol: JsonProtocol ) -> t.Iterator[ t.List[ bytes ] ]:
+        """The status without the tasks, a frame per task and an empty frame as end"""
+        snapshot = self._processes.Snapshot
+        logger.info( f"Response: status stream of generation { snapshot.Generation }" )
+        try:
+            header, tasks, _ = snapshot.encoded( protocol, **self.selection( text.parameters ) )
+
+        except ValueError as exc:
+            yield protocol.parts( IMessageResponse( status = False, id = text.id, message = str( exc ) ) )
+            return
+
+        yield protocol.parts( protocol.with_id( header, text.id ) )
+        for task in tasks:
+            yield protocol.parts( task )
+
+        yield protocol.parts( b'' )
+        return
+
+    def _watch( self, text: IMessageRequest, session: dict ) -> t.Iterator[ t.List[ bytes ] ]:
+        """The frames pushed after every monitor sweep, until the connection is closed"""
+        logger.info( f"Watch: { text }" )
+        watcher = self.watcher( text, session )
+        updates = queue.Queue()
+        self.subscribe( updates.put )
+        try:
+            snapshot = self.Snapshot
+            while True:
+                try:
+                    parts = watcher.frame( snapshot )
+
+                except FrameTooLarge as exc:
+                    yield session[ 'protocol' ].parts( IMessageResponse( status = False, id = text.id,
+                                                                         message = f"{ exc }, agree on a larger "
+                                                                                   f"header with hello" ) )
+                    break
+
+                if parts is not None:
+                    yield parts
+
+                # Only the last snapshot when the connection was slow
+                snapshot = None
+                while snapshot is None:
+                    try:
+                        snapshot = updates.get( timeout = self.WATCH_POLL )
+
+                    except queue.Empty:
+                        if self._processes.Closed or self._disconnected( session.get( 'socket' ) ):
+                            # Replaced by a restart of osmon, or nobody to push to
+                            return
+
+                while not updates.empty():
+                    snapshot = updates.get_nowait()
+
+        finally:
+            self.unsubscribe( updates.put )
+
+        return
+
+    @staticmethod
+    def _disconnected( sock ) -> bool:
+        """The client of a watch closed the connection, it sends nothing after the watch request"""
+        if sock is None:
+            return False
+
+        try:
+            readable, _, _ = select.select( [ sock ], [], [], 0 )
+            return len( readable ) > 0 and sock.recv( 1, socket.MSG_PEEK ) == b''
+
+        except ( OSError, ValueError ):
+            return True
+
+    def dispatch( self, text: IMessageRequest, session: dict ) -> t.Union[ IMessageResponse, bytes ]:
+        started = time.perf_counter()
+        try:
+            return self._dispatch( text, session )
+
+        finally:
+            action = text.action if text.action in self.ACTIONS else 'other'
+            histogram( f"request.{ action }" ).record( time.perf_counter() - started )
+
+    def _dispatch( self, text: IMessageRequest, session: dict ) -> t.Union[ IMessageResponse, bytes ]:
+        try:
+            logger.info( f"Request: { text }" )
+            if text.action == 'hello':
+                # parameters: persistent, keep the connection open for more requests
+                #             header, size of the length header of the frames (2, 4 or 8)
+                #             encoding, codec of the frames, json or msgpack. The response tells
+                #             the codec that is used, json when the asked codec is not available
+                #             compression, zlib to deflate the larger frames, the response tells
+                #             the compression that is used
+                parameters = text.parameters or {}
+                header = parameters.get( 'header', session[ 'protocol' ].HeaderSize )
+                if header not in self.HEADER_SIZES:
+                    raise ValueError( f"Invalid header size { header }, one of { self.HEADER_SIZES }" )
+
+                codec = parameters.get( 'encoding', session[ 'protocol' ].Codec )
+                if codec not in CODECS:
+                    logger.warning( f"Codec { codec } not available, using json" )
+                    codec = 'json'
+
+                compression = parameters.get( 'compression' )
+                if compression is not None and compression not in COMPRESSIONS:
+                    logger.warning( f"Compression { compression } not available, not compressed" )
+                    compression = None
+
+                session[ 'persistent' ] = bool( parameters.get( 'persistent', False ) )
+                session[ 'header' ] = header
+                session[ 'codec' ] = codec
+                session[ 'compression' ] = compression
+                response = IMessageResponse( status = True, message = '',
+                                             options = { 'persistent': session[ 'persistent' ],
+                                                         'header': header,
+                                                         'encoding': codec,
+                                                         'compression': compression } )
+
+            elif not self.authorized( text, session ):
+                peer = f"of user { session[ 'uid' ] }" if 'uid' in session else "over TCP"
+                logger.warning( f"Request { text.action } { peer } refused" )
+                response = IMessageResponse( status = False, message = f"Not authorized to { text.action }" )
+
+            elif text.action == 'stop':
+                self._event.set( STOP_EVENT )
+                logger.warning( f"Stop requested" )
+                response = IMessageResponse( status = True, message = 'Stop requested' )
+
+            elif text.action == 'restart':
+                self._event.set( RESTART_EVENT )
+                logger.warning( f"Restart requested" )
+                response = IMessageResponse( status = True, message = 'Restart requested' )
+
+            elif text.action == 'reload':
+                self._event.set( RELOAD_EVENT )
+                logger.warning( f"Reload requested" )
+                response = IMessageResponse( status = True, message = 'Reload requested' )
+
+            elif text.action == 'status':
+                # Built and serialized by the monitor sweep, the snapshot is never changed so
+                # it is read without a lock
+                # parameters: the selection, see selection()
+                #             generation, the last generation the client has, the response is
+                #             not modified or the changes since that generation
+                snapshot = self._processes.Snapshot
+                protocol = session[ 'protocol' ]
+                selection = self.selection( text.parameters )
+                generation = ( text.parameters or {} ).get( 'generation' )
+                if generation == snapshot.Generation:
+                    logger.info( f"Response: status of generation { generation } not modified" )
+                    response = IMessageResponse( status = True, message = 'Not modified', generation = generation,
+                                                 delta = { 'previous': generation } )
+
+                else:
+                    # The changes of a selection are not kept, it gets the selected status
+                    previous = self._processes.recent( generation ) if selection == self.ALL else None
+                    if previous is not None:
+                        logger.info( f"Response: status changes of generation { generation } "
+                                     f"to { snapshot.Generation }" )
+                        snapshot.changes( previous )
+                        return protocol.with_id( snapshot.encodedDelta( protocol, generation ), text.id )
+
+                    logger.info( f"Response: status of generation { snapshot.Generation }" )
+                    return protocol.with_id( snapshot.encoded( protocol, **selection )[ 2 ], text.id )
+
+            elif text.action == 'history':
+                # parameters: name (optional, all tasks), start and end timestamps, points to downsample to
+                parameters = text.parameters or {}
+                response = IMessageResponse( status = True, message = '', history = [] )
+                for process in self._processes:
+                    if parameters.get( 'name' ) in ( None, process.Name ):
+                        response.history.append( ITaskHistory( name = process.Name,
+                                                               **process.History.window( parameters.get( 'start' ),
+                                                                                         parameters.get( 'end' ),
+                                                                                         parameters.get( 'points' ) ) ) )
+
+                if len( response.history ) == 0:
+                    response = IMessageResponse( status = False, message = f"Unknown task { parameters.get( 'name' ) }" )
+
+            elif text.action == 'query':
+                # Samples of the on-disk store, also of the tasks that were removed or ran before a restart of osmon
+                # parameters: name (optional, all tasks), start and end timestamps, resolution 1s, 1m or 1h
+                #             (optional, the finest resolution that holds start), points to downsample to
+                parameters = text.parameters or {}
+                store = self._processes.Store
+                if store is None:
+                    response = IMessageResponse( status = False, message = 'The metrics store is disabled' )
+
+                else:
+                    response = IMessageResponse( status = True, message = '', history = [] )
+                    for name in store.names():
+                        if parameters.get( 'name' ) in ( None, name ):
+                            response.history.append( ITaskHistory( name = name,
+                                                                   **store.query( name, parameters.get( 'start' ),
+                                                                                  parameters.get( 'end' ),
+                                                                                  parameters.get( 'resolution' ),
+                                                                                  parameters.get( 'points' ) ) ) )
+
+                    if len( response.history ) == 0:
+                        response = IMessageResponse( status = False, message = f"Unknown task { parameters.get( 'name' ) }" )
+
+            elif text.action == 'metrics':
+                # Latency of the hot paths of osmon since its start
+                response = IMessageResponse( status = True, message = '',
+                                             metrics = { item.Name: item.asDict() for item in histograms() } )
+
+            else:
+                logger.error( f"Unknown request: { text }")
+                response = IMessageResponse( status = False, message = 'Unknown request' )
+
+        except Exception as exc:
+            logger.exception( "During processing request" )
+            response = IMessageResponse( status = False, message = str( exc ) )
+
+        response.id = text.id
+        logger.info( f"Response: {response}" )
+        return response
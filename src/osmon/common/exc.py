@@ -4,4 +4,12 @@ class NotExecutable( Exception ):
 
 
 class ProcessNotFound( Exception ):
-    pass
\ No newline at end of file
+    pass
+
+
+class ConnectionClosed( Exception ):
+    pass
+
+
+class FrameTooLarge( ValueError ):
+    pass
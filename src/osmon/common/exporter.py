@@ -0,0 +1,169 @@
+import typing as t
+import logging
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from osmon.common.interfaces import IProcessInfo, ICgroupInfo, IProcessTreeInfo
+from osmon.common.snapshot import StatusSnapshot
+
+
+__all__ = [ 'MetricsExporter', 'MetricsServer' ]
+
+
+logger = logging.getLogger( 'OSMON.EXPORTER' )
+
+
+# Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape( value: str ) -> str:
+    return value.replace( '\\', '\\\\' ).replace( '"', '\\"' ).replace( '\n', '\\n' )
+
+
+class MetricsExporter( object ):
+    """Renders the status snapshot of the last sweep in the Prometheus text format.
+
+    The text is rendered on the first scrape of a snapshot and kept until the next sweep,
+    a scrape only reads the snapshot and never samples the processes.
+    """
+    def __init__( self, processes ):
+        self._processes = processes
+        self._cache     = ( None, b'' )
+        return
+
+    def render( self ) -> bytes:
+        snapshot = self._processes.Snapshot
+        generation, data = self._cache
+        if generation != snapshot.Generation:
+            data = self._render( snapshot, self._processes.SweepTime )
+            # Replaced in one assignment, two scrapes may render the same snapshot
+            self._cache = ( snapshot.Generation, data )
+
+        return data
+
+    @staticmethod
+    def _render( snapshot: StatusSnapshot, sweep_time: float ) -> bytes:
+        metrics = {}
+
+        def add( name: str, kind: str, description: str, labels: dict, value ):
+            if value is None:
+                return
+
+            if name not in metrics:
+                metrics[ name ] = [ f"# HELP { name } { description }", f"# TYPE { name } { kind }" ]
+
+            label = ','.join( f'{ key }="{ escape( str( item ) ) }"' for key, item in labels.items() )
+            metrics[ name ].append( f"{ name }{{{ label }}} { value }" if label else f"{ name } { value }" )
+            return
+
+        def process( prefix: str, labels: dict, info: IProcessInfo ):
+            if info.cpu_times is not None:
+                add( f"{ prefix }_cpu_seconds_total", 'counter', "CPU time of the process",
+                     { **labels, 'mode': 'user' }, info.cpu_times[ 0 ] )
+                add( f"{ prefix }_cpu_seconds_total", 'counter', "CPU time of the process",
+                     { **labels, 'mode': 'system' }, info.cpu_times[ 1 ] )
+
+            if info.memory_info is not None:
+                add( f"{ prefix }_resident_memory_bytes", 'gauge', "Resident memory of the process",
+                     labels, info.memory_info[ 0 ] )
+                add( f"{ prefix }_virtual_memory_bytes", 'gauge', "Virtual memory of the process",
+                     labels, info.memory_info[ 1 ] )
+
+            add( f"{ prefix }_threads", 'gauge', "Threads of the process", labels, info.num_threads )
+            add( f"{ prefix }_open_fds", 'gauge', "Open file descriptors of the process", labels, info.num_fds )
+            add( f"{ prefix }_start_time_seconds", 'gauge', "Start time of the process since the epoch",
+                 labels, info.create_time )
+            return
+
+        def cgroup( labels: dict, info: ICgroupInfo ):
+            add( 'osmon_task_cgroup_cpu_seconds_total', 'counter', "CPU time of all processes of the task",
+                 { **labels, 'mode': 'user' }, info.cpu_user )
+            add( 'osmon_task_cgroup_cpu_seconds_total', 'counter', "CPU time of all processes of the task",
+                 { **labels, 'mode': 'system' }, info.cpu_system )
+            add( 'osmon_task_cgroup_cpu_throttled_seconds_total', 'counter', "Time the task was throttled",
+                 labels, info.cpu_throttled )
+            add( 'osmon_task_cgroup_memory_bytes', 'gauge', "Memory of all processes of the task",
+                 labels, info.memory_current )
+            for event, value in ( info.memory_events or {} ).items():
+                add( 'osmon_task_cgroup_memory_events_total', 'counter', "Memory events of the cgroup of the task",
+                     { **labels, 'event': event }, value )
+
+            add( 'osmon_task_cgroup_io_bytes_total', 'counter', "Bytes read and written by the task",
+                 { **labels, 'direction': 'read' }, info.io_read_bytes )
+            add( 'osmon_task_cgroup_io_bytes_total', 'counter', "Bytes read and written by the task",
+                 { **labels, 'direction': 'write' }, info.io_write_bytes )
+            add( 'osmon_task_cgroup_io_operations_total', 'counter', "Read and write operations of the task",
+                 { **labels, 'direction': 'read' }, info.io_reads )
+            add( 'osmon_task_cgroup_io_operations_total', 'counter', "Read and write operations of the task",
+                 { **labels, 'direction': 'write' }, info.io_writes )
+            return
+
+        def tree( labels: dict, info: IProcessTreeInfo ):
+            add( 'osmon_task_tree_processes', 'gauge', "Processes of the task with its descendants",
+                 labels, info.processes )
+            add( 'osmon_task_tree_cpu_seconds_total', 'counter', "CPU time of the running processes of the task",
+                 { **labels, 'mode': 'user' }, info.cpu_user )
+            add( 'osmon_task_tree_cpu_seconds_total', 'counter', "CPU time of the running processes of the task",
+                 { **labels, 'mode': 'system' }, info.cpu_system )
+            add( 'osmon_task_tree_resident_memory_bytes', 'gauge', "Resident memory of the processes of the task",
+                 labels, info.rss )
+            add( 'osmon_task_tree_threads', 'gauge', "Threads of the processes of the task", labels, info.num_threads )
+            add( 'osmon_task_tree_open_fds', 'gauge', "Open file descriptors of the processes of the task",
+                 labels, info.num_fds )
+            return
+
+        response = snapshot.Response
+        add( 'osmon_sweep_duration_seconds', 'gauge', "Wall time of the last monitor sweep", {}, sweep_time )
+        add( 'osmon_snapshot_generation', 'gauge', "Generation of the status snapshot", {}, snapshot.Generation )
+        add( 'osmon_snapshot_timestamp_seconds', 'gauge', "Time the status snapshot was built", {},
+             snapshot.Timestamp )
+        if response.osmon is not None:
+            process( 'osmon_self', {}, response.osmon )
+
+        for task in response.parameters:
+            labels = { 'task': task.name }
+            add( 'osmon_task_up', 'gauge', "1 when the process of the task is running", labels,
+                 1 if task.process is not None else 0 )
+            add( 'osmon_task_restarts_total', 'counter', "Restarts of the task", labels, task.restarts or 0 )
+            if task.process is not None:
+                process( 'osmon_task', labels, task.process )
+
+            if task.cgroup is not None:
+                cgroup( labels, task.cgroup )
+
+            if task.tree is not None:
+                tree( labels, task.tree )
+
+        lines = [ line for lines in metrics.values() for line in lines ]
+        return ( '\n'.join( lines ) + '\n' ).encode( 'utf-8' )
+
+
+class MetricsHandler( BaseHTTPRequestHandler ):
+    exporter: MetricsExporter = None
+
+    def do_GET( self ):
+        if self.path.split( '?' )[ 0 ] != '/metrics':
+            self.send_error( 404 )
+            return
+
+        data = self.exporter.render()
+        self.send_response( 200 )
+        self.send_header( 'Content-Type', CONTENT_TYPE )
+        self.send_header( 'Content-Length', str( len( data ) ) )
+        self.end_headers()
+        self.wfile.write( data )
+        return
+
+    def log_message( self, format: str, *args: t.Any ):
+        logger.debug( format % args )
+        return
+
+
+class MetricsServer( ThreadingHTTPServer ):
+    """HTTP listener of the /metrics endpoint, with the interface of JsonServer"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__( self, server_address, processes ):
+        handler = type( 'Handler', ( MetricsHandler, ), { 'exporter': MetricsExporter( processes ) } )
+        ThreadingHTTPServer.__init__( self, server_address, handler )
+        return
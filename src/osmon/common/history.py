@@ -0,0 +1,120 @@
+import typing as t
+from array import array
+from threading import Lock
+
+
+__all__ = [ 'StatisticsHistory', 'STATUS_CODES' ]
+
+
+# Process status names as reported by psutil, stored in the history as their index
+STATUS_CODES = [ '?', 'running', 'sleeping', 'disk-sleep', 'stopped', 'tracing-stop', 'zombie', 'dead',
+                 'wake-kill', 'waking', 'idle', 'locked', 'waiting', 'suspended', 'parked' ]
+STATUS_INDEX = { name: idx for idx, name in enumerate( STATUS_CODES ) }
+
+
+class StatisticsHistory( object ):
+    """Fixed size ring buffer with the statistics samples of one task.
+
+    Every column is an array of a fixed type, a sample costs 45 bytes; 8 bytes each for
+    timestamp, user and system cpu time, rss and vms, 4 bytes cpu percentage and 1 byte
+    for the status code. The memory of the buffer is allocated once for size samples.
+    """
+    COLUMNS = ( ( 'timestamp',      'd' ),
+                ( 'user',           'd' ),
+                ( 'system',         'd' ),
+                ( 'cpu_percent',    'f' ),
+                ( 'rss',            'Q' ),
+                ( 'vms',            'Q' ),
+                ( 'status',         'B' ) )
+
+    def __init__( self, size: int ):
+        self._size      = max( 1, size )
+        self._index     = 0
+        self._count     = 0
+        self._lock      = Lock()
+        self._columns   = { name: array( code, bytes( array( code ).itemsize * self._size ) )
+                            for name, code in self.COLUMNS }
+        return
+
+    def __len__( self ):
+        return self._count
+
+    @property
+    def Size( self ) -> int:
+        return self._size
+
+    def append( self, timestamp: float, user: float, system: float, cpu_percent: float,
+                rss: float, vms: float, status: str ):
+        columns = self._columns
+        with self._lock:
+            idx = self._index
+            columns[ 'timestamp' ][ idx ]   = timestamp
+            columns[ 'user' ][ idx ]        = user
+            columns[ 'system' ][ idx ]      = system
+            columns[ 'cpu_percent' ][ idx ] = cpu_percent
+            columns[ 'rss' ][ idx ]         = int( rss )
+            columns[ 'vms' ][ idx ]         = int( vms )
+            columns[ 'status' ][ idx ]      = STATUS_INDEX.get( status, 0 )
+            self._index = ( idx + 1 ) % self._size
+            if self._count < self._size:
+                self._count += 1
+
+        return
+
+    def _ordered( self ) -> t.Dict[ str, array ]:
+        # Oldest sample first
+        first = ( self._index - self._count ) % self._size
+        result = {}
+        for name, column in self._columns.items():
+            if first + self._count <= self._size:
+                result[ name ] = column[ first: first + self._count ]
+
+            else:
+                result[ name ] = column[ first: ] + column[ : self._index ]
+
+        return result
+
+    def window( self, start: t.Optional[ float ] = None, end: t.Optional[ float ] = None,
+                points: t.Optional[ int ] = None ) -> t.Dict[ str, list ]:
+        """Samples between start and end (timestamps, inclusive), when points is given the
+        window is downsampled to at most that number of samples by averaging"""
+        with self._lock:
+            columns = self._ordered()
+
+        timestamps = columns[ 'timestamp' ]
+        first = 0
+        last = len( timestamps )
+        if start is not None:
+            while first < last and timestamps[ first ] < start:
+                first += 1
+
+        if end is not None:
+            while last > first and timestamps[ last - 1 ] > end:
+                last -= 1
+
+        result = { name: column[ first: last ].tolist() for name, column in columns.items() }
+        if points is not None and 0 < points < last - first:
+            result = self._downsample( result, points )
+
+        result[ 'status' ] = [ STATUS_CODES[ code ] for code in result[ 'status' ] ]
+        return result
+
+    @staticmethod
+    def _downsample( columns: t.Dict[ str, list ], points: int ) -> t.Dict[ str, list ]:
+        count = len( columns[ 'timestamp' ] )
+        result = { name: [] for name in columns }
+        for bucket in range( points ):
+            lower = bucket * count // points
+            upper = ( bucket + 1 ) * count // points
+            for name, column in columns.items():
+                if name == 'status':
+                    # The status at the end of the bucket
+                    result[ name ].append( column[ upper - 1 ] )
+
+                elif name in ( 'rss', 'vms' ):
+                    result[ name ].append( sum( column[ lower: upper ] ) // ( upper - lower ) )
+
+                else:
+                    result[ name ].append( sum( column[ lower: upper ] ) / ( upper - lower ) )
+
+        return result
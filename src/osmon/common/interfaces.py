@@ -1,5 +1,48 @@
 import typing as t
-from pydantic import BaseModel, Field, AliasChoices
+import re
+import socket
+from pydantic import BaseModel, Field, AliasChoices, model_validator, field_validator
+
+
+class ITaskReadiness( BaseModel ):
+    #                                                   all given conditions must hold before the task is ready,
+    #                                                   without conditions a task is ready when its PID file is written.
+    #                                                   The log condition is skipped for a process that was running
+    #                                                   already. Only the start of osmon and of a reload wait for the
+    #                                                   conditions, a restart after an exit does not
+    tcp_port:           t.Optional[ int ]           = Field( None, validation_alias = AliasChoices( 'tcp_port',
+                                                                                                    'tcp-port' ) )
+    tcp_host:           str                         = Field( 'localhost', validation_alias = AliasChoices( 'tcp_host',
+                                                                                                           'tcp-host' ) )
+    unix_socket:        t.Optional[ str ]           = Field( None, validation_alias = AliasChoices( 'unix_socket',
+                                                                                                    'unix-socket' ) )
+    #                                                   regular expression matched against the lines the task
+    #                                                   writes to log-file after it was started
+    log_file:           t.Optional[ str ]           = Field( None, validation_alias = AliasChoices( 'log_file',
+                                                                                                    'log-file' ) )
+    log_line:           t.Optional[ str ]           = Field( None, validation_alias = AliasChoices( 'log_line',
+                                                                                                    'log-line' ) )
+    #                                                   seconds to wait for the conditions
+    timeout:            float                       = Field( 30.0 )
+
+    @field_validator( 'log_line' )
+    @classmethod
+    def _log_line( cls, value: t.Optional[ str ] ):
+        if value is not None:
+            try:
+                re.compile( value )
+
+            except re.error as exc:
+                raise ValueError( f"Invalid log-line pattern: { exc }" )
+
+        return value
+
+    @model_validator( mode = 'after' )
+    def _log( self ):
+        if ( self.log_file is None ) != ( self.log_line is None ):
+            raise ValueError( "The log readiness condition needs both a log-file and a log-line" )
+
+        return self
 
 
 class ITaskConfig( BaseModel ):
@@ -13,6 +56,40 @@ class ITaskConfig( BaseModel ):
     #                                                   restart after 5 seconds
     restart_delay:      int                         = Field( 5, validation_alias = AliasChoices( 'restart_delay',
                                                                                                  'restart-delay' ) )
+    #                                                   the restart delay is multiplied by restart-backoff for every
+    #                                                   exit within the crash-loop window, up to restart-max-delay
+    restart_max_delay:  int                         = Field( 300, validation_alias = AliasChoices( 'restart_max_delay',
+                                                                                                   'restart-max-delay' ) )
+    restart_backoff:    float                       = Field( 2.0, validation_alias = AliasChoices( 'restart_backoff',
+                                                                                                   'restart-backoff' ) )
+    #                                                   random spread of the restart delay, fraction of the delay
+    restart_jitter:     float                       = Field( 0.1, validation_alias = AliasChoices( 'restart_jitter',
+                                                                                                   'restart-jitter' ) )
+    #                                                   more than crash-loop-exits exits within crash-loop-window
+    #                                                   seconds parks the task, it is not restarted anymore
+    crash_loop_exits:   int                         = Field( 5, validation_alias = AliasChoices( 'crash_loop_exits',
+                                                                                                 'crash-loop-exits' ) )
+    crash_loop_window:  int                         = Field( 300, validation_alias = AliasChoices( 'crash_loop_window',
+                                                                                                   'crash-loop-window' ) )
+    #                                                   number of statistics samples kept in memory
+    history_size:       int                         = Field( 360, validation_alias = AliasChoices( 'history_size',
+                                                                                                   'history-size' ) )
+    #                                                   sampling interval range, the sampling is tightened to the
+    #                                                   minimum on changes and backs off to the maximum while stable.
+    #                                                   Both default to the monitor-interval
+    min_interval:       t.Optional[ float ]         = Field( None, validation_alias = AliasChoices( 'min_interval',
+                                                                                                    'min-interval' ) )
+    max_interval:       t.Optional[ float ]         = Field( None, validation_alias = AliasChoices( 'max_interval',
+                                                                                                    'max-interval' ) )
+    #                                                   names of the tasks that must be ready before this task
+    #                                                   is started
+    depends_on:         t.List[ str ]               = Field( [], validation_alias = AliasChoices( 'depends_on',
+                                                                                                  'depends-on' ) )
+    ready:              t.Optional[ ITaskReadiness ] = Field( None )
+    #                                                   cgroup v2 directory the task is started in, the resource usage
+    #                                                   of all its processes is read from it (Linux). Defaults to
+    #                                                   <cgroup-root>/<name> when cgroup-root is set
+    cgroup:             t.Optional[ str ]           = Field( None )
 
 
 class IConfiguration( BaseModel ):
@@ -20,6 +97,67 @@ class IConfiguration( BaseModel ):
     #                                               # Default every 30 seconds check the processes
     monitor_interval:   int                         = Field( 30, validation_alias = AliasChoices( 'monitor_interval',
                                                                                                   'monitor-interval' ) )
+    #                                               # Number of worker threads for the monitor sweep
+    monitor_workers:    int                         = Field( 8, validation_alias = AliasChoices( 'monitor_workers',
+                                                                                                 'monitor-workers' ) )
+    #                                               # Seconds one task may take in the monitor sweep
+    monitor_deadline:   float                       = Field( 5.0, validation_alias = AliasChoices( 'monitor_deadline',
+                                                                                                   'monitor-deadline' ) )
+    #                                               # Number of tasks that are started at the same time
+    start_concurrency:  int                         = Field( 8, validation_alias = AliasChoices( 'start_concurrency',
+                                                                                                 'start-concurrency' ) )
+    #                                               # Collect the statistics of all tasks in one pass over /proc (Linux)
+    batch_collector:    bool                        = Field( True, validation_alias = AliasChoices( 'batch_collector',
+                                                                                                    'batch-collector' ) )
+    #                                               # Track the descendants of the tasks without cgroup, in one scan
+    #                                               # of /proc per sweep for all tasks (Linux)
+    process_tree:       bool                        = Field( True, validation_alias = AliasChoices( 'process_tree',
+                                                                                                    'process-tree' ) )
+    #                                               # Directory of the on-disk metrics store, the samples of the tasks
+    #                                               # survive a restart of osmon. None disables the store
+    store_dir:          t.Optional[ str ]           = Field( None, validation_alias = AliasChoices( 'store_dir',
+                                                                                                  'store-dir' ) )
+    #                                               # Seconds the samples are kept per resolution, a resolution
+    #                                               # that is left out is not stored
+    store_retention:    t.Dict[ t.Literal[ '1s', '1m', '1h' ], int ] = Field( { '1s': 86400, '1m': 2592000, '1h': 31536000 },
+                                                                              validation_alias = AliasChoices( 'store_retention',
+                                                                                                               'store-retention' ) )
+    #                                               # Control server, 'threading' (a thread per connection)
+    #                                               # or 'asyncio' (all connections on one event loop)
+    control_server:     t.Literal[ 'threading', 'asyncio' ] = Field( 'threading',
+                                                                     validation_alias = AliasChoices( 'control_server',
+                                                                                                      'control-server' ) )
+    #                                               # Maximum number of open connections (asyncio)
+    control_connections: int                        = Field( 100, validation_alias = AliasChoices( 'control_connections',
+                                                                                                   'control-connections' ) )
+    #                                               # Seconds an idle persistent connection is kept open
+    control_keepalive:  float                       = Field( 60.0, validation_alias = AliasChoices( 'control_keepalive',
+                                                                                                    'control-keepalive' ) )
+    #                                               # TCP listener of the control server, no port disables it
+    control_host:       str                         = Field( 'localhost', validation_alias = AliasChoices( 'control_host',
+                                                                                                           'control-host' ) )
+    control_port:       t.Optional[ int ]           = Field( 5678, validation_alias = AliasChoices( 'control_port',
+                                                                                                    'control-port' ) )
+    #                                               # Unix socket of the control server (not on Windows)
+    control_socket:     t.Optional[ str ]           = Field( None, validation_alias = AliasChoices( 'control_socket',
+                                                                                                    'control-socket' ) )
+    #                                               # File mode of the unix socket
+    control_socket_mode: int                        = Field( 0o666, validation_alias = AliasChoices( 'control_socket_mode',
+                                                                                                     'control-socket-mode' ) )
+    #                                               # User ids that may stop, restart and reload over the unix socket,
+    #                                               # besides root and the user of osmon. Over TCP the user is not known,
+    #                                               # with a control-socket these requests are refused over TCP
+    control_admins:     t.List[ int ]               = Field( [], validation_alias = AliasChoices( 'control_admins',
+                                                                                                  'control-admins' ) )
+    #                                               # HTTP listener of the Prometheus /metrics endpoint, no port disables it
+    metrics_host:       str                         = Field( 'localhost', validation_alias = AliasChoices( 'metrics_host',
+                                                                                                           'metrics-host' ) )
+    metrics_port:       t.Optional[ int ]           = Field( None, validation_alias = AliasChoices( 'metrics_port',
+                                                                                                    'metrics-port' ) )
+    #                                               # cgroup v2 directory under which every task gets its own cgroup,
+    #                                               # for example /sys/fs/cgroup/osmon (Linux). None disables it
+    cgroup_root:        t.Optional[ str ]           = Field( None, validation_alias = AliasChoices( 'cgroup_root',
+                                                                                                    'cgroup-root' ) )
     #                                               # Default log level is WARNING
     trace_level:        str                         = Field( "WARNING", validation_alias = AliasChoices( 'trace_level',
                                                                                                          'trace-level' ) )
@@ -32,6 +170,70 @@ class IConfiguration( BaseModel ):
     cwd:                str                         = Field( None )
     processes:          t.List[ ITaskConfig ]
 
+    @model_validator( mode = 'after' )
+    def _sampling_intervals( self ):
+        for task in self.processes:
+            if task.max_interval is None:
+                task.max_interval = max( self.monitor_interval, task.min_interval or 0 )
+
+            if task.min_interval is None:
+                task.min_interval = min( self.monitor_interval, task.max_interval )
+
+            if task.min_interval <= 0:
+                raise ValueError( f"Task { task.name } needs a min-interval above 0, not { task.min_interval }" )
+
+            if task.min_interval > task.max_interval:
+                raise ValueError( f"Task { task.name } has a min-interval of { task.min_interval } above "
+                                  f"its max-interval of { task.max_interval }" )
+
+        return self
+
+    @model_validator( mode = 'after' )
+    def _cgroups( self ):
+        if self.cgroup_root is not None:
+            for task in self.processes:
+                if task.cgroup is None:
+                    task.cgroup = f"{ self.cgroup_root.rstrip( '/' ) }/{ task.name }"
+
+        return self
+
+    @model_validator( mode = 'after' )
+    def _control( self ):
+        if self.control_port is None and self.control_socket is None:
+            raise ValueError( "The control server needs a control-port or a control-socket" )
+
+        if self.control_socket is not None and not hasattr( socket, 'AF_UNIX' ):
+            raise ValueError( "control-socket is not available on this platform, use control-port" )
+
+        return self
+
+    @model_validator( mode = 'after' )
+    def _dependencies( self ):
+        names = { task.name: task for task in self.processes }
+        for task in self.processes:
+            for name in task.depends_on:
+                if name not in names:
+                    raise ValueError( f"Task { task.name } depends on unknown task { name }" )
+
+        # Depth first search, a task that is reached again while it is on the path closes a cycle
+        visited = set()
+        def visit( task: ITaskConfig, path: t.List[ str ] ):
+            if task.name in path:
+                raise ValueError( f"Dependency cycle { ' -> '.join( path[ path.index( task.name ): ] + [ task.name ] ) }" )
+
+            if task.name not in visited:
+                for name in task.depends_on:
+                    visit( names[ name ], path + [ task.name ] )
+
+                visited.add( task.name )
+
+            return
+
+        for task in self.processes:
+            visit( task, [] )
+
+        return self
+
 
 class IProcessCpuTimes( BaseModel ):
     user:               float
@@ -74,35 +276,96 @@ class IProcessStatistics( BaseModel ):
 class IMessageRequest( BaseModel ):
     action:             str
     parameters:         dict                        = Field( None )
+    #                                               # Echoed in the response, to match pipelined responses
+    id:                 t.Optional[ int ]           = Field( None )
 
 
 class IProcessInfo( BaseModel ):
-    cmdline:            t.List[ str ]
-    cpu_num:            int
-    cpu_percent:        float
-    cpu_times:          t.List[ float ]
-    create_time:        float
-    cwd:                str
-    environ:            dict
-    exe:                str
-    memory_info:        t.List[ int ]
-    memory_percent:     float
-    name:               str
-    num_ctx_switches:   t.List[ int ]
-    num_fds:            int
-    num_threads:        int
-    pid:                int
-    ppid:               int
-    status:             str
+    # All fields are optional, a status request may ask for some of them
+    cmdline:            t.List[ str ]               = Field( None )
+    cpu_num:            int                         = Field( None )
+    cpu_percent:        float                       = Field( None )
+    cpu_times:          t.List[ float ]             = Field( None )
+    create_time:        float                       = Field( None )
+    cwd:                str                         = Field( None )
+    environ:            dict                        = Field( None )
+    exe:                str                         = Field( None )
+    memory_info:        t.List[ int ]               = Field( None )
+    memory_percent:     float                       = Field( None )
+    name:               str                         = Field( None )
+    num_ctx_switches:   t.List[ int ]               = Field( None )
+    num_fds:            int                         = Field( None )
+    num_threads:        int                         = Field( None )
+    pid:                int                         = Field( None )
+    ppid:               int                         = Field( None )
+    status:             str                         = Field( None )
     terminal:           t.Union[ str, None ]        = Field( None )
-    username:           str
+    username:           str                         = Field( None )
+
+
+class ICgroupInfo( BaseModel ):
+    # Resource usage of all processes in the cgroup of a task, the fields of
+    # a controller that is not enabled for the cgroup are None
+    cpu_usage:          float                       = Field( None )
+    cpu_user:           float                       = Field( None )
+    cpu_system:         float                       = Field( None )
+    cpu_throttled:      float                       = Field( None )
+    memory_current:     int                         = Field( None )
+    #                                               # low, high, max, oom and oom_kill counters
+    memory_events:      t.Dict[ str, int ]          = Field( None )
+    io_read_bytes:      int                         = Field( None )
+    io_write_bytes:     int                         = Field( None )
+    io_reads:           int                         = Field( None )
+    io_writes:          int                         = Field( None )
+
+
+class IProcessTreeInfo( BaseModel ):
+    # Totals of the main process of a task and all its descendants
+    processes:          int                         = Field( None )
+    cpu_percent:        float                       = Field( None )
+    cpu_user:           float                       = Field( None )
+    cpu_system:         float                       = Field( None )
+    rss:                int                         = Field( None )
+    num_threads:        int                         = Field( None )
+    num_fds:            int                         = Field( None )
 
 
 class ITaskProcessInfo( BaseModel ):
     name:               str
-    pid:                str
+    #                                               # Path of the PID file, the PID is process.pid; the key is
+    #                                               # kept for the clients that read it, select it as pidfile
+    pid:                str                         = Field( None )
     status:             str                         = Field( '' )
+    restarts:           int                         = Field( None )
     process:            IProcessInfo                = Field( None )
+    #                                               # The whole process tree, when the task runs in a cgroup
+    cgroup:             ICgroupInfo                 = Field( None )
+    #                                               # The whole process tree, when the task runs without cgroup
+    tree:               IProcessTreeInfo            = Field( None )
+
+
+class ITaskHistory( BaseModel ):
+    name:               str
+    timestamp:          t.List[ float ]             = Field( [] )
+    user:               t.List[ float ]             = Field( [] )
+    system:             t.List[ float ]             = Field( [] )
+    cpu_percent:        t.List[ float ]             = Field( [] )
+    rss:                t.List[ int ]               = Field( [] )
+    vms:                t.List[ int ]               = Field( [] )
+    status:             t.List[ str ]               = Field( [] )
+
+
+class ILatencyInfo( BaseModel ):
+    # Wall time in seconds of a hot path of osmon, from its histogram
+    count:              int
+    total:              float
+    min:                float
+    max:                float
+    mean:               float
+    p50:                float
+    p90:                float
+    p99:                float
+    p999:               float
 
 
 class IMessageResponse( BaseModel ):
@@ -110,3 +373,13 @@ class IMessageResponse( BaseModel ):
     message:            str
     osmon:              IProcessInfo                = Field( None )
     parameters:         t.List[ ITaskProcessInfo ]  = Field( [] )
+    history:            t.List[ ITaskHistory ]      = Field( None )
+    #                                               # Monitor sweep the status belongs to
+    generation:         int                         = Field( None )
+    id:                 t.Optional[ int ]           = Field( None )
+    #                                               # Connection options agreed on by hello
+    options:            dict                        = Field( None )
+    #                                               # Changes since the previous generation, pushed by watch
+    delta:              dict                        = Field( None )
+    #                                               # Latency histograms by name, of the metrics request
+    metrics:            t.Dict[ str, ILatencyInfo ] = Field( None )
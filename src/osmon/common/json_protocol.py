@@ -1,11 +1,55 @@
 import typing as t
 import struct
+import zlib
 from pydantic import BaseModel
 import json
+from osmon.common.exc import ConnectionClosed, FrameTooLarge
+from osmon.common.metrics import timed
+try:
+    import msgpack
+
+except ImportError:
+    # Optional, without it only JSON is available
+    msgpack = None
+
+
+# Codecs of the frames that can be agreed on, JSON is the default
+CODECS = ( 'json', 'msgpack' ) if msgpack is not None else ( 'json', )
+# Compression of the frames that can be agreed on, default none
+COMPRESSIONS = ( 'zlib', )
+# Frames smaller than this are not compressed
+COMPRESS_THRESHOLD = 1024
+COMPRESS_LEVEL = 6
+# Flag byte in front of the payload when compression is agreed on
+PLAIN = b'\x00'
+DEFLATED = b'\x01'
+# Largest request payload osmon accepts, also after inflating; a larger frame closes the connection
+MAX_REQUEST_FRAME = 1 << 20
 
 
 class JsonProtocol( object ):
-    def __init__( self, size: int = 2 ):
+    """Framing and serialization of the control protocol.
+
+    With compression every non-empty payload starts with a flag byte, the payloads from the
+    threshold size on are deflated. The frames of a connection are one deflate stream in each
+    direction, flushed at the end of every frame, so a frame refers to the data of the frames
+    before it. The frames must be decoded in the order they were sent. With a limit a frame that
+    inflates to more than limit bytes raises FrameTooLarge.
+    """
+    def __init__( self, size: int = 2, codec: str = 'json', compression: t.Optional[ str ] = None,
+                  threshold: int = COMPRESS_THRESHOLD, limit: t.Optional[ int ] = None ):
+        if codec not in CODECS:
+            raise ValueError( f"Codec { codec } not available, one of { CODECS }" )
+
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError( f"Compression { compression } not available, one of { COMPRESSIONS }" )
+
+        self._codec = codec
+        self._compression = compression
+        self._threshold = threshold
+        self._limit = limit
+        self._compressor = zlib.compressobj( COMPRESS_LEVEL ) if compression is not None else None
+        self._decompressor = zlib.decompressobj() if compression is not None else None
         if size <= 2:
             self._format = ">H"
             self.__size = 2
@@ -20,31 +64,253 @@ class JsonProtocol( object ):
 
         return
 
-    def serialize( self, writer: t.Callable, data: t.Union[ str, bytes, dict, BaseModel ], encoding: str = 'u8' ) -> int:
-        if isinstance( data, BaseModel ):
-            data = data.model_dump_json( exclude_none = True )
+    @property
+    def HeaderSize( self ) -> int:
+        return self.__size
+
+    @property
+    def Codec( self ) -> str:
+        return self._codec
+
+    @property
+    def Compression( self ) -> t.Optional[ str ]:
+        return self._compression
+
+    def encode( self, data: t.Union[ str, bytes, dict, BaseModel ], encoding: str = 'u8', **kwargs ) -> bytes:
+        """Serialize with the codec, bytes are taken as serialized already. The keyword arguments
+        go to the model dump"""
+        if self._codec == 'msgpack':
+            if isinstance( data, BaseModel ):
+                data = data.model_dump( mode = 'json', exclude_none = True, **kwargs )
 
-        if isinstance( data, dict ):
-            data = json.dumps( data )
+            if isinstance( data, dict ):
+                data = msgpack.packb( data )
+
+        else:
+            if isinstance( data, BaseModel ):
+                data = data.model_dump_json( exclude_none = True, **kwargs )
+
+            if isinstance( data, dict ):
+                data = json.dumps( data )
 
         if isinstance( data, str ):
             data = bytes( data, encoding )
 
-        length = len( data )
-        return writer( struct.pack( self._format, length) + data )
+        return data
+
+    def with_id( self, data: bytes, id: t.Optional[ int ] ) -> bytes:
+        """Add the request id to a serialized response, without serializing it again"""
+        if id is None:
+            return data
+
+        if self._codec == 'msgpack':
+            # One more entry in the map header, the id entry goes in front of the others
+            if data[ 0 ] < 0x8f:
+                return bytes( [ data[ 0 ] + 1 ] ) + msgpack.packb( 'id' ) + msgpack.packb( id ) + data[ 1: ]
+
+            return msgpack.packb( { 'id': id, **msgpack.unpackb( data ) } )
+
+        return b'{"id":' + str( id ).encode() + b',' + data[ 1: ]
+
+    def join( self, header: bytes, parameters: t.List[ bytes ] ) -> bytes:
+        """The serialized header response with the serialized parameters added, without serializing again"""
+        if self._codec == 'msgpack':
+            count = len( parameters )
+            if count < 16:
+                array = bytes( [ 0x90 + count ] )
+
+            elif count < 1 << 16:
+                array = b'\xdc' + struct.pack( '>H', count )
+
+            else:
+                array = b'\xdd' + struct.pack( '>I', count )
+
+            if header[ 0 ] < 0x8f:
+                return bytes( [ header[ 0 ] + 1 ] ) + header[ 1: ] + msgpack.packb( 'parameters' ) + array + b''.join( parameters )
+
+            return msgpack.packb( { **msgpack.unpackb( header ),
+                                    'parameters': [ msgpack.unpackb( item ) for item in parameters ] } )
+
+        return header[ :-1 ] + b',"parameters":[' + b','.join( parameters ) + b']}'
+
+    @timed( 'protocol.serialize' )
+    def parts( self, data: t.Union[ str, bytes, dict, BaseModel ], encoding: str = 'u8' ) -> t.List[ bytes ]:
+        """The length header and the data, to be written without joining them"""
+        data = self.encode( data, encoding )
+        compressor = None
+        if self._compression is None or len( data ) == 0:
+            parts = [ data ]
+
+        elif len( data ) < self._threshold:
+            parts = [ PLAIN, data ]
+
+        else:
+            # On a copy, the stream only continues with the frames that are sent
+            compressor = self._compressor.copy()
+            parts = [ DEFLATED, compressor.compress( data ) + compressor.flush( zlib.Z_SYNC_FLUSH ) ]
+
+        length = sum( len( part ) for part in parts )
+        if length >= 1 << ( 8 * self.__size ):
+            raise FrameTooLarge( f"Frame of { length } bytes does not fit a { self.__size } byte length header" )
+
+        if compressor is not None:
+            self._compressor = compressor
+
+        return [ struct.pack( self._format, length ), *parts ]
+
+    def inflate( self, data: t.Union[ bytes, memoryview ] ) -> t.Union[ bytes, memoryview ]:
+        """The payload without the flag byte, inflated when it was deflated"""
+        if self._compression is None or len( data ) == 0:
+            return data
+
+        if data[ :1 ] == DEFLATED:
+            # Never much more than the limit in memory, a max_length of 0 is unlimited
+            result = self._decompressor.decompress( data[ 1: ], 0 if self._limit is None else self._limit + 1 )
+            if self._decompressor.unconsumed_tail or ( self._limit is not None and len( result ) > self._limit ):
+                raise FrameTooLarge( f"Frame inflates to more than the maximum of { self._limit } bytes" )
+
+            return result
+
+        return data[ 1: ]
+
+    def frame( self, data: t.Union[ str, bytes, dict, BaseModel ], encoding: str = 'u8' ) -> bytes:
+        """The data with the length header"""
+        return b''.join( self.parts( data, encoding ) )
+
+    def length( self, header: bytes, limit: t.Optional[ int ] = None ) -> int:
+        """The length of the payload from the header, a payload larger than limit is refused
+        before it is received"""
+        if len( header ) == 0:
+            raise ConnectionClosed()
+
+        length = struct.unpack( self._format, header )[ 0 ]
+        if limit is not None and length > limit:
+            raise FrameTooLarge( f"Frame of { length } bytes exceeds the maximum of { limit } bytes" )
+
+        return length
+
+    @timed( 'protocol.deserialize' )
+    def decode( self, data: t.Union[ bytes, memoryview ], return_type, encoding: str = 'u8' ) -> t.Union[ str, bytes, dict, BaseModel ]:
+        data = self.inflate( data )
+        if return_type is not bytes and self._codec == 'msgpack':
+            data = msgpack.unpackb( data )
+            if return_type is dict:
+                return data
+
+            return return_type.model_validate( data )
+
+        if isinstance( data, memoryview ):
+            # Neither pydantic nor json parse a memoryview, this is the one copy of the frame
+            data = data.tobytes()
 
-    def deserialize( self, reader: t.Callable, return_type, encoding: str = 'u8' ) -> t.Union[ str, bytes, dict, BaseModel ]:
-        data = reader( self.__size )
-        length = struct.unpack( self._format, data )[ 0 ]
-        data = reader( length )  # clip input at 1Kb
         if return_type is bytes:
             return data
 
+        if issubclass( return_type, BaseModel ):
+            # Parsed from the bytes, without decoding to str first
+            return return_type.model_validate_json( data )
+
         data = data.decode( encoding )
         if return_type is dict:
             return json.loads( data )
 
-        if issubclass( return_type, BaseModel ):
-            data = return_type.model_validate_json( data )
+        return data
+
+    def serialize( self, writer: t.Callable, data: t.Union[ str, bytes, dict, BaseModel ], encoding: str = 'u8' ) -> int:
+        return writer( self.frame( data, encoding ) )
+
+    @staticmethod
+    def read( reader: t.Callable, size: int ) -> bytes:
+        """Exactly size bytes, a socket may return less than asked for"""
+        data = reader( size ) if size > 0 else b''
+        while 0 < len( data ) < size:
+            chunk = reader( size - len( data ) )
+            if len( chunk ) == 0:
+                raise ConnectionClosed()
+
+            data += chunk
 
         return data
+
+    def deserialize( self, reader: t.Callable, return_type, encoding: str = 'u8' ) -> t.Union[ str, bytes, dict, BaseModel ]:
+        length = self.length( self.read( reader, self.__size ) )
+        data = self.read( reader, length )
+        if len( data ) < length:
+            raise ConnectionClosed()
+
+        return self.decode( data, return_type, encoding )
+
+
+class FrameReader( object ):
+    """Reads the frames of a socket into one buffer that is reused for every frame.
+
+    recv_into() fills the buffer, it may receive more than one frame at once when the
+    requests are pipelined. The memoryview returned by read() is only valid until the
+    next call of read(). With a limit a frame that declares a larger payload raises FrameTooLarge,
+    the buffer never grows beyond it.
+    """
+    def __init__( self, sock, size: int = 16384, limit: t.Optional[ int ] = None ):
+        self._sock      = sock
+        self._limit     = limit
+        self._buffer    = bytearray( size )
+        self._view      = memoryview( self._buffer )
+        self._start     = 0
+        self._end       = 0
+        return
+
+    def _fill( self, size: int ):
+        if self._start + size > len( self._buffer ):
+            # Move the partial frame to the front, a frame larger than the buffer gets a larger buffer
+            pending = self._end - self._start
+            if size > len( self._buffer ):
+                self._buffer = bytearray( max( size, 2 * len( self._buffer ) ) )
+                self._buffer[ :pending ] = self._view[ self._start: self._end ]
+                self._view = memoryview( self._buffer )
+
+            else:
+                self._view[ :pending ] = self._view[ self._start: self._end ]
+
+            self._start = 0
+            self._end = pending
+
+        while self._end - self._start < size:
+            received = self._sock.recv_into( self._view[ self._end: ] )
+            if received == 0:
+                raise ConnectionClosed()
+
+            self._end += received
+
+        return
+
+    def read( self, protocol: JsonProtocol ) -> memoryview:
+        """The payload of the next frame, with the length header of protocol"""
+        self._fill( protocol.HeaderSize )
+        length = protocol.length( self._view[ self._start: self._start + protocol.HeaderSize ], self._limit )
+        self._start += protocol.HeaderSize
+        self._fill( length )
+        frame = self._view[ self._start: self._start + length ]
+        self._start += length
+        if self._start == self._end:
+            self._start = self._end = 0
+
+        return frame
+
+
+def send_parts( sock, parts: t.List[ bytes ] ):
+    """Write the parts with scatter-gather I/O, sendmsg() may write less than all parts"""
+    if not hasattr( sock, 'sendmsg' ):
+        # Windows
+        sock.sendall( b''.join( parts ) )
+        return
+
+    views = [ memoryview( part ) for part in parts if len( part ) > 0 ]
+    while len( views ) > 0:
+        sent = sock.sendmsg( views )
+        while len( views ) > 0 and sent >= len( views[ 0 ] ):
+            sent -= len( views[ 0 ] )
+            views.pop( 0 )
+
+        if sent > 0:
+            views[ 0 ] = views[ 0 ][ sent: ]
+
+    return
@@ -0,0 +1,149 @@
+import typing as t
+import time
+import functools
+from threading import Lock
+from contextlib import contextmanager
+
+
+__all__ = [ 'Histogram', 'histogram', 'histograms', 'timed' ]
+
+
+# Buckets per power of two, the relative error of a recorded value is below 1 / SUB_BUCKETS
+SUB_BITS        = 4
+SUB_BUCKETS     = 1 << SUB_BITS
+# Microseconds up to 2^40, about 12 days; longer durations count in the last bucket
+MAX_BITS        = 40
+BUCKETS         = ( MAX_BITS - SUB_BITS + 1 ) * SUB_BUCKETS
+QUANTILES       = { 'p50': 0.5, 'p90': 0.9, 'p99': 0.99, 'p999': 0.999 }
+
+
+def bucket( value: int ) -> int:
+    """Index of the bucket of value in microseconds; below 2 * SUB_BUCKETS the buckets are exact,
+    above it every power of two has SUB_BUCKETS buckets of equal width"""
+    if value < 2 * SUB_BUCKETS:
+        return max( 0, value )
+
+    shift = value.bit_length() - SUB_BITS - 1
+    return min( shift * SUB_BUCKETS + ( value >> shift ), BUCKETS - 1 )
+
+
+def upper( index: int ) -> int:
+    """Highest value in microseconds of the bucket"""
+    if index < 2 * SUB_BUCKETS:
+        return index
+
+    shift = index // SUB_BUCKETS - 1
+    return ( ( index - shift * SUB_BUCKETS + 1 ) << shift ) - 1
+
+
+class Histogram( object ):
+    """Latency histogram with fixed log-linear buckets, in the manner of an HDR histogram.
+
+    A value is counted in its bucket, recording is a few integer operations and the memory
+    is allocated once. The quantiles are computed from the buckets when they are asked for.
+    """
+    def __init__( self, name: str ):
+        self._name      = name
+        self._lock      = Lock()
+        self._counts    = [ 0 ] * BUCKETS
+        self._count     = 0
+        self._total     = 0.0
+        self._min       = None
+        self._max       = 0.0
+        return
+
+    @property
+    def Name( self ) -> str:
+        return self._name
+
+    def record( self, seconds: float ):
+        index = bucket( int( seconds * 1000000 ) )
+        with self._lock:
+            self._counts[ index ] += 1
+            self._count += 1
+            self._total += seconds
+            if self._min is None or seconds < self._min:
+                self._min = seconds
+
+            if seconds > self._max:
+                self._max = seconds
+
+        return
+
+    @contextmanager
+    def time( self ):
+        """Record the wall time of the with block"""
+        started = time.perf_counter()
+        try:
+            yield self
+
+        finally:
+            self.record( time.perf_counter() - started )
+
+    def quantiles( self, quantiles: t.Dict[ str, float ] = QUANTILES ) -> t.Dict[ str, float ]:
+        """Seconds per quantile, the highest value of the bucket and never more than the maximum"""
+        with self._lock:
+            counts = list( self._counts )
+            count = self._count
+            maximum = self._max
+
+        result = {}
+        for name, quantile in quantiles.items():
+            rank = quantile * count
+            seen = 0
+            value = 0.0
+            for index, hits in enumerate( counts ):
+                seen += hits
+                if hits and seen >= rank:
+                    value = min( upper( index ) / 1000000, maximum )
+                    break
+
+            result[ name ] = value
+
+        return result
+
+    def asDict( self ) -> t.Dict[ str, t.Any ]:
+        with self._lock:
+            count, total, minimum, maximum = self._count, self._total, self._min, self._max
+
+        return { 'count': count, 'total': total, 'min': minimum or 0.0, 'max': maximum,
+                 'mean': total / count if count else 0.0, **self.quantiles() }
+
+
+# All histograms of the process by name
+_registry = {}
+_registry_lock = Lock()
+
+
+def histogram( name: str ) -> Histogram:
+    """The histogram of name, created on first use"""
+    result = _registry.get( name )
+    if result is None:
+        with _registry_lock:
+            result = _registry.setdefault( name, Histogram( name ) )
+
+    return result
+
+
+def histograms() -> t.List[ Histogram ]:
+    """All histograms sorted by name"""
+    return [ _registry[ name ] for name in sorted( list( _registry ) ) ]
+
+
+def timed( name: str ):
+    """Decorator that records the wall time of every call in the histogram of name"""
+    def decorator( function ):
+        recorder = histogram( name )
+
+        @functools.wraps( function )
+        def wrapper( *args, **kwargs ):
+            started = time.perf_counter()
+            try:
+                return function( *args, **kwargs )
+
+            finally:
+                recorder.record( time.perf_counter() - started )
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,97 @@
+import typing as t
+import os
+import select
+import time
+import ctypes
+import logging
+from osmon.common.exc import ProcessNotFound
+
+
+__all__ = [ 'wait_for_pidfile', 'read_pidfile' ]
+
+
+logger = logging.getLogger( 'OSMON.PIDFILE' )
+
+
+# inotify flags, only used on Linux; elsewhere _LIBC is None and the pidfile is polled
+IN_MODIFY       = 0x00000002
+IN_CLOSE_WRITE  = 0x00000008
+IN_MOVED_TO     = 0x00000080
+IN_CREATE       = 0x00000100
+IN_NONBLOCK     = getattr( os, 'O_NONBLOCK', 0 )
+IN_CLOEXEC      = getattr( os, 'O_CLOEXEC', 0 )
+# Interval of the fallback waiter when inotify is not available
+POLL_INTERVAL   = 0.05
+
+
+def _libc():
+    try:
+        libc = ctypes.CDLL( None, use_errno = True )
+        libc.inotify_init1
+        return libc
+
+    except ( OSError, AttributeError, TypeError ):
+        # No inotify (or no C library to load on Windows)
+        return None
+
+
+_LIBC = _libc()
+
+
+def read_pidfile( filename: str ) -> t.Optional[ int ]:
+    """The PID in the file, None when the file does not exist (yet) or is (still) empty"""
+    try:
+        with open( filename, 'r' ) as stream:
+            return int( stream.read() )
+
+    except ( FileNotFoundError, ValueError ):
+        return None
+
+
+def _inotify( folder: str ) -> t.Optional[ int ]:
+    if _LIBC is None:
+        return None
+
+    fd = _LIBC.inotify_init1( IN_NONBLOCK | IN_CLOEXEC )
+    if fd < 0:
+        return None
+
+    if _LIBC.inotify_add_watch( fd, os.fsencode( folder ), IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO ) < 0:
+        os.close( fd )
+        return None
+
+    return fd
+
+
+def wait_for_pidfile( filename: str, timeout: float ) -> int:
+    """Wait until the PID file exists and contains a PID. The folder of the file is watched
+    with inotify, without inotify the file is polled every POLL_INTERVAL seconds"""
+    deadline = time.monotonic() + timeout
+    fd = _inotify( os.path.dirname( os.path.abspath( filename ) ) )
+    try:
+        while True:
+            # Also checked after the watch was added, the file may have been written before
+            pid = read_pidfile( filename )
+            if pid is not None:
+                return pid
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ProcessNotFound( f"PID file { filename } not written within { timeout } seconds" )
+
+            logger.debug( f"Waiting on PID file { filename }" )
+            if fd is None:
+                time.sleep( min( POLL_INTERVAL, remaining ) )
+
+            elif select.select( [ fd ], [], [], remaining )[ 0 ]:
+                try:
+                    # Drain the events, the file is checked regardless of the event
+                    while os.read( fd, 4096 ):
+                        pass
+
+                except BlockingIOError:
+                    pass
+
+    finally:
+        if fd is not None:
+            os.close( fd )
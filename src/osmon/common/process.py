@@ -3,27 +3,90 @@ import logging
 import os.path
 import sys
 import stat
-from threading import Timer
+import time
+import random
+from collections import deque
+from threading import Lock
 from psutil import Process, NoSuchProcess
 from osmon.common.exc import NotExecutable
-from osmon.common.interfaces import ITaskConfig, IProcessStatistics, IProcessCpuTimes, IProcessMemInfo, ITaskProcessInfo, IProcessInfo
+from osmon.common.history import StatisticsHistory
+from osmon.common.metrics import timed
+from osmon.common.interfaces import ITaskConfig, ITaskReadiness, IProcessStatistics, IProcessCpuTimes, IProcessMemInfo, ITaskProcessInfo, IProcessInfo
+from osmon.common.scheduler import RestartScheduler
 from abc import ABC, abstractmethod
 
 
-__all__ = [ 'ProcessMonitorAbc' ]
+__all__ = [ 'ProcessMonitorAbc', 'process_info' ]
+
+
+# A sample counts as a change when the status differs or the resource usage grows faster than this
+RSS_GROWTH          = 1.10      # factor
+CPU_GROWTH          = 10.0      # percent points
+
+
+# Attributes that do not change during the lifetime of a process, these are read once
+STATIC_ATTRIBUTES   = [ 'pid', 'create_time', 'exe', 'cmdline', 'name', 'environ', 'terminal' ]
+# Attributes that are expensive to read and change slowly, these are read every SLOW_REFRESH seconds
+SLOW_ATTRIBUTES     = [ 'num_fds', 'num_threads', 'ppid', 'cwd', 'username', 'num_ctx_switches', 'memory_percent' ]
+SLOW_REFRESH        = 30.0
+# Attributes of the sample of the monitor sweep, only read for a process without a sample
+SAMPLED_ATTRIBUTES  = [ 'cpu_num', 'cpu_times', 'memory_info', 'status', 'cpu_percent' ]
 
 
 logger = logging.getLogger( 'OSMON.PROCESS' )
 
 
+def process_info( process: Process, cache: dict, stats: t.Optional[ IProcessStatistics ] = None ) -> IProcessInfo:
+    """Information of the process for the status, cache keeps the static and the slow attributes
+    and must be the same dict for every call with the same process. The attributes of the sample
+    are taken from stats when the process was sampled"""
+    now = time.monotonic()
+    with process.oneshot():
+        if len( cache ) == 0:
+            cache[ 'static' ] = process.as_dict( STATIC_ATTRIBUTES )
+
+        if now - cache.get( 'refreshed', -SLOW_REFRESH ) >= SLOW_REFRESH:
+            cache[ 'slow' ] = process.as_dict( SLOW_ATTRIBUTES )
+            cache[ 'refreshed' ] = now
+
+        if stats is None:
+            sampled = process.as_dict( SAMPLED_ATTRIBUTES )
+
+        else:
+            # The fields of the models are in the order of the psutil tuples
+            sampled = { 'cpu_num': stats.cpu, 'cpu_percent': stats.cpu_percent, 'status': stats.status,
+                        'cpu_times': list( stats.cpu_times.model_dump().values() ),
+                        'memory_info': [ int( value ) for value in stats.memory.model_dump().values() if value is not None ] }
+
+    return IProcessInfo( **cache[ 'static' ], **cache[ 'slow' ], **sampled )
+
+
 class ProcessMonitorAbc( ABC ):
-    def __init__( self, descriptor: ITaskConfig ):
+    def __init__( self, descriptor: ITaskConfig, watcher = None, scheduler: RestartScheduler = None, store = None ):
         super().__init__()
         self._descriptor    = descriptor
-        self._process       = None
+        self._watcher       = watcher
+        self._scheduler     = scheduler
+        self._lock          = Lock()
         self._process       = None
         self._stats         = None
-        self._restart_timer = None
+        self._history       = StatisticsHistory( descriptor.history_size )
+        # The samples on disk, kept over restarts of osmon
+        self._series        = store.series( descriptor.name ) if store is not None else None
+        # Monotonic timestamps of the exits within the crash-loop window
+        self._exits         = deque()
+        self._restarts      = 0
+        self._parked        = False
+        # The last start picked up a process that was running already
+        self._adopted       = False
+        self._interval      = descriptor.min_interval
+        self._next_sample   = 0.0
+        # The process the static attributes are cached for, and the attributes
+        self._static        = ( None, {} )
+        # cgroup v2 of the task, set by the platform when the task has a cgroup
+        self._cgroup        = None
+        # The PID and totals of the process tree of the last sweep, for a task without cgroup
+        self._tree          = ( None, None )
         return
 
     def _build_process_argument( self ):
@@ -67,62 +130,318 @@ class ProcessMonitorAbc( ABC ):
     def PidFile( self ) -> str:
         return self._descriptor.pidfile
 
+    @property
+    def DependsOn( self ) -> t.List[ str ]:
+        return self._descriptor.depends_on
+
+    @property
+    def Readiness( self ) -> t.Optional[ ITaskReadiness ]:
+        return self._descriptor.ready
+
+    @property
+    def Adopted( self ) -> bool:
+        return self._adopted
+
     @abstractmethod
     def start( self ):
         pass
 
     def stop( self ):
+        if self._scheduler is not None:
+            self._scheduler.cancel( self )
+
         if isinstance( self._process, Process ):
+            if self._watcher is not None:
+                self._watcher.unwatch( self._process.pid )
+
             self._process.kill()
 
         return
 
+    def _watch( self ):
+        """Register the attached process with the exit watcher"""
+        if self._watcher is not None and isinstance( self._process, Process ):
+            if not self._watcher.watch( self._process.pid, self._exited ):
+                logger.info( f"Process { self._descriptor.name } exit is detected by the monitor sweep" )
+
+        return
+
+    def _exited( self, pid: int ):
+        """Called from the exit watcher thread when the process terminated"""
+        process = self._process
+        if not isinstance( process, Process ) or process.pid != pid:
+            # Notification of a previous incarnation of the process
+            return
+
+        logger.error( f"Process {self._descriptor.name} (PID { pid }) exited, needs restarting" )
+        self._restart( process )
+        return
+
+    def _restart( self, process: t.Optional[ Process ] ):
+        with self._lock:
+            if self._process is not process:
+                # Already handled by the exit watcher or the monitor sweep
+                return
+
+            self._process = None
+            self._stats = None
+
+        self._refresh()
+        self._schedule_restart()
+        return
+
+    def _refresh( self ):
+        """Make the task due, the next sweep publishes its new status"""
+        self._next_sample = 0.0
+        return
+
+    def _schedule_restart( self ):
+        """Schedule the start with exponential backoff and jitter, a task that exits
+        too often within the crash-loop window is parked"""
+        now = time.monotonic()
+        self._exits.append( now )
+        while self._exits and self._exits[ 0 ] < now - self._descriptor.crash_loop_window:
+            self._exits.popleft()
+
+        if len( self._exits ) > self._descriptor.crash_loop_exits:
+            self._parked = True
+            logger.error( f"Process {self._descriptor.name} exited { len( self._exits ) } times within "
+                          f"{ self._descriptor.crash_loop_window } seconds, parked" )
+            return
+
+        # Every exit within the window doubles the delay
+        delay = min( self._descriptor.restart_delay * self._descriptor.restart_backoff ** ( len( self._exits ) - 1 ),
+                     self._descriptor.restart_max_delay )
+        delay *= 1 + random.uniform( -self._descriptor.restart_jitter, self._descriptor.restart_jitter )
+        if self._scheduler is None:
+            # Monitored without a ProcessList, nothing starts the task again
+            logger.error( f"Process {self._descriptor.name} cannot be restarted, there is no scheduler" )
+            return
+
+        logger.warning( f"Process {self._descriptor.name} scheduled for start in { delay:.1f} seconds" )
+        self._scheduler.schedule( self, delay, self._scheduled_start )
+        return
+
+    def tryStart( self ) -> bool:
+        """Start the task, a failed start is retried through the restart backoff"""
+        try:
+            self.start()
+            self._refresh()
+            return True
+
+        except Exception:   # noqa
+            logger.exception( f"Process {self._descriptor.name} failed to start" )
+            self._schedule_restart()
+
+        return False
+
+    def deferStart( self ):
+        """Leave the start to the restart backoff, used when a task it depends on did not come up"""
+        self._schedule_restart()
+        return
+
+    def _scheduled_start( self ):
+        self._restarts += 1
+        self.tryStart()
+        return
+
+    # Settings that define the process itself, a change requires a restart of the task
+    PROCESS_SETTINGS = ( 'process', 'arguments', 'pidfile', 'cwd', 'user', 'group', 'cgroup' )
+
+    def reconfigure( self, descriptor: ITaskConfig ) -> bool:
+        """Take over the new settings of the task, returns False when the process definition
+        changed and the task needs to be restarted"""
+        for name in self.PROCESS_SETTINGS:
+            if getattr( descriptor, name ) != getattr( self._descriptor, name ):
+                return False
+
+        if descriptor.history_size != self._descriptor.history_size:
+            self._history = StatisticsHistory( descriptor.history_size )
+
+        self._descriptor = descriptor
+        self._interval = min( max( self._interval, descriptor.min_interval ), descriptor.max_interval )
+        if self._parked and self._scheduler is not None:
+            # Reload gives a parked task a new chance
+            self._parked = False
+            self._exits.clear()
+            self._scheduler.schedule( self, 0, self._scheduled_start )
+
+        return True
+
+    @property
+    def Parked( self ) -> bool:
+        return self._parked
+
+    @property
+    def Restarts( self ) -> int:
+        return self._restarts
+
+    @timed( 'task.monitor' )
     def monitor( self ):
         if not isinstance( self._process, Process ):
             logger.warning( f"Waiting for { self._descriptor.name } to be started" )
-            # Timer is running and process is not started yes
+            # Restart is scheduled and process is not started yet
             return
 
         logger.debug( f"Checking status of process { self._descriptor.name }" )
-        self._process: Process
+        process: Process = self._process
         try:
-            with self._process.oneshot():
-                cpu = IProcessCpuTimes( **self._process.cpu_times()._asdict() )     # noqa
-                mem = IProcessMemInfo( **self._process.memory_info()._asdict() )    # noqa
-                self._stats = IProcessStatistics( cpu = self._process.cpu_num(),
-                                                  status = self._process.status(),
-                                                  cpu_percent = self._process.cpu_percent(),
-                                                  cpu_times = cpu,
-                                                  memory = mem )
-            logger.debug( f"Usage of {self._descriptor.name}: {cpu}" )
-            # Clear the restart timer on a successful poll of the process
-            self._restart_timer = None
+            with process.oneshot():
+                cpu = IProcessCpuTimes( **process.cpu_times()._asdict() )     # noqa
+                mem = IProcessMemInfo( **process.memory_info()._asdict() )    # noqa
+                stats = IProcessStatistics( cpu = process.cpu_num(),
+                                            status = process.status(),
+                                            cpu_percent = process.cpu_percent(),
+                                            cpu_times = cpu,
+                                            memory = mem )
 
         except AttributeError:
             logger.exception( "During monitor" )
+            return
 
         except NoSuchProcess:
-            logger.error( f"Process {self._descriptor.name} disappeared, needs restarting" )
-            if self._descriptor.restart_delay == 0:
-                self.start()
+            self._disappeared( process )
+            return
+
+        self._update( stats )
+        return
+
+    def collected( self, pid: int, result: t.Optional[ t.Tuple[ float, t.Any ] ] ):
+        """Apply the statistics of a batch collector, result is None when the PID was not found"""
+        process = self._process
+        if not isinstance( process, Process ) or process.pid != pid:
+            # Restarted since the PID was handed to the collector
+            return
 
-            else:
-                self._process = None
-                logger.warning( f"Process {self._descriptor.name} scheduled for start in { self._descriptor.restart_delay }" )
-                self._restart_timer = Timer( self._descriptor.restart_delay, self.start )
-                self._restart_timer.start()
+        if result is None or abs( result[ 0 ] - process.create_time() ) > 0.01:
+            # Gone, or the PID was reused by an other process
+            self._disappeared( process )
+            return
 
+        self._update( result[ 1 ] )
         return
 
-    def asDict( self ) -> dict:
+    def collectedTree( self, pid: int, info ):
+        """Keep the totals of the process tree, from the process tree index"""
+        self._tree = ( pid, info )
+        return
+
+    @property
+    def Cgroup( self ):
+        return self._cgroup
+
+    @property
+    def Pid( self ) -> t.Optional[ int ]:
+        process = self._process
+        return process.pid if isinstance( process, Process ) else None
+
+    @property
+    def Statistics( self ) -> t.Optional[ IProcessStatistics ]:
+        stats = self._stats
+        if stats is not None and not isinstance( stats, IProcessStatistics ):
+            # Raw sample of the batch collector
+            stats = stats.statistics()
+
+        return stats
+
+    @property
+    def History( self ) -> StatisticsHistory:
+        return self._history
+
+    @property
+    def NextSample( self ) -> float:
+        """Monotonic time the task is due for the next sample"""
+        return self._next_sample
+
+    def postpone( self ):
+        """Move the next sample one interval ahead, called when the sample is taken"""
+        self._next_sample = time.monotonic() + self._interval
+        return
+
+    def _adapt( self, stats ):
+        """Sample more often after a (re)start, a status change or a fast growing resource usage,
+        back off exponentially while the task is stable"""
+        previous = self._stats
+        if previous is None:
+            changed = True
+
+        else:
+            previous = self._usage( previous )
+            current = self._usage( stats )
+            changed = ( current[ 0 ] != previous[ 0 ] or
+                        current[ 1 ] > previous[ 1 ] * RSS_GROWTH or
+                        current[ 2 ] > previous[ 2 ] + CPU_GROWTH )
+
+        if changed:
+            self._interval = self._descriptor.min_interval
+
+        else:
+            self._interval = min( self._interval * 2, self._descriptor.max_interval )
+
+        self._next_sample = time.monotonic() + self._interval
+        return
+
+    @staticmethod
+    def _usage( stats ) -> t.Tuple[ str, float, float ]:
+        if isinstance( stats, IProcessStatistics ):
+            return stats.status, stats.memory.rss, stats.cpu_percent
+
+        return stats.status, stats.rss, stats.cpu_percent
+
+    def _update( self, stats ):
+        self._adapt( stats )
+        self._stats = stats
+        if isinstance( stats, IProcessStatistics ):
+            sample = ( time.time(), stats.cpu_times.user, stats.cpu_times.system, stats.cpu_percent,
+                       stats.memory.rss, stats.memory.vms, stats.status )
+
+        else:
+            sample = ( time.time(), stats.user, stats.system, stats.cpu_percent, stats.rss, stats.vms, stats.status )
+
+        self._history.append( *sample )
+        if self._series is not None:
+            try:
+                self._series.append( *sample )
+
+            except OSError:
+                logger.exception( f"Storing the sample of { self._descriptor.name }" )
+
+        if logger.isEnabledFor( logging.DEBUG ):
+            logger.debug( f"Usage of {self._descriptor.name}: {stats}" )
+
+        return
+
+    def _disappeared( self, process: Process ):
+        logger.error( f"Process {self._descriptor.name} disappeared, needs restarting" )
+        self._restart( process )
+        return
+
+    def asDict( self ) -> ITaskProcessInfo:
         result = ITaskProcessInfo( name = self._descriptor.name, pid = self._descriptor.pidfile )
-        if isinstance( self._process, Process ):
-            result.status = 'running'
-            result.process = IProcessInfo( **self._process.as_dict( [ 'num_fds', 'pid', 'terminal', 'num_threads', 'create_time',
-                                                                      'ppid', 'cpu_num', 'cwd', 'exe', 'cpu_times', 'environ',
-                                                                      'memory_info', 'cmdline', 'name', 'username', 'num_ctx_switches',
-                                                                      'status', 'cpu_percent', 'memory_percent' ] ) )
+        process = self._process
+        if isinstance( process, Process ):
+            if self._static[ 0 ] is not process:
+                self._static = ( process, {} )
+
+            try:
+                result.process = process_info( process, self._static[ 1 ], self.Statistics )
+                result.status = 'running'
+                if self._cgroup is not None:
+                    result.cgroup = self._cgroup.statistics()
+
+                elif self._tree[ 0 ] == process.pid:
+                    result.tree = self._tree[ 1 ]
+
+            except NoSuchProcess:
+                # Exited, the exit watcher or the next sample takes care of the restart
+                result.status = 'not running/initialized'
+
+        elif self._parked:
+            result.status = 'parked (crash loop)'
+
         else:
             result.status = 'not running/initialized'
 
+        result.restarts = self._restarts
+
         return result
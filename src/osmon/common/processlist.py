@@ -1,14 +1,61 @@
+import typing as t
 import os
+import time
+import logging
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 
 from psutil import Process
 
-from osmon.system import ProcessMonitor
-from osmon.common.interfaces import IConfiguration, IProcessInfo
+from osmon.system import ProcessMonitor, Collector, ProcessTree
+from osmon.common.interfaces import IConfiguration, IProcessInfo, IMessageResponse
+from osmon.common.metrics import timed
+from osmon.common.process import process_info
+from osmon.common.readiness import ReadinessGate
+from osmon.common.scheduler import RestartScheduler
+from osmon.common.snapshot import StatusSnapshot
+from osmon.common.store import MetricsStore
+
+
+logger = logging.getLogger( 'OSMON.PROCESSLIST' )
+# Snapshots kept for the changes since the generation of a client
+RECENT_SNAPSHOTS = 8
 
 
 class ProcessList( object ):
-    def __init__( self, cfg: IConfiguration ):
-        self._processes = [ ProcessMonitor( proc_class ) for proc_class in cfg.processes ]
+    def __init__( self, cfg: IConfiguration, watcher = None ):
+        # One thread schedules the restarts of all tasks, at most start_concurrency start at the same time
+        self._scheduler     = RestartScheduler( cfg.start_concurrency )
+        self._scheduler.start()
+        self._watcher       = watcher
+        self._store         = MetricsStore( cfg.store_dir, cfg.store_retention ) if cfg.store_dir is not None else None
+        self._processes     = [ ProcessMonitor( proc_class, watcher, self._scheduler, self._store )
+                                for proc_class in cfg.processes ]
+        self._interval      = cfg.monitor_interval
+        self._deadline      = cfg.monitor_deadline
+        self._executor      = ThreadPoolExecutor( max_workers = max( 1, cfg.monitor_workers ),
+                                                  thread_name_prefix = 'monitor' )
+        self._collector     = Collector() if cfg.batch_collector and Collector is not None else None
+        self._tree          = ProcessTree() if cfg.process_tree and ProcessTree is not None else None
+        self._lock          = Lock()
+        # Tasks that are still in the monitor from a previous sweep, with their start time
+        self._busy          = set()
+        self._started       = {}
+        self._sweep_time    = 0.0
+        self._concurrency   = cfg.start_concurrency
+        self._startup_time  = None
+        # Status of the tasks of the last snapshot, only the sampled tasks are refreshed
+        self._entries       = {}
+        self._self          = Process( os.getpid() )
+        self._self_static   = {}
+        self._snapshot      = None
+        # The last snapshots by generation, for the changes since the generation of a client
+        self._recent        = {}
+        # Called with every new snapshot, on the monitor thread
+        self._subscribers   = []
+        # Set by close(), the watchers of the list end
+        self._closed        = False
+        self._publish( self._processes )
         return
 
     def __del__( self ):
@@ -18,9 +65,85 @@ class ProcessList( object ):
         self._processes = []
         return
 
+    def close( self ):
+        self._closed = True
+        # Pending restarts are discarded
+        self._scheduler.stop()
+        # Don't wait for workers that are stuck in the kernel
+        self._executor.shutdown( wait = False )
+        if self._store is not None:
+            self._store.close()
+
+        return
+
     def start( self ):
-        for proc_class in self._processes:
-            proc_class.start()
+        self._start( self._processes )
+        self._publish( self._processes )
+        return
+
+    def _start( self, processes: list ):
+        """Start the tasks along their dependencies, at most start_concurrency at the same time.
+        A task is started as soon as the tasks it depends on are ready, dependencies outside
+        processes are running already. A task that fails to start is retried through its restart
+        backoff, the start of the tasks that depend on it is left to their restart backoff"""
+        if len( processes ) == 0:
+            return
+
+        started     = time.monotonic()
+        names       = { proc_class.Name for proc_class in processes }
+        waiting     = { proc_class: { name for name in proc_class.DependsOn if name in names }
+                        for proc_class in processes }
+        dependents  = { name: [] for name in names }
+        for proc_class, depends in waiting.items():
+            for name in depends:
+                dependents[ name ].append( proc_class )
+
+        running     = 0
+        futures     = {}
+        with ThreadPoolExecutor( max_workers = max( 1, min( self._concurrency, len( processes ) ) ),
+                                 thread_name_prefix = 'start' ) as executor:
+            while True:
+                for proc_class in [ proc_class for proc_class, depends in waiting.items() if len( depends ) == 0 ]:
+                    del waiting[ proc_class ]
+                    futures[ executor.submit( self._start_task, proc_class ) ] = proc_class
+
+                if len( futures ) == 0:
+                    break
+
+                done, _ = wait( futures, return_when = FIRST_COMPLETED )
+                for future in done:
+                    proc_class = futures.pop( future )
+                    if future.result():
+                        running += 1
+                        for dependent in dependents[ proc_class.Name ]:
+                            waiting[ dependent ].discard( proc_class.Name )
+
+                    else:
+                        self._defer( proc_class.Name, dependents, waiting )
+
+        self._startup_time = time.monotonic() - started
+        logger.warning( f"Started { running } of { len( processes ) } tasks in { self._startup_time:.2f} seconds" )
+        return
+
+    @staticmethod
+    def _start_task( proc_class ) -> bool:
+        # The gate is created before the start, only log lines of this start are matched
+        gate = ReadinessGate( proc_class.Name, proc_class.Readiness )
+        if not proc_class.tryStart():
+            return False
+
+        if proc_class.Adopted:
+            gate.adopted()
+
+        return gate.wait()
+
+    def _defer( self, name: str, dependents: dict, waiting: dict ):
+        for dependent in dependents[ name ]:
+            if dependent in waiting:
+                del waiting[ dependent ]
+                logger.warning( f"Process { dependent.Name } not started, { name } is not ready" )
+                dependent.deferStart()
+                self._defer( dependent.Name, dependents, waiting )
 
         return
 
@@ -30,18 +153,270 @@ class ProcessList( object ):
 
         return
 
-    def monitor( self ):
-        for proc_class in self._processes:
+    def reload( self, cfg: IConfiguration ):
+        """Apply a new configuration, only the tasks that were added, removed or changed are touched.
+        The monitors of unchanged tasks keep their process, statistics and history"""
+        started     = time.monotonic()
+        current     = { proc_class.Name: proc_class for proc_class in self._processes }
+        processes   = []
+        start       = []
+        for descriptor in cfg.processes:
+            proc_class = current.pop( descriptor.name, None )
+            if proc_class is None:
+                logger.warning( f"Reload: process { descriptor.name } added" )
+                proc_class = ProcessMonitor( descriptor, self._watcher, self._scheduler, self._store )
+                start.append( proc_class )
+
+            elif not proc_class.reconfigure( descriptor ):
+                logger.warning( f"Reload: process { descriptor.name } changed, restarting" )
+                proc_class.stop()
+                proc_class = ProcessMonitor( descriptor, self._watcher, self._scheduler, self._store )
+                start.append( proc_class )
+
+            processes.append( proc_class )
+
+        for proc_class in current.values():
+            logger.warning( f"Reload: process { proc_class.Name } removed, stopping" )
+            proc_class.stop()
+
+        # Replace the list in one go, request handlers may iterate the old one
+        self._processes     = processes
+        self._interval      = cfg.monitor_interval
+        self._deadline      = cfg.monitor_deadline
+        self._concurrency   = cfg.start_concurrency
+        self._start( start )
+        self._publish( start )
+        logger.warning( f"Reload of { len( processes ) } tasks took { ( time.monotonic() - started ) * 1000:.1f} ms, "
+                        f"{ len( start ) } started and { len( current ) } stopped" )
+        return
+
+    def _monitor_task( self, proc_class ):
+        with self._lock:
+            self._started[ proc_class ] = time.monotonic()
+
+        try:
             proc_class.monitor()
 
+        finally:
+            with self._lock:
+                self._busy.discard( proc_class )
+                del self._started[ proc_class ]
+
+        return
+
+    @timed( 'sweep' )
+    def monitor( self ):
+        """Sample the tasks that are due, each task has its own adaptive sampling interval"""
+        now = time.monotonic()
+        due = [ proc_class for proc_class in self._processes if proc_class.NextSample <= now ]
+        for proc_class in due:
+            proc_class.postpone()
+
+        if self._collector is not None:
+            self._monitor_batch( due )
+
+        else:
+            self._monitor_pool( due )
+
+        if self._tree is not None:
+            self._monitor_tree( due )
+
+        if self._sweep_time > self._interval:
+            logger.warning( f"Monitor sweep took { self._sweep_time:.1f} seconds, longer than the monitor interval" )
+
+        self._publish( due )
+        return
+
+    def _publish( self, refresh: list ):
+        """Build the status snapshot of this sweep, the tasks in refresh get a new status and the
+        other tasks keep the status of the previous snapshot. The snapshot replaces the previous one
+        in a single assignment, request handlers never see a partial snapshot"""
+        for proc_class in refresh:
+            try:
+                self._entries[ proc_class ] = proc_class.asDict()
+
+            except Exception:   # noqa
+                logger.exception( f"During the status of { proc_class.Name }" )
+
+        processes = self._processes
+        # Drop the tasks that were removed by a reload
+        self._entries = { proc_class: self._entries[ proc_class ] for proc_class in processes
+                          if proc_class in self._entries }
+        response = IMessageResponse( status = True, message = '',
+                                     parameters = [ self._entries[ proc_class ] for proc_class in processes
+                                                    if proc_class in self._entries ],
+                                     osmon = self.processInfo() )
+        previous = self._snapshot
+        # The first generation is the time in milliseconds, a restarted osmon does not repeat
+        # the generations that clients have seen before
+        generation = int( time.time() * 1000 ) if previous is None else previous.Generation + 1
+        self._snapshot = StatusSnapshot( generation, response )
+        # Replaced in one assignment like the snapshot
+        self._recent = { snapshot.Generation: snapshot
+                         for snapshot in list( self._recent.values() )[ 1 - RECENT_SNAPSHOTS: ] + [ self._snapshot ] }
+        subscribers = list( self._subscribers )
+        if len( subscribers ) > 0:
+            if previous is not None:
+                # Once for all watchers
+                self._snapshot.changes( previous )
+
+            for subscriber in subscribers:
+                try:
+                    subscriber( self._snapshot )
+
+                except Exception:   # noqa
+                    logger.exception( "During the push of the snapshot" )
+
+        return
+
+    def subscribe( self, subscriber: t.Callable[ [ StatusSnapshot ], None ] ):
+        """Call subscriber with every new snapshot, it is called on the monitor thread and must not block"""
+        self._subscribers.append( subscriber )
+        return
+
+    def unsubscribe( self, subscriber: t.Callable[ [ StatusSnapshot ], None ] ):
+        if subscriber in self._subscribers:
+            self._subscribers.remove( subscriber )
+
+        return
+
+    @property
+    def Closed( self ) -> bool:
+        return self._closed
+
+    @property
+    def Store( self ) -> t.Optional[ MetricsStore ]:
+        """The on-disk metrics store, None when it is disabled"""
+        return self._store
+
+    @property
+    def Snapshot( self ) -> StatusSnapshot:
+        """Status of the last monitor sweep"""
+        return self._snapshot
+
+    def recent( self, generation: int ) -> t.Optional[ StatusSnapshot ]:
+        """The snapshot of generation, None when it is not one of the last snapshots"""
+        return self._recent.get( generation )
+
+    def waitTime( self ) -> float:
+        """Seconds until the first task is due for sampling"""
+        if len( self._processes ) == 0:
+            return self._interval
+
+        return max( 0.0, min( proc_class.NextSample for proc_class in self._processes ) - time.monotonic() )
+
+    @timed( 'sweep.collector' )
+    def _monitor_batch( self, due: list ):
+        started = time.monotonic()
+        tasks = {}
+        for proc_class in due:
+            pid = proc_class.Pid
+            if pid is None:
+                logger.warning( f"Waiting for { proc_class.Name } to be started" )
+
+            else:
+                tasks[ pid ] = proc_class
+
+        self._collector.retain( proc_class.Pid for proc_class in self._processes )
+        results = self._collector.collect( tasks )
+        for pid, proc_class in tasks.items():
+            try:
+                proc_class.collected( pid, results.get( pid ) )
+
+            except Exception:   # noqa
+                logger.exception( f"During the monitor of { proc_class.Name }" )
+
+        self._sweep_time = time.monotonic() - started
+        logger.debug( f"Batch monitor sweep of { len( tasks ) } tasks took { self._sweep_time * 1000:.1f} ms" )
+        return
+
+    @timed( 'sweep.tree' )
+    def _monitor_tree( self, due: list ):
+        """The process trees of the due tasks without cgroup, from one scan of /proc"""
+        started = time.monotonic()
+        tasks = { proc_class.Pid: proc_class for proc_class in due
+                  if proc_class.Pid is not None and proc_class.Cgroup is None }
+        if len( tasks ) == 0:
+            return
+
+        try:
+            results = self._tree.collect( tasks )
+
+        except Exception:   # noqa
+            logger.exception( "During the scan of the process trees" )
+            return
+
+        for pid, proc_class in tasks.items():
+            proc_class.collectedTree( pid, results.get( pid ) )
+
+        elapsed = time.monotonic() - started
+        self._sweep_time += elapsed
+        logger.debug( f"Process trees of { len( tasks ) } tasks took { elapsed * 1000:.1f} ms" )
         return
 
+    def _monitor_pool( self, due: list ):
+        started = time.monotonic()
+        futures = {}
+        for proc_class in due:
+            with self._lock:
+                if proc_class in self._busy:
+                    logger.warning( f"Process { proc_class.Name } is still busy in the previous sweep, skipped" )
+                    continue
+
+                self._busy.add( proc_class )
+
+            futures[ self._executor.submit( self._monitor_task, proc_class ) ] = proc_class
+
+        remaining = set( futures )
+        while remaining:
+            with self._lock:
+                expires = [ self._started[ futures[ future ] ] + self._deadline
+                            for future in remaining if futures[ future ] in self._started ]
+
+            timeout = min( expires ) - time.monotonic() if expires else self._deadline
+            done, remaining = wait( remaining, timeout = max( timeout, 0 ), return_when = FIRST_COMPLETED )
+            for future in done:
+                self._report( futures[ future ], future )
+
+            now = time.monotonic()
+            with self._lock:
+                overdue = { future for future in remaining
+                            if self._started.get( futures[ future ], now ) + self._deadline <= now }
+
+            if not done and not overdue:
+                # Queued behind workers that are stuck, these are picked up when a worker comes free
+                overdue = set( remaining )
+
+            for future in overdue:
+                logger.warning( f"Process { futures[ future ].Name } did not finish the monitor within "
+                                f"{ self._deadline } seconds" )
+
+            remaining -= overdue
+
+        self._sweep_time = time.monotonic() - started
+        logger.debug( f"Monitor sweep of { len( futures ) } tasks took { self._sweep_time * 1000:.1f} ms" )
+        return
+
+    @staticmethod
+    def _report( proc_class, future: Future ):
+        exc = future.exception()
+        if exc is not None:
+            logger.error( f"During the monitor of { proc_class.Name }: { exc }", exc_info = exc )
+
+        return
+
+    @property
+    def SweepTime( self ) -> float:
+        """Wall time in seconds of the last monitor sweep"""
+        return self._sweep_time
+
+    @property
+    def StartupTime( self ) -> t.Optional[ float ]:
+        """Wall time in seconds until the last started tasks were running"""
+        return self._startup_time
+
     def __iter__( self ):
         return iter( self._processes )
 
     def processInfo( self ) -> IProcessInfo:
-        process = Process( os.getpid() )
-        return IProcessInfo( **process.as_dict( [ 'num_fds', 'pid', 'terminal', 'num_threads', 'create_time',
-                                                  'ppid', 'cpu_num', 'cwd', 'exe', 'cpu_times', 'environ',
-                                                  'memory_info', 'cmdline', 'name', 'username', 'num_ctx_switches',
-                                                  'status', 'cpu_percent', 'memory_percent' ] ) )
+        return process_info( self._self, self._self_static )
@@ -0,0 +1,112 @@
+import typing as t
+import os
+import re
+import stat
+import socket
+import time
+import logging
+from osmon.common.interfaces import ITaskReadiness
+from osmon.common.pidfile import POLL_INTERVAL
+
+
+__all__ = [ 'ReadinessGate' ]
+
+
+logger = logging.getLogger( 'OSMON.READINESS' )
+
+
+class ReadinessGate( object ):
+    """Readiness conditions of one start of a task.
+
+    Create the gate before the task is started, the log file position is taken at that
+    moment, so only lines written by this start of the task are matched.
+    """
+    def __init__( self, name: str, ready: t.Optional[ ITaskReadiness ] ):
+        self._name      = name
+        self._ready     = ready
+        self._checks    = []
+        self._offset    = 0
+        self._partial   = b''
+        self._matched   = False
+        if ready is not None:
+            if ready.tcp_port is not None:
+                self._checks.append( self._tcp )
+
+            if ready.unix_socket is not None:
+                self._checks.append( self._unix )
+
+            if ready.log_file is not None and ready.log_line is not None:
+                self._pattern = re.compile( ready.log_line.encode() )
+                try:
+                    self._offset = os.path.getsize( ready.log_file )
+
+                except OSError:
+                    self._offset = 0
+
+                self._checks.append( self._log )
+
+        return
+
+    def adopted( self ):
+        """The task picked up a process that was running already, its log line was written before
+        the gate was created; only the conditions that can still be checked are waited for"""
+        if self._log in self._checks:
+            self._checks.remove( self._log )
+
+        return
+
+    def wait( self ) -> bool:
+        """Wait until all conditions hold, False when the timeout expired"""
+        if len( self._checks ) == 0:
+            return True
+
+        started = time.monotonic()
+        deadline = started + self._ready.timeout
+        while not all( check() for check in self._checks ):
+            if time.monotonic() >= deadline:
+                logger.error( f"Process { self._name } not ready within { self._ready.timeout } seconds" )
+                return False
+
+            time.sleep( POLL_INTERVAL )
+
+        logger.info( f"Process { self._name } ready after { time.monotonic() - started:.2f} seconds" )
+        return True
+
+    def _tcp( self ) -> bool:
+        try:
+            with socket.create_connection( ( self._ready.tcp_host, self._ready.tcp_port ), timeout = 1.0 ):
+                return True
+
+        except OSError:
+            return False
+
+    def _unix( self ) -> bool:
+        try:
+            return stat.S_ISSOCK( os.stat( self._ready.unix_socket ).st_mode )
+
+        except OSError:
+            return False
+
+    def _log( self ) -> bool:
+        if self._matched:
+            return True
+
+        try:
+            with open( self._ready.log_file, 'rb' ) as stream:
+                if os.fstat( stream.fileno() ).st_size < self._offset:
+                    # Rotated or truncated, start over
+                    self._offset = 0
+                    self._partial = b''
+
+                stream.seek( self._offset )
+                data = stream.read()
+
+        except OSError:
+            return False
+
+        self._offset += len( data )
+        lines = ( self._partial + data ).split( b'\n' )
+        # The last line is incomplete until the newline is written
+        self._partial = lines.pop()
+        self._matched = any( self._pattern.search( line ) for line in lines )
+        return self._matched
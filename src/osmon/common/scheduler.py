@@ -0,0 +1,123 @@
+import typing as t
+import heapq
+import itertools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Thread
+
+
+__all__ = [ 'RestartScheduler' ]
+
+
+logger = logging.getLogger( 'OSMON.SCHEDULER' )
+
+
+class RestartScheduler( object ):
+    """Single thread that times the pending restarts of all tasks from a timer heap.
+
+    A task has at most one pending restart, scheduling it again replaces the previous one.
+    A due callback runs on a pool of at most workers threads, a slow start only delays the
+    other restarts when all workers are starting.
+    """
+    def __init__( self, workers: int = 1 ):
+        self._workers   = max( 1, workers )
+        self._executor  = None
+        self._heap      = []
+        self._pending   = {}
+        self._counter   = itertools.count()
+        self._cond      = Condition()
+        self._running   = False
+        self._thread    = None
+        return
+
+    def start( self ):
+        self._running = True
+        self._executor = ThreadPoolExecutor( max_workers = self._workers, thread_name_prefix = 'restart' )
+        self._thread = Thread( target = self._run, name = 'restart-scheduler', daemon = True )
+        self._thread.start()
+        return
+
+    def stop( self ):
+        """Stop the scheduler, pending restarts are discarded"""
+        with self._cond:
+            self._running = False
+            self._heap.clear()
+            self._pending.clear()
+            self._cond.notify()
+
+        if isinstance( self._thread, Thread ):
+            self._thread.join()
+            self._thread = None
+
+        if self._executor is not None:
+            # Don't wait for starts that are waiting for their PID file
+            self._executor.shutdown( wait = False )
+            self._executor = None
+
+        return
+
+    def schedule( self, key: t.Hashable, delay: float, callback: t.Callable[ [], None ] ):
+        with self._cond:
+            self._cancel( key )
+            entry = [ time.monotonic() + delay, next( self._counter ), key, callback ]
+            self._pending[ key ] = entry
+            heapq.heappush( self._heap, entry )
+            self._cond.notify()
+
+        return
+
+    def cancel( self, key: t.Hashable ):
+        with self._cond:
+            self._cancel( key )
+
+        return
+
+    def _cancel( self, key: t.Hashable ):
+        entry = self._pending.pop( key, None )
+        if entry is not None:
+            # Lazy removal, the entry is skipped when it reaches the top of the heap
+            entry[ 3 ] = None
+
+        return
+
+    def pending( self, key: t.Hashable ) -> t.Optional[ float ]:
+        """Seconds until the pending restart of key, None when there is none"""
+        with self._cond:
+            entry = self._pending.get( key )
+            return None if entry is None else max( 0.0, entry[ 0 ] - time.monotonic() )
+
+    def __len__( self ):
+        return len( self._pending )
+
+    def _run( self ):
+        while True:
+            with self._cond:
+                while self._running:
+                    while self._heap and self._heap[ 0 ][ 3 ] is None:
+                        heapq.heappop( self._heap )
+
+                    timeout = self._heap[ 0 ][ 0 ] - time.monotonic() if self._heap else None
+                    if timeout is not None and timeout <= 0:
+                        break
+
+                    self._cond.wait( timeout )
+
+                if not self._running:
+                    return
+
+                _, _, key, callback = heapq.heappop( self._heap )
+                del self._pending[ key ]
+                self._executor.submit( self._call, key, callback )
+
+        return
+
+    @staticmethod
+    def _call( key: t.Hashable, callback: t.Callable[ [], None ] ):
+        try:
+            callback()
+
+        except Exception:   # noqa
+            logger.exception( f"During the scheduled restart of { key }" )
+
+        return
@@ -1,10 +1,18 @@
+import typing as t
+import os
+import stat
+import struct
+import asyncio
 import logging
+import socket
 import socketserver
+import threading
+from osmon.common.exc import FrameTooLarge
 from osmon.common.interfaces import IMessageRequest, IMessageResponse
-from osmon.common.json_protocol import JsonProtocol
+from osmon.common.json_protocol import MAX_REQUEST_FRAME
 
 
-__all__ = [ 'JsonServer' ]
+__all__ = [ 'JsonServer', 'UnixJsonServer', 'AsyncJsonServer', 'peer_credentials' ]
 
 
 logger = logging.getLogger( 'osmon.oscom' )
@@ -19,3 +27,237 @@ class JsonServer( socketserver.ThreadingMixIn, socketserver.TCPServer):
     def __init__( self, server_address, RequestHandlerClass: socketserver.BaseRequestHandler ):
         socketserver.TCPServer.__init__(self, server_address, RequestHandlerClass)
         return
+
+
+def peer_credentials( sock ) -> t.Optional[ t.Tuple[ int, int, int ] ]:
+    """Process id, user id and group id of the peer of a unix socket, None when the platform does not tell"""
+    if not hasattr( socket, 'SO_PEERCRED' ):
+        return None
+
+    try:
+        return struct.unpack( '3i', sock.getsockopt( socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize( '3i' ) ) )
+
+    except OSError:
+        return None
+
+
+def remove_socket( path: str ):
+    """Remove the unix socket at path, left by a previous run that did not stop cleanly"""
+    try:
+        if stat.S_ISSOCK( os.stat( path ).st_mode ):
+            os.unlink( path )
+
+    except FileNotFoundError:
+        pass
+
+    return
+
+
+if hasattr( socket, 'AF_UNIX' ):
+    class UnixJsonServer( socketserver.ThreadingMixIn, socketserver.UnixStreamServer ):
+        """JsonServer on a unix socket, the socket file is removed when the server is closed"""
+        daemon_threads = True
+
+        def __init__( self, server_address: str, RequestHandlerClass: socketserver.BaseRequestHandler, mode: int = 0o666 ):
+            remove_socket( server_address )
+            socketserver.UnixStreamServer.__init__( self, server_address, RequestHandlerClass )
+            os.chmod( server_address, mode )
+            return
+
+        def server_close( self ):
+            socketserver.UnixStreamServer.server_close( self )
+            remove_socket( self.server_address )
+            return
+
+else:
+    # Windows
+    UnixJsonServer = None
+
+
+class AsyncJsonServer( object ):
+    """Control server that serves all connections from one asyncio event loop.
+
+    It has the interface of JsonServer; serve_forever() runs on its own thread until
+    shutdown() is called from another thread, server_close() releases the socket.
+    Connections above max_connections are closed right away, a connection is closed
+    when no request arrives within keepalive seconds. A server_address that is a str is
+    the path of a unix socket.
+    """
+    def __init__( self, server_address, dispatcher, max_connections: int = 100, keepalive: float = 60.0,
+                  mode: int = 0o666 ):
+        self._dispatcher        = dispatcher
+        self._max_connections   = max_connections
+        self._keepalive         = keepalive
+        self._connections       = set()
+        self._loop              = asyncio.new_event_loop()
+        # Created by _serve() on the loop, an asyncio.Event is bound to the loop it is created on before 3.10
+        self._stop              = None
+        self._stopping          = False
+        self._stopped           = threading.Event()
+        # Bound here like TCPServer, the address is in use when the constructor returns
+        if isinstance( server_address, str ):
+            remove_socket( server_address )
+            self._socket        = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+            self._socket.bind( server_address )
+            os.chmod( server_address, mode )
+            self._socket.listen()
+            self.server_address = server_address
+
+        else:
+            self._socket        = socket.create_server( server_address )
+            self.server_address = self._socket.getsockname()[ :2 ]
+
+        return
+
+    def serve_forever( self ):
+        asyncio.set_event_loop( self._loop )
+        try:
+            self._loop.run_until_complete( self._serve() )
+
+        finally:
+            self._stopped.set()
+
+        return
+
+    def shutdown( self ):
+        """Stop serve_forever() and wait until it returned"""
+        self._loop.call_soon_threadsafe( self._request_stop )
+        self._stopped.wait()
+        return
+
+    def _request_stop( self ):
+        self._stopping = True
+        if self._stop is not None:
+            self._stop.set()
+
+        return
+
+    def server_close( self ):
+        self._socket.close()
+        self._loop.close()
+        if isinstance( self.server_address, str ):
+            remove_socket( self.server_address )
+
+        return
+
+    async def _serve( self ):
+        self._stop = asyncio.Event()
+        if self._stopping:
+            # shutdown() was called before the loop ran
+            self._stop.set()
+
+        server = await asyncio.start_server( self._connection, sock = self._socket )
+        async with server:
+            await self._stop.wait()
+            connections = list( self._connections )
+            for task in connections:
+                task.cancel()
+
+            await asyncio.gather( *connections, return_exceptions = True )
+
+        return
+
+    async def _connection( self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter ):
+        if len( self._connections ) >= self._max_connections:
+            logger.warning( f"Connection from { writer.get_extra_info( 'peername' ) } refused, "
+                            f"{ self._max_connections } connections open" )
+            writer.close()
+            return
+
+        sock = writer.get_extra_info( 'socket' )
+        if sock.family != getattr( socket, 'AF_UNIX', None ):
+            # asyncio only sets TCP_NODELAY when the socket was created with IPPROTO_TCP, without it
+            # pipelined responses wait for the delayed ACK of the client
+            sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+
+        task = asyncio.current_task()
+        self._connections.add( task )
+        session = self._dispatcher.session( sock )
+        # A timer instead of wait_for() on every read, that costs a task per request
+        idle = self._loop.call_later( self._keepalive, task.cancel )
+        try:
+            while True:
+                try:
+                    protocol = session[ 'protocol' ]
+                    header = await reader.readexactly( protocol.HeaderSize )
+
+                except asyncio.IncompleteReadError:
+                    # Closed by the client
+                    break
+
+                # The body and every frame of the response get keepalive seconds as well, a peer that
+                # stalls on the body or stops reading is closed like an idle one
+                idle.cancel()
+                idle = self._loop.call_later( self._keepalive, task.cancel )
+                text = protocol.decode( await reader.readexactly( protocol.length( header, MAX_REQUEST_FRAME ) ),
+                                        IMessageRequest )
+                if text.action == 'watch':
+                    # Pushes until the connection is closed, without the keep-alive timer
+                    idle.cancel()
+                    await self._watch( writer, text, session )
+                    break
+
+                for parts in self._dispatcher.respond( text, session ):
+                    writer.writelines( parts )
+                    # Flow control per frame, a stream is not buffered in memory as a whole
+                    await writer.drain()
+                    idle.cancel()
+                    idle = self._loop.call_later( self._keepalive, task.cancel )
+
+                if not session[ 'persistent' ]:
+                    break
+
+        except ( ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError, asyncio.TimeoutError ):
+            # Cancelled by the keep-alive timer or the shutdown, or a watcher that stopped reading
+            pass
+
+        except FrameTooLarge as exc:
+            logger.warning( f"Closing the connection of { writer.get_extra_info( 'peername' ) }: { exc }" )
+
+        except Exception:   # noqa
+            logger.exception( "During the connection" )
+
+        finally:
+            idle.cancel()
+            self._connections.discard( task )
+            writer.close()
+
+        return
+
+    async def _watch( self, writer: asyncio.StreamWriter, text: IMessageRequest, session: dict ):
+        """Push a frame after every monitor sweep, the snapshots are handed over from the monitor thread"""
+        watcher = self._dispatcher.watcher( text, session )
+        updates = asyncio.Queue()
+
+        def push( snapshot ):
+            self._loop.call_soon_threadsafe( updates.put_nowait, snapshot )
+            return
+
+        self._dispatcher.subscribe( push )
+        try:
+            snapshot = self._dispatcher.Snapshot
+            while True:
+                try:
+                    parts = watcher.frame( snapshot )
+
+                except FrameTooLarge as exc:
+                    writer.writelines( session[ 'protocol' ].parts( IMessageResponse( status = False, id = text.id,
+                                                                                      message = f"{ exc }, agree on a "
+                                                                                                f"larger header with hello" ) ) )
+                    await asyncio.wait_for( writer.drain(), self._keepalive )
+                    break
+
+                if parts is not None:
+                    writer.writelines( parts )
+                    # A push per sweep, a watcher that stops reading is dropped after keepalive seconds
+                    await asyncio.wait_for( writer.drain(), self._keepalive )
+
+                # Only the last snapshot when the connection was slow
+                snapshot = await updates.get()
+                while not updates.empty():
+                    snapshot = updates.get_nowait()
+
+        finally:
+            self._dispatcher.unsubscribe( push )
+
+        return
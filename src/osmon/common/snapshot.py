@@ -0,0 +1,177 @@
+import typing as t
+import time
+import json
+import fnmatch
+from osmon.common.delta import diff
+from osmon.common.interfaces import IMessageResponse, ITaskProcessInfo, IProcessInfo
+
+
+__all__ = [ 'StatusSnapshot', 'projection' ]
+
+
+# Serialized selections of tasks and fields kept per snapshot
+CACHED_SELECTIONS = 32
+
+
+# Fields of a status request to the keys of the task; the path of the PID file is under the key pid,
+# the field pid selects the PID of the process
+TASK_FIELDS = { **{ name: name for name in ITaskProcessInfo.model_fields if name != 'pid' }, 'pidfile': 'pid' }
+
+
+def projection( fields: t.Optional[ t.Iterable[ str ] ] ) -> t.Optional[ dict ]:
+    """The include argument of the model dump of a task for the fields, None for all fields.
+    A field of the task itself goes before the field of its process with the same name;
+    pid is the PID of the process, pidfile the path of its PID file"""
+    if fields is None:
+        return None
+
+    include = { 'name': True }
+    for field in fields:
+        if field in TASK_FIELDS:
+            include[ TASK_FIELDS[ field ] ] = True
+
+        elif field in IProcessInfo.model_fields:
+            if include.get( 'process' ) is not True:
+                include.setdefault( 'process', {} )[ field ] = True
+
+        else:
+            raise ValueError( f"Unknown field { field }" )
+
+    return include
+
+
+class StatusSnapshot( object ):
+    """Status of osmon and all tasks at the end of one monitor sweep.
+
+    The snapshot is built on the monitor thread and not changed afterwards, request
+    handlers only read it. The response is serialized once when the snapshot is built;
+    the status without the tasks and every task on its own, for streaming, and the
+    complete response joined from these parts. Other codecs than JSON are serialized
+    when a client asks for them the first time.
+
+    The changes since an earlier snapshot are computed by changes() when they are asked for,
+    by the watchers or by a status request with the generation of the client. They are
+    computed and serialized once, all watchers push the same serialized changes.
+    """
+    __slots__ = ( '_generation', '_timestamp', '_response', '_header', '_tasks', '_data', '_encoded',
+                  '_state', '_deltas', '_delta_encoded' )
+
+    def __init__( self, generation: int, response: IMessageResponse ):
+        response.generation = generation
+        self._generation    = generation
+        self._timestamp     = time.time()
+        self._response      = response
+        self._header        = response.model_dump_json( exclude_none = True, exclude = { 'parameters' } ).encode( 'utf-8' )
+        self._tasks         = [ task.model_dump_json( exclude_none = True ).encode( 'utf-8' )
+                                for task in response.parameters ]
+        self._data          = self._header[ :-1 ] + b',"parameters":[' + b','.join( self._tasks ) + b']}'
+        # Serialized with other codecs, on first use
+        self._encoded       = {}
+        self._state         = None
+        # Changes since earlier generations
+        self._deltas        = {}
+        self._delta_encoded = {}
+        return
+
+    @property
+    def Generation( self ) -> int:
+        return self._generation
+
+    @property
+    def Timestamp( self ) -> float:
+        return self._timestamp
+
+    @property
+    def Response( self ) -> IMessageResponse:
+        """The response model, shared by all readers so it must not be modified"""
+        return self._response
+
+    @property
+    def Data( self ) -> bytes:
+        """The serialized response"""
+        return self._data
+
+    @property
+    def Header( self ) -> bytes:
+        """The serialized response without the tasks"""
+        return self._header
+
+    @property
+    def Tasks( self ) -> t.List[ bytes ]:
+        """The serialized status of every task"""
+        return self._tasks
+
+    def encoded( self, protocol, tasks: t.Optional[ t.Tuple[ str, ... ] ] = None,
+                 fields: t.Optional[ t.Tuple[ str, ... ] ] = None,
+                 osmon: bool = True ) -> t.Tuple[ bytes, t.List[ bytes ], bytes ]:
+        """The header, tasks and complete response serialized with the codec of protocol.
+
+        tasks are the names or glob patterns of the tasks to include, fields the fields of the tasks
+        to include, the name of the task is always included. A field that is not a field of the task
+        is a field of its process. osmon includes the status of osmon itself.
+        """
+        key = ( protocol.Codec, tasks, fields, osmon )
+        if key == ( 'json', None, None, True ):
+            return self._header, self._tasks, self._data
+
+        result = self._encoded.get( key )
+        if result is None:
+            selected = [ idx for idx, task in enumerate( self._response.parameters )
+                         if tasks is None or any( fnmatch.fnmatchcase( task.name, pattern ) for pattern in tasks ) ]
+            header = protocol.encode( self._response, exclude = { 'parameters' } if osmon else { 'parameters', 'osmon' } )
+            if fields is None and protocol.Codec == 'json':
+                parameters = [ self._tasks[ idx ] for idx in selected ]
+
+            else:
+                include = projection( fields )
+                parameters = [ protocol.encode( self._response.parameters[ idx ], include = include ) for idx in selected ]
+
+            result = ( header, parameters, protocol.join( header, parameters ) )
+            # Two requests may serialize it at the same time, both results are the same. The number
+            # of selections kept is limited, a snapshot is replaced every sweep
+            if len( self._encoded ) < CACHED_SELECTIONS:
+                self._encoded[ key ] = result
+
+        return result
+
+    @property
+    def State( self ) -> dict:
+        """The osmon status and the status of every task by name, as dicts to compare"""
+        if self._state is None:
+            # From the serialized parts, that is faster than dumping the models again
+            self._state = { 'osmon': json.loads( self._header ).get( 'osmon', {} ),
+                            'tasks': { task.name: json.loads( data )
+                                       for task, data in zip( self._response.parameters, self._tasks ) } }
+
+        return self._state
+
+    def changes( self, previous: 'StatusSnapshot' ) -> IMessageResponse:
+        """The changes since previous; the osmon status and the tasks that changed, with only the
+        fields that changed. A removed task or field is None"""
+        delta = self._deltas.get( previous.Generation )
+        if delta is None:
+            delta = IMessageResponse( status = True, message = '', generation = self._generation,
+                                      delta = { 'previous': previous.Generation,
+                                                **diff( previous.State, self.State ) } )
+            self._deltas[ previous.Generation ] = delta
+
+        return delta
+
+    @property
+    def Delta( self ) -> t.Optional[ IMessageResponse ]:
+        """The changes since the previous generation, None when they were not computed"""
+        return self._deltas.get( self._generation - 1 )
+
+    def encodedDelta( self, protocol, previous: t.Optional[ int ] = None ) -> bytes:
+        """The changes since generation previous, default the previous generation, serialized
+        with the codec of protocol. changes() must have computed them"""
+        if previous is None:
+            previous = self._generation - 1
+
+        key = ( protocol.Codec, previous )
+        data = self._delta_encoded.get( key )
+        if data is None:
+            data = protocol.encode( self._deltas[ previous ] )
+            self._delta_encoded[ key ] = data
+
+        return data
@@ -0,0 +1,392 @@
+import typing as t
+import os
+import math
+import mmap
+import time
+import struct
+import bisect
+import logging
+from threading import Lock
+from urllib.parse import quote, unquote
+from osmon.common.history import StatisticsHistory, STATUS_CODES, STATUS_INDEX
+
+
+__all__ = [ 'MetricsStore', 'LEVELS' ]
+
+
+logger = logging.getLogger( 'OSMON.STORE' )
+
+
+# Resolutions of the store in seconds, every sample is rolled up into all of them
+LEVELS = { '1s': 1, '1m': 60, '1h': 3600 }
+# Records per segment file
+SEGMENT_RECORDS = 4096
+SEGMENT_SUFFIX = '.seg'
+# magic, records, resolution, count; padded to HEADER_SIZE
+HEADER = struct.Struct( '<8sIII' )
+HEADER_SIZE = 64
+MAGIC = b'OSMSEG1\x00'
+# The descriptors of os.open() are not inherited
+OPEN_FLAGS = os.O_RDWR | getattr( os, 'O_BINARY', 0 )
+# The columns of the history and the number of samples rolled up in a record
+COLUMNS = StatisticsHistory.COLUMNS + ( ( 'samples', 'I' ), )
+# Columns that are averaged in a rollup, of the other columns the last value is kept
+AVERAGED = ( 'cpu_percent', 'rss', 'vms' )
+
+
+class Segment( object ):
+    """One memory mapped file with a fixed number of records, stored column after column.
+
+    The count in the header is written after the record, a reader never sees a record that
+    is not complete. The file is mapped shared, the records are on disk when osmon crashes.
+    """
+    def __init__( self, path: str, records: int = SEGMENT_RECORDS, resolution: int = 1, create: bool = False ):
+        self._path = path
+        if create:
+            fd = os.open( path, OPEN_FLAGS | os.O_CREAT | os.O_EXCL, 0o644 )
+
+        else:
+            fd = os.open( path, OPEN_FLAGS )
+
+        try:
+            size = HEADER_SIZE + records * sum( struct.calcsize( code ) for _, code in COLUMNS )
+            if create:
+                os.ftruncate( fd, size )
+
+            elif os.fstat( fd ).st_size < HEADER_SIZE:
+                raise ValueError( f"Invalid segment { path }" )
+
+            self._map = mmap.mmap( fd, 0 )
+
+        finally:
+            os.close( fd )
+
+        if create:
+            HEADER.pack_into( self._map, 0, MAGIC, records, resolution, 0 )
+
+        magic, self._records, self._resolution, _ = HEADER.unpack_from( self._map, 0 )
+        if magic != MAGIC or len( self._map ) != HEADER_SIZE + self._records * sum( struct.calcsize( code )
+                                                                                   for _, code in COLUMNS ):
+            self._map.close()
+            raise ValueError( f"Invalid segment { path }" )
+
+        # The count is the last field of the header
+        self._count = memoryview( self._map )[ HEADER.size - 4: HEADER.size ].cast( 'I' )
+        self._columns = {}
+        offset = HEADER_SIZE
+        for name, code in COLUMNS:
+            length = self._records * struct.calcsize( code )
+            self._columns[ name ] = memoryview( self._map )[ offset: offset + length ].cast( code )
+            offset += length
+
+        return
+
+    def close( self ):
+        self._count.release()
+        for column in self._columns.values():
+            column.release()
+
+        self._map.close()
+        return
+
+    @property
+    def Path( self ) -> str:
+        return self._path
+
+    @property
+    def Count( self ) -> int:
+        return self._count[ 0 ]
+
+    @property
+    def Full( self ) -> bool:
+        return self._count[ 0 ] >= self._records
+
+    @property
+    def First( self ) -> float:
+        return self._columns[ 'timestamp' ][ 0 ]
+
+    @property
+    def Last( self ) -> float:
+        return self._columns[ 'timestamp' ][ self._count[ 0 ] - 1 ]
+
+    def record( self, index: int ) -> t.Dict[ str, t.Any ]:
+        return { name: column[ index ] for name, column in self._columns.items() }
+
+    def write( self, index: int, record: t.Dict[ str, t.Any ] ):
+        """Write record at index, index is the last record or the first free one"""
+        for name, column in self._columns.items():
+            column[ index ] = record[ name ]
+
+        if index == self._count[ 0 ]:
+            self._count[ 0 ] = index + 1
+
+        return
+
+    def range( self, start: t.Optional[ float ], end: t.Optional[ float ],
+               count: t.Optional[ int ] = None ) -> t.Dict[ str, list ]:
+        """The records between the timestamps start and end, inclusive, of the first count records"""
+        count = self._count[ 0 ] if count is None else min( count, self._count[ 0 ] )
+        timestamps = self._columns[ 'timestamp' ][ : count ]
+        first = 0 if start is None else bisect.bisect_left( timestamps, start )
+        last = count if end is None else bisect.bisect_right( timestamps, end )
+        timestamps.release()
+        return { name: column[ first: last ].tolist() for name, column in self._columns.items() }
+
+
+class Level( object ):
+    """The segments of one task at one resolution, the last segment is written"""
+    def __init__( self, directory: str, resolution: int, retention: int ):
+        self._directory     = directory
+        self._resolution    = resolution
+        self._retention     = retention
+        # Disk use is bounded by the number of segments, also when the clock jumps
+        self._max_segments  = math.ceil( retention / resolution / SEGMENT_RECORDS ) + 1
+        os.makedirs( directory, exist_ok = True )
+        self._segments      = sorted( ( int( name[ : -len( SEGMENT_SUFFIX ) ] ), os.path.join( directory, name ) )
+                                      for name in os.listdir( directory )
+                                      if name.endswith( SEGMENT_SUFFIX ) and name[ : -len( SEGMENT_SUFFIX ) ].isdigit() )
+        self._active        = None
+        self._current       = None
+        # Samples are dropped while the clock is behind the last record
+        self._behind        = False
+        while self._segments and self._active is None:
+            try:
+                self._active = Segment( self._segments[ -1 ][ 1 ] )
+
+            except ValueError:
+                logger.warning( f"Removing invalid segment { self._segments[ -1 ][ 1 ] }" )
+                os.remove( self._segments.pop()[ 1 ] )
+
+        if self._active is not None and self._active.Count > 0:
+            # Continue the rollup of the last record after a restart of osmon
+            self._current = self._active.record( self._active.Count - 1 )
+
+        self._prune( time.time() )
+        return
+
+    def close( self ):
+        if self._active is not None:
+            self._active.close()
+            self._active = None
+
+        return
+
+    def append( self, sample: t.Dict[ str, t.Any ] ):
+        """Roll the sample up into the record of its interval, that is written in place"""
+        bucket = sample[ 'timestamp' ] - sample[ 'timestamp' ] % self._resolution
+        current = self._current
+        if current is not None and bucket < current[ 'timestamp' ]:
+            # The clock went back, the records stay sorted for the bisect of the queries
+            if not self._behind:
+                logger.warning( f"Clock went back in { self._directory }, dropping the samples before "
+                                f"{ time.ctime( current[ 'timestamp' ] ) }" )
+                self._behind = True
+
+            return
+
+        self._behind = False
+        if current is not None and current[ 'timestamp' ] == bucket and self._active is not None:
+            samples = current[ 'samples' ] + 1
+            for name in AVERAGED:
+                current[ name ] += ( sample[ name ] - current[ name ] ) / samples
+
+            for name in ( 'user', 'system', 'status' ):
+                current[ name ] = sample[ name ]
+
+            current[ 'samples' ] = samples
+            index = self._active.Count - 1
+
+        else:
+            current = dict( sample, timestamp = bucket, samples = 1 )
+            if self._active is None or self._active.Full:
+                self._roll( bucket )
+
+            index = self._active.Count
+
+        # Memory is integer in the file
+        self._active.write( index, dict( current, rss = int( current[ 'rss' ] ), vms = int( current[ 'vms' ] ) ) )
+        self._current = current
+        return
+
+    def _roll( self, bucket: float ):
+        """Start a new segment, the segments that are past the retention are removed"""
+        if self._active is not None:
+            self._active.close()
+
+        path = os.path.join( self._directory, f"{ int( bucket ) }{ SEGMENT_SUFFIX }" )
+        if os.path.exists( path ):
+            # Left behind by an osmon that ran with a clock ahead
+            os.remove( path )
+            self._segments = [ segment for segment in self._segments if segment[ 1 ] != path ]
+
+        self._active = Segment( path, SEGMENT_RECORDS, self._resolution, create = True )
+        self._segments.append( ( int( bucket ), path ) )
+        self._prune( bucket )
+        return
+
+    def _prune( self, now: float ):
+        # A segment is past the retention when the next one starts before the retention window
+        while len( self._segments ) > 1 and ( len( self._segments ) > self._max_segments or
+                                              self._segments[ 1 ][ 0 ] < now - self._retention ):
+            _, path = self._segments.pop( 0 )
+            logger.debug( f"Removing segment { path }" )
+            try:
+                os.remove( path )
+
+            except FileNotFoundError:
+                pass
+
+        return
+
+    def view( self ) -> t.Tuple[ t.List[ t.Tuple[ int, str ] ], t.Optional[ str ], int, t.Optional[ t.Dict[ str, t.Any ] ] ]:
+        """What a query reads, taken under the lock of the series: the segments, the path of the
+        active segment, its number of complete records and its last record, that is rolled up in place"""
+        if self._active is None or self._current is None:
+            return list( self._segments ), None, 0, None
+
+        return ( list( self._segments ), self._active.Path, self._active.Count - 1,
+                 dict( self._current, rss = int( self._current[ 'rss' ] ), vms = int( self._current[ 'vms' ] ) ) )
+
+    @staticmethod
+    def read( view, start: t.Optional[ float ], end: t.Optional[ float ] ) -> t.Dict[ str, list ]:
+        """The records of view() between start and end, read from the files without the lock"""
+        segments, active, count, last = view
+        result = { name: [] for name, _ in COLUMNS }
+        for idx, ( first, path ) in enumerate( segments ):
+            if end is not None and first > end:
+                break
+
+            if start is not None and idx + 1 < len( segments ) and segments[ idx + 1 ][ 0 ] <= start:
+                # Ends before start
+                continue
+
+            try:
+                segment = Segment( path )
+
+            except ( FileNotFoundError, ValueError ):
+                # Removed by the retention since the view was taken
+                continue
+
+            try:
+                records = segment.range( start, end, count if path == active else None )
+
+            finally:
+                segment.close()
+
+            for name, column in records.items():
+                result[ name ].extend( column )
+
+        if last is not None and ( start is None or last[ 'timestamp' ] >= start ) and \
+                ( end is None or last[ 'timestamp' ] <= end ):
+            for name, _ in COLUMNS:
+                result[ name ].append( last[ name ] )
+
+        return result
+
+
+class Series( object ):
+    """The samples of one task at all resolutions of the store"""
+    def __init__( self, directory: str, retention: t.Dict[ str, int ] ):
+        self._lock      = Lock()
+        self._levels    = { name: Level( os.path.join( directory, name ), LEVELS[ name ], seconds )
+                            for name, seconds in sorted( retention.items(), key = lambda item: LEVELS[ item[ 0 ] ] ) }
+        self._retention = retention
+        return
+
+    def close( self ):
+        with self._lock:
+            for level in self._levels.values():
+                level.close()
+
+        return
+
+    def append( self, timestamp: float, user: float, system: float, cpu_percent: float,
+                rss: float, vms: float, status: str ):
+        """The same arguments as StatisticsHistory.append(), one write per resolution"""
+        sample = { 'timestamp': timestamp, 'user': user, 'system': system, 'cpu_percent': cpu_percent,
+                   'rss': rss, 'vms': vms, 'status': STATUS_INDEX.get( status, 0 ) }
+        with self._lock:
+            for level in self._levels.values():
+                level.append( sample )
+
+        return
+
+    def resolution( self, start: t.Optional[ float ] ) -> str:
+        """The finest resolution that still holds the samples of start"""
+        names = list( self._levels )
+        if start is not None:
+            for name in names:
+                if start >= time.time() - self._retention[ name ]:
+                    return name
+
+        return names[ 0 ] if start is None else names[ -1 ]
+
+    def query( self, start: t.Optional[ float ] = None, end: t.Optional[ float ] = None,
+               resolution: t.Optional[ str ] = None, points: t.Optional[ int ] = None ) -> t.Dict[ str, list ]:
+        """Records between start and end, in the columns of StatisticsHistory.window()"""
+        if resolution is None:
+            resolution = self.resolution( start )
+
+        if resolution not in self._levels:
+            raise ValueError( f"Unknown resolution { resolution }, one of { ', '.join( self._levels ) }" )
+
+        with self._lock:
+            # The files are read without the lock, the sweep appends in the meantime
+            view = self._levels[ resolution ].view()
+
+        result = Level.read( view, start, end )
+
+        del result[ 'samples' ]
+        if points is not None and 0 < points < len( result[ 'timestamp' ] ):
+            result = StatisticsHistory._downsample( result, points )
+
+        result[ 'status' ] = [ STATUS_CODES[ code ] for code in result[ 'status' ] ]
+        return result
+
+
+class MetricsStore( object ):
+    """Append only on-disk store of the samples of the tasks, the history survives a restart of osmon.
+
+    Every task has a directory with per resolution the segment files; the samples are rolled up
+    into 1 second, 1 minute and 1 hour records, each kept for the retention of its resolution.
+    A sample costs one in place write per resolution, a query reads the mapped segment files.
+    """
+    def __init__( self, directory: str, retention: t.Dict[ str, int ] ):
+        self._directory = directory
+        self._retention = retention
+        self._lock      = Lock()
+        self._series    = {}
+        os.makedirs( directory, exist_ok = True )
+        # The series of tasks that are no longer configured are only pruned here
+        for name in self.names():
+            self.series( name )
+
+        return
+
+    def close( self ):
+        with self._lock:
+            for series in self._series.values():
+                series.close()
+
+            self._series = {}
+
+        return
+
+    def names( self ) -> t.List[ str ]:
+        """The tasks in the store, also those that are not running anymore"""
+        return sorted( unquote( name ) for name in os.listdir( self._directory )
+                       if os.path.isdir( os.path.join( self._directory, name ) ) )
+
+    def series( self, name: str ) -> Series:
+        """The series of a task, there is one per task also when the task is restarted or reloaded"""
+        with self._lock:
+            series = self._series.get( name )
+            if series is None:
+                series = Series( os.path.join( self._directory, quote( name, safe = '' ) ), self._retention )
+                self._series[ name ] = series
+
+        return series
+
+    def query( self, name: str, start: t.Optional[ float ] = None, end: t.Optional[ float ] = None,
+               resolution: t.Optional[ str ] = None, points: t.Optional[ int ] = None ) -> t.Dict[ str, list ]:
+        return self.series( name ).query( start, end, resolution, points )
@@ -0,0 +1,40 @@
+import typing as t
+from osmon.common.json_protocol import JsonProtocol
+from osmon.common.snapshot import StatusSnapshot
+
+
+__all__ = [ 'Watcher' ]
+
+
+class Watcher( object ):
+    """One watch subscription, the frames to push for the snapshots of the monitor sweeps.
+
+    The first frame and every keyframe-th frame after it carry the full status, the others
+    only the changes since the previous frame. A watcher that missed a snapshot because the
+    connection was slow gets the full status.
+    """
+    def __init__( self, protocol: JsonProtocol, id: t.Optional[ int ], keyframe: int ):
+        self._protocol      = protocol
+        self._id            = id
+        self._keyframe      = max( 1, keyframe )
+        self._generation    = None
+        self._pushed        = 0
+        return
+
+    def frame( self, snapshot: StatusSnapshot ) -> t.Optional[ t.List[ bytes ] ]:
+        """The header and data parts of the frame for snapshot, None when it was pushed already"""
+        if snapshot.Generation == self._generation:
+            return None
+
+        delta = snapshot.Delta
+        if ( self._pushed % self._keyframe == 0 or delta is None or
+             delta.delta[ 'previous' ] != self._generation ):
+            data = snapshot.encoded( self._protocol )[ 2 ]
+            self._pushed = 0
+
+        else:
+            data = snapshot.encodedDelta( self._protocol )
+
+        self._pushed += 1
+        self._generation = snapshot.Generation
+        return self._protocol.parts( self._protocol.with_id( data, self._id ) )
@@ -1,65 +1,60 @@
 import typing as t
 import logging
+import socket
 import socketserver
 from threading import Thread
+from osmon.common.dispatcher import RequestDispatcher
 from osmon.common.event import FlagEvent, STOP_EVENT, RESTART_EVENT, RELOAD_EVENT
-from osmon.common.interfaces import IConfiguration, IMessageRequest, IMessageResponse
-from osmon.common.json_protocol import JsonProtocol
-from osmon.common.process import ProcessMonitorAbc
+from osmon.common.exc import ConnectionClosed, FrameTooLarge
+from osmon.common.exporter import MetricsServer
+from osmon.common.interfaces import IConfiguration, IMessageRequest
+from osmon.common.json_protocol import FrameReader, send_parts, MAX_REQUEST_FRAME
 from osmon.common.processlist import ProcessList
-from osmon.common.server import JsonServer
+from osmon.common.server import JsonServer, UnixJsonServer, AsyncJsonServer
+from osmon.system import ExitWatcher
 
 
 logger = logging.getLogger( 'OSMON' )
 
 
-class JsonHandler( socketserver.BaseRequestHandler, JsonProtocol ):
-    processes       = None
-    event           = None
-
-    def __init__( self, request, client_address, server ):
-        JsonProtocol.__init__( self, 2 )
-        socketserver.BaseRequestHandler.__init__( self, request, client_address, server )
+class JsonHandler( socketserver.BaseRequestHandler ):
+    dispatcher      = None
+    keepalive       = None
 
     "One instance per connection.  Override handle(self) to customize action."
     def handle( self ):
-        # self.request is the client connection
-        text = self.deserialize( self.request.recv, IMessageRequest )
-        try:
-            logger.info( f"Request: { text }" )
-            if text.action == 'stop':
-                self.event.set( STOP_EVENT )
-                logger.warning( f"Stop requested" )
-                response = IMessageResponse( status = True, message = 'Stop requested' )
-
-            elif text.action == 'restart':
-                self.event.set( RESTART_EVENT )
-                logger.warning( f"Restart requested" )
-                response = IMessageResponse( status = True, message = 'Restart requested' )
-
-            elif text.action == 'reload':
-                self.event.set( RELOAD_EVENT )
-                logger.warning( f"Reload requested" )
-                response = IMessageResponse( status = True, message = 'Reload requested' )
-
-            elif text.action == 'status':
-                response = IMessageResponse( status = True, message = '' )
-                for process in self.processes:
-                    if isinstance( process, ProcessMonitorAbc ):
-                        response.parameters.append( process.asDict() )
-
-                response.osmon = self.processes.processInfo()
-
-            else:
-                logger.error( f"Unknown request: { text }")
-                response = IMessageResponse( status = False, message = 'Unknown request' )
-
-        except Exception as exc:
-            logger.exception( "During processing request" )
-            response = IMessageResponse( status = False, message = str( exc ) )
-
-        logger.info( f"Response: {response}" )
-        self.serialize( self.request.send, response )
+        # self.request is the client connection, it carries one request unless the client
+        # asked with hello to keep it open
+        session = self.dispatcher.session( self.request )
+        reader = FrameReader( self.request, limit = MAX_REQUEST_FRAME )
+        while True:
+            try:
+                protocol = session[ 'protocol' ]
+                text = protocol.decode( reader.read( protocol ), IMessageRequest )
+
+            except ( ConnectionClosed, socket.timeout ):
+                break
+
+            except FrameTooLarge as exc:
+                logger.warning( f"Closing the connection of { self.client_address }: { exc }" )
+                break
+
+            try:
+                for parts in self.dispatcher.respond( text, session ):
+                    send_parts( self.request, parts )
+
+            except ConnectionError:
+                # Closed by the client, a watch ends this way
+                break
+
+            if not session[ 'persistent' ]:
+                break
+
+            # An idle persistent connection is closed after the keep-alive timeout
+            self.request.settimeout( self.keepalive )
+            if self.request.family != getattr( socket, 'AF_UNIX', None ):
+                self.request.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+
         self.request.close()
         return
 
@@ -78,17 +73,68 @@ def main( cfg: IConfiguration, load_configuration: t.Callable, *argv ):
         logger.setLevel( logging._nameToLevel[ cfg.trace_level ] )  # noqa
         dump_configuration( cfg )
         logger.warning( "Startup monitoring" )
-        processes                   = ProcessList( cfg )
-        JsonHandler.processes       = processes
-        JsonHandler.event           = event
-        server = JsonServer( ( 'localhost', 5678 ), JsonHandler )
-        thread = Thread( target = server.serve_forever )
-        thread.start()
+        # Exits are detected event driven, the monitor interval only collects the statistics
+        watcher                     = ExitWatcher()
+        watcher.start()
+        processes                   = ProcessList( cfg, watcher )
+        # With a unix socket stop, restart and reload are only taken from the admins on it
+        dispatcher                  = RequestDispatcher( processes, event, cfg.control_admins,
+                                                         tcp_control = cfg.control_socket is None )
+        if cfg.control_socket is not None and cfg.control_port is not None:
+            logger.warning( f"Control server listens on TCP port { cfg.control_port } and on { cfg.control_socket }, "
+                            f"stop, restart and reload are refused over TCP" )
+
+        servers                     = []
+        if cfg.control_server == 'asyncio':
+            # One thread with an event loop serves all connections of a listener
+            if cfg.control_port is not None:
+                servers.append( AsyncJsonServer( ( cfg.control_host, cfg.control_port ), dispatcher,
+                                                 cfg.control_connections, cfg.control_keepalive ) )
+
+            if cfg.control_socket is not None:
+                servers.append( AsyncJsonServer( cfg.control_socket, dispatcher, cfg.control_connections,
+                                                 cfg.control_keepalive, cfg.control_socket_mode ) )
+
+        else:
+            JsonHandler.dispatcher  = dispatcher
+            JsonHandler.keepalive   = cfg.control_keepalive
+            if cfg.control_port is not None:
+                servers.append( JsonServer( ( cfg.control_host, cfg.control_port ), JsonHandler ) )
+
+            if cfg.control_socket is not None:
+                servers.append( UnixJsonServer( cfg.control_socket, JsonHandler, cfg.control_socket_mode ) )
+
+        if cfg.metrics_port is not None:
+            # Scrapes are served from the snapshot of the last sweep
+            servers.append( MetricsServer( ( cfg.metrics_host, cfg.metrics_port ), processes ) )
+
+        threads = [ Thread( target = server.serve_forever ) for server in servers ]
+        for thread in threads:
+            thread.start()
+
         # Start all processes
         processes.start()
         logger.warning( "Enter monitoring" )
-        while not event.is_set( STOP_EVENT | RESTART_EVENT | RELOAD_EVENT ):
-            event.wait( cfg.monitor_interval )
+        while not event.is_set( STOP_EVENT | RESTART_EVENT ):
+            # Every task has its own sampling interval, wake up for the first that is due
+            event.wait( processes.waitTime() )
+            if event.is_set( STOP_EVENT | RESTART_EVENT ):
+                break
+
+            if event.is_set( RELOAD_EVENT ):
+                # Reload only touches the changed tasks, the server and the other tasks keep running
+                event.clear( RELOAD_EVENT )
+                try:
+                    cfg, _ = load_configuration()
+                    logger.setLevel( logging._nameToLevel[ cfg.trace_level ] )  # noqa
+                    dump_configuration( cfg )
+                    processes.reload( cfg )
+
+                except Exception:   # noqa
+                    logger.exception( "During the reload of the configuration" )
+
+                continue
+
             try:
                 processes.monitor()
 
@@ -96,17 +142,19 @@ def main( cfg: IConfiguration, load_configuration: t.Callable, *argv ):
                 logger.exception( "During the monitor of processes" )
 
         logger.warning( "Shutdown monitoring" )
-        if not event.is_set( RELOAD_EVENT ):
-            # On reloading the configuration, don't stop the processes
-            processes.stop()
+        # Stop watching and the pending restarts first, the processes that are stopped shall not be restarted
+        watcher.stop()
+        processes.close()
+        processes.stop()
+        for server, thread in zip( servers, threads ):
+            server.shutdown()
+            server.server_close()
+            thread.join()
 
-        server.shutdown()
-        server.server_close()
-        thread.join()
         del processes
-        del server
-        if event.is_set( RESTART_EVENT | RELOAD_EVENT ):
-            # Restart / reload the configuration
+        del servers
+        if event.is_set( RESTART_EVENT ):
+            # Restart with the configuration
             cfg, _ = load_configuration()
 
         event.clear( RESTART_EVENT | RELOAD_EVENT )
@@ -1,11 +1,19 @@
 import platform
 if platform.system() == 'Windows':
     from osmon.system.windows.process import ProcessMonitorWindows as ProcessMonitor
+    from osmon.system.windows.watcher import ExitWatcher
+    # No batch collector, psutil is used per task
+    Collector = None
+    # No process tree index, the tasks are measured by their main process
+    ProcessTree = None
 
 elif platform.system() == 'Linux':
     from osmon.system.linux.process import ProcessMonitorLinux as ProcessMonitor
+    from osmon.system.linux.watcher import ExitWatcher
+    from osmon.system.linux.collector import ProcStatCollector as Collector
+    from osmon.system.linux.tree import ProcessTree
 
 else:
     raise Exception( f"Platform { platform.system() } is not supported (YET) by osmon" )
 
-__all__ = [ 'ProcessMonitor' ]
+__all__ = [ 'ProcessMonitor', 'ExitWatcher', 'Collector', 'ProcessTree' ]
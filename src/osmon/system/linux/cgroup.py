@@ -0,0 +1,199 @@
+import typing as t
+import os
+import time
+import signal
+import logging
+from osmon.common.interfaces import ICgroupInfo
+
+
+__all__ = [ 'TaskCgroup' ]
+
+
+logger = logging.getLogger( 'OSMON.CGROUP' )
+
+
+# Controllers enabled for the cgroups of the tasks, cpu.stat is always there
+CONTROLLERS     = ( 'cpu', 'memory', 'io' )
+MEMORY_EVENTS   = ( 'low', 'high', 'max', 'oom', 'oom_kill' )
+# Started in front of the command of a task, the shell moves itself into the cgroup and execs the
+# command; no Python code runs between fork and exec. $0 is the cgroup.procs file
+JOIN_SCRIPT     = 'echo $$ > "$0" 2> /dev/null; exec "$@"'
+# Seconds the processes left in a cgroup have to exit after they were killed
+REMOVE_TIMEOUT  = 2.0
+
+
+def keyed( data: bytes ) -> t.Dict[ bytes, int ]:
+    """Parse the flat keyed format, one 'key value' pair per line"""
+    result = {}
+    for line in data.splitlines():
+        key, _, value = line.partition( b' ' )
+        if value:
+            result[ key ] = int( value )
+
+    return result
+
+
+class TaskCgroup( object ):
+    """The cgroup v2 directory of one task.
+
+    The task is started in the cgroup, every process it forks stays in it. The resource usage of
+    the whole process tree is then read from the accounting files of the cgroup; a read per file
+    whatever the number of processes, instead of walking the children of the main process.
+    """
+    def __init__( self, path: str ):
+        self._path      = path
+        self._created   = False
+        return
+
+    @property
+    def Path( self ) -> str:
+        return self._path
+
+    def create( self ) -> bool:
+        """Create the cgroup with the controllers enabled, False when cgroup v2 cannot be used"""
+        if self._created:
+            return True
+
+        parent = os.path.dirname( self._path )
+        try:
+            os.makedirs( self._path, exist_ok = True )
+            with open( os.path.join( parent, 'cgroup.controllers' ), 'r' ) as stream:
+                available = stream.read().split()
+
+            for controller in CONTROLLERS:
+                if controller not in available:
+                    logger.warning( f"cgroup controller { controller } is not available in { parent }" )
+                    continue
+
+                try:
+                    with open( os.path.join( parent, 'cgroup.subtree_control' ), 'w' ) as stream:
+                        stream.write( f"+{ controller }" )
+
+                except OSError as exc:
+                    logger.warning( f"Cannot enable cgroup controller { controller } in { parent }: { exc }" )
+
+        except OSError as exc:
+            logger.warning( f"Cannot use cgroup { self._path }, only the main process is measured: { exc }" )
+            return False
+
+        self._created = True
+        return True
+
+    def command( self, args: t.List[ str ] ) -> t.List[ str ]:
+        """The args started by a shell that joins the cgroup before the exec of args. Failing does not
+        fail the start; attach() afterwards reports it"""
+        return [ '/bin/sh', '-c', JOIN_SCRIPT, os.path.join( self._path, 'cgroup.procs' ), *args ]
+
+    def attach( self, pids: t.Iterable[ int ] ):
+        """Move already running processes into the cgroup, one write per process"""
+        for pid in pids:
+            try:
+                with open( os.path.join( self._path, 'cgroup.procs' ), 'w' ) as stream:
+                    stream.write( str( pid ) )
+
+            except OSError as exc:
+                logger.warning( f"Cannot move PID { pid } into cgroup { self._path }: { exc }" )
+
+        return
+
+    def remove( self ):
+        """Kill the processes left in the cgroup and remove its directory, for a task that is stopped"""
+        if not self._created:
+            return
+
+        self._created = False
+        try:
+            with open( os.path.join( self._path, 'cgroup.kill' ), 'w' ) as stream:
+                stream.write( '1' )
+
+        except FileNotFoundError:
+            # Before Linux 5.14, one kill per process
+            for pid in self._pids():
+                try:
+                    os.kill( pid, signal.SIGKILL )
+
+                except ProcessLookupError:
+                    pass
+
+        except OSError as exc:
+            logger.warning( f"Cannot kill the processes of cgroup { self._path }: { exc }" )
+
+        deadline = time.monotonic() + REMOVE_TIMEOUT
+        while True:
+            try:
+                os.rmdir( self._path )
+                break
+
+            except FileNotFoundError:
+                break
+
+            except OSError as exc:
+                # Busy until the killed processes have exited
+                if time.monotonic() > deadline:
+                    logger.warning( f"Cannot remove cgroup { self._path }: { exc }" )
+                    break
+
+                time.sleep( 0.05 )
+
+        return
+
+    def _pids( self ) -> t.List[ int ]:
+        try:
+            return [ int( pid ) for pid in ( self._read( 'cgroup.procs' ) or b'' ).split() ]
+
+        except OSError:
+            return []
+
+    def _read( self, name: str ) -> t.Optional[ bytes ]:
+        try:
+            with open( os.path.join( self._path, name ), 'rb' ) as stream:
+                return stream.read()
+
+        except FileNotFoundError:
+            # The controller is not enabled for the cgroup
+            return None
+
+    def statistics( self ) -> t.Optional[ ICgroupInfo ]:
+        """Resource usage of all processes in the cgroup, None when the cgroup is gone"""
+        try:
+            cpu = self._read( 'cpu.stat' )
+            if cpu is None:
+                return None
+
+            memory = self._read( 'memory.current' )
+            events = self._read( 'memory.events' )
+            io = self._read( 'io.stat' )
+
+        except OSError as exc:
+            logger.debug( f"Reading cgroup { self._path }: { exc }" )
+            return None
+
+        cpu = keyed( cpu )
+        info = ICgroupInfo.model_construct( cpu_usage = cpu.get( b'usage_usec', 0 ) / 1e6,
+                                            cpu_user = cpu.get( b'user_usec', 0 ) / 1e6,
+                                            cpu_system = cpu.get( b'system_usec', 0 ) / 1e6 )
+        if b'throttled_usec' in cpu:
+            info.cpu_throttled = cpu[ b'throttled_usec' ] / 1e6
+
+        if memory is not None:
+            info.memory_current = int( memory )
+
+        if events is not None:
+            events = keyed( events )
+            info.memory_events = { name: events.get( name.encode(), 0 ) for name in MEMORY_EVENTS }
+
+        if io is not None:
+            # One line per device; '<major>:<minor> rbytes=.. wbytes=.. rios=.. wios=.. ...'
+            totals = { b'rbytes': 0, b'wbytes': 0, b'rios': 0, b'wios': 0 }
+            for line in io.splitlines():
+                for item in line.split()[ 1: ]:
+                    key, _, value = item.partition( b'=' )
+                    if key in totals:
+                        totals[ key ] += int( value )
+
+            info.io_read_bytes  = totals[ b'rbytes' ]
+            info.io_write_bytes = totals[ b'wbytes' ]
+            info.io_reads       = totals[ b'rios' ]
+            info.io_writes      = totals[ b'wios' ]
+
+        return info
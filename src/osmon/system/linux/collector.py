@@ -0,0 +1,215 @@
+import typing as t
+import os
+import time
+import resource
+from osmon.common.interfaces import IProcessStatistics, IProcessCpuTimes, IProcessMemInfo
+
+
+__all__ = [ 'ProcStatCollector', 'ProcStatSample' ]
+
+
+# /proc/<pid>/stat state character to the psutil status names
+STATUS_NAMES = {
+    ord( 'R' ): 'running',
+    ord( 'S' ): 'sleeping',
+    ord( 'D' ): 'disk-sleep',
+    ord( 'Z' ): 'zombie',
+    ord( 'T' ): 'stopped',
+    ord( 't' ): 'tracing-stop',
+    ord( 'X' ): 'dead',
+    ord( 'x' ): 'dead',
+    ord( 'K' ): 'wake-kill',
+    ord( 'W' ): 'waking',
+    ord( 'P' ): 'parked',
+    ord( 'I' ): 'idle',
+}
+
+# Field index in /proc/<pid>/stat counted after the closing parenthesis of the comm field
+STAT_STATE          = 0
+STAT_UTIME          = 11
+STAT_STIME          = 12
+STAT_CUTIME         = 13
+STAT_CSTIME         = 14
+STAT_NUM_THREADS    = 17
+STAT_STARTTIME      = 19
+STAT_PROCESSOR      = 36
+STAT_BLKIO_TICKS    = 39
+
+
+def boot_time() -> float:
+    with open( '/proc/stat', 'rb' ) as stream:
+        for line in stream:
+            if line.startswith( b'btime' ):
+                return float( line.split()[ 1 ] )
+
+    raise RuntimeError( "btime not found in /proc/stat" )
+
+
+class ProcStatSample( t.NamedTuple ):
+    """Raw statistics of one process, the pydantic model is only build when requested"""
+    cpu:                int
+    cpu_percent:        float
+    user:               float
+    system:             float
+    children_user:      float
+    children_system:    float
+    iowait:             float
+    rss:                float
+    vms:                float
+    shared:             float
+    text:               float
+    lib:                float
+    data:               float
+    dirty:              float
+    status:             str
+
+    def statistics( self ) -> IProcessStatistics:
+        return IProcessStatistics.model_construct( cpu = self.cpu,
+                                                   cpu_percent = self.cpu_percent,
+                                                   cpu_times = IProcessCpuTimes.model_construct( user = self.user,
+                                                                                                 system = self.system,
+                                                                                                 children_user = self.children_user,
+                                                                                                 children_system = self.children_system,
+                                                                                                 iowait = self.iowait ),
+                                                   memory = IProcessMemInfo.model_construct( rss = self.rss,
+                                                                                             vms = self.vms,
+                                                                                             shared = self.shared,
+                                                                                             text = self.text,
+                                                                                             lib = self.lib,
+                                                                                             data = self.data,
+                                                                                             dirty = self.dirty ),
+                                                   status = self.status )
+
+
+class ProcStatCollector( object ):
+    """Collects the statistics of all monitored processes in a single pass.
+
+    Per process only /proc/<pid>/stat and /proc/<pid>/statm are read, into a buffer
+    that is allocated once. The files are kept open between the passes and re-read
+    with pread(), so a pass costs two system calls per process. This replaces the
+    psutil oneshot() calls per task, that open and parse several files and build
+    intermediate objects per process.
+    """
+    def __init__( self, buffer_size: int = 4096, max_open: t.Optional[ int ] = None ):
+        self._buffer    = bytearray( buffer_size )
+        self._ticks     = float( os.sysconf( 'SC_CLK_TCK' ) )
+        self._pagesize  = float( os.sysconf( 'SC_PAGE_SIZE' ) )
+        self._boot_time = boot_time()
+        # pid -> ( starttime, timestamp, cpu ticks ) of the previous pass, for the cpu percentage
+        self._previous  = {}
+        # pid -> ( stat fd, statm fd ), limited to max_open processes to stay within RLIMIT_NOFILE
+        self._files     = {}
+        if max_open is None:
+            # Two files per process, leave half of the descriptors for the rest of osmon
+            limit = resource.getrlimit( resource.RLIMIT_NOFILE )[ 0 ]
+            max_open = 1024 if limit == resource.RLIM_INFINITY else limit // 4
+
+        self._max_open  = max_open
+        return
+
+    def __del__( self ):
+        self.close()
+        return
+
+    def close( self ):
+        for pid in list( self._files ):
+            self._close( pid )
+
+        return
+
+    def _close( self, pid: int ):
+        for fd in self._files.pop( pid, () ):
+            os.close( fd )
+
+        return
+
+    def _open( self, pid: int ) -> t.Tuple[ int, int ]:
+        stat_fd = os.open( b'/proc/%d/stat' % pid, os.O_RDONLY | os.O_CLOEXEC )
+        try:
+            statm_fd = os.open( b'/proc/%d/statm' % pid, os.O_RDONLY | os.O_CLOEXEC )
+
+        except OSError:
+            os.close( stat_fd )
+            raise
+
+        return stat_fd, statm_fd
+
+    def collect( self, pids: t.Iterable[ int ] ) -> t.Dict[ int, t.Tuple[ float, ProcStatSample ] ]:
+        """Returns per PID the create time and the statistics, PIDs that do not exist are left out"""
+        result      = {}
+        previous    = self._previous
+        files       = self._files
+        buffer      = self._buffer
+        ticks       = self._ticks
+        pagesize    = self._pagesize
+        for pid in pids:
+            fds = files.get( pid )
+            try:
+                if fds is None:
+                    fds = self._open( pid )
+                    if len( files ) < self._max_open:
+                        files[ pid ] = fds
+
+                try:
+                    length = os.preadv( fds[ 0 ], [ buffer ], 0 )
+                    # The comm field may contain spaces and parenthesis, skip to the last one
+                    fields = buffer[ buffer.rfind( b')', 0, length ) + 2: length ].split()
+                    length = os.preadv( fds[ 1 ], [ buffer ], 0 )
+                    pages = buffer[ : length ].split()
+
+                finally:
+                    if files.get( pid ) is not fds:
+                        os.close( fds[ 0 ] )
+                        os.close( fds[ 1 ] )
+
+            except ( FileNotFoundError, ProcessLookupError ):
+                # Gone, an open file of an exited process reports ESRCH
+                self._close( pid )
+                previous.pop( pid, None )
+                continue
+
+            now         = time.monotonic()
+            starttime   = int( fields[ STAT_STARTTIME ] )
+            utime       = int( fields[ STAT_UTIME ] )
+            stime       = int( fields[ STAT_STIME ] )
+            cpu_percent = 0.0
+            last        = previous.get( pid )
+            if last is not None and last[ 0 ] == starttime and now > last[ 1 ]:
+                cpu_percent = ( ( utime + stime - last[ 2 ] ) / ticks ) / ( now - last[ 1 ] ) * 100.0
+
+            previous[ pid ] = ( starttime, now, utime + stime )
+            stats       = ProcStatSample( int( fields[ STAT_PROCESSOR ] ),
+                                          cpu_percent,
+                                          utime / ticks,
+                                          stime / ticks,
+                                          int( fields[ STAT_CUTIME ] ) / ticks,
+                                          int( fields[ STAT_CSTIME ] ) / ticks,
+                                          int( fields[ STAT_BLKIO_TICKS ] ) / ticks,
+                                          int( pages[ 1 ] ) * pagesize,
+                                          int( pages[ 0 ] ) * pagesize,
+                                          int( pages[ 2 ] ) * pagesize,
+                                          int( pages[ 3 ] ) * pagesize,
+                                          int( pages[ 4 ] ) * pagesize,
+                                          int( pages[ 5 ] ) * pagesize,
+                                          int( pages[ 6 ] ) * pagesize,
+                                          STATUS_NAMES.get( fields[ STAT_STATE ][ 0 ], '?' ) )
+            result[ pid ] = ( self._boot_time + starttime / ticks, stats )
+
+        return result
+
+    def retain( self, pids: t.Iterable[ int ] ):
+        """Forget all processes that are not in pids, e.g. the old PID of a restarted task"""
+        keep = set( pids )
+        for pid in set( self._files ) - keep:
+            self._close( pid )
+
+        for pid in set( self._previous ) - keep:
+            del self._previous[ pid ]
+
+        return
+
+    def forget( self, pid: int ):
+        """Drop the open files and cpu percentage history of a process that is no longer monitored"""
+        self._close( pid )
+        self._previous.pop( pid, None )
+        return
@@ -1,28 +1,45 @@
 import os
-import time
 import logging
 from psutil import Process, Popen, NoSuchProcess
 from osmon.common.exc import ProcessNotFound
 from osmon.common.interfaces import ITaskConfig
+from osmon.common.metrics import timed
+from osmon.common.pidfile import wait_for_pidfile
 from osmon.common.process import ProcessMonitorAbc
+from osmon.system.linux.cgroup import TaskCgroup
 
 
 __all__ = [ 'ProcessMonitorLinux' ]
 
 
 logger = logging.getLogger( 'OSMON.PROCESS' )
+# Seconds a started daemon has to write its PID file
+PIDFILE_TIMEOUT = 10.0
 
 
 class ProcessMonitorLinux( ProcessMonitorAbc ):
-    def __init__( self, descriptor: ITaskConfig ):
-        super().__init__( descriptor )
+    def __init__( self, descriptor: ITaskConfig, watcher = None, scheduler = None, store = None ):
+        super().__init__( descriptor, watcher, scheduler, store )
+        if descriptor.cgroup is not None:
+            self._cgroup = TaskCgroup( descriptor.cgroup )
+
+        return
+
+    def stop( self ):
+        super().stop()
+        if self._cgroup is not None:
+            # The workers of the task are in the cgroup as well
+            self._cgroup.remove()
+
         return
 
     def __del__(self):
         del self._process
         return
 
+    @timed( 'task.start' )
     def start( self ):
+        self._adopted = False
         args = self._build_process_argument()
         if isinstance( self._descriptor.pidfile, str ):
             if os.path.exists( self._descriptor.pidfile ):
@@ -35,6 +52,17 @@ class ProcessMonitorLinux( ProcessMonitorAbc ):
                     prc_args = [ prc_args[ 0 ] ] + prc_args[ -args_len: ]
                     if set( args ) == set( prc_args ):
                         logger.info( f"Found existing process { self._descriptor.name } with PID { pid }" )
+                        if self._cgroup is not None:
+                            if self._cgroup.create():
+                                # Started before, by an osmon without cgroups or in an other cgroup
+                                self._cgroup.attach( [ pid ] + [ child.pid for child in self._process.children( recursive = True ) ] )
+
+                            else:
+                                # Measured by the process tree index instead
+                                self._cgroup = None
+
+                        self._adopted = True
+                        self._watch()
                         self.monitor()
                         return
 
@@ -45,33 +73,32 @@ class ProcessMonitorLinux( ProcessMonitorAbc ):
                     os.remove( self._descriptor.pidfile )
                     self._process = None
 
+        if self._cgroup is not None:
+            if self._cgroup.create():
+                # The started process joins the cgroup before exec, everything it forks stays in it
+                args = self._cgroup.command( args )
+
+            else:
+                # Measured by the process tree index instead
+                self._cgroup = None
+
         self._process = Popen( args )
         logger.info( f"Started process {self._process}" )
         self._process.wait( 5 )
         pid = -1
         if isinstance( self._descriptor.pidfile, str ):
-            tries = 10
-            while True:
-                try:
-                    if os.path.exists( self._descriptor.pidfile ):
-                        pid = self._get_pid_child()
-
-                    break
-
-                except ValueError:
-                    logger.debug( "Waiting on PID file" )
-                    time.sleep( 1 )
-                    tries -= 1
-                    if tries == 0:
-                        raise ProcessNotFound( f"PID file not found, process did not create the file: { self._descriptor.process }" )
-
-                except Exception:
-                    raise
+            # Woken up by inotify as soon as the daemon writes the file
+            pid = wait_for_pidfile( self._descriptor.pidfile, PIDFILE_TIMEOUT )
 
         if pid == -1:
             raise ProcessNotFound( f"PID file not found { self._descriptor.process }" )
 
         # Now pickup the daemonized process
         self._process = Process( pid )
+        if self._cgroup is not None:
+            # Normally there already, logs why when joining failed in the started process
+            self._cgroup.attach( [ pid ] )
+
+        self._watch()
         self.monitor()
         return
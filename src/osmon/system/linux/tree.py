@@ -0,0 +1,104 @@
+import typing as t
+import os
+from psutil import Process, NoSuchProcess, AccessDenied
+from osmon.common.interfaces import IProcessTreeInfo
+from osmon.system.linux.collector import STAT_UTIME, STAT_STIME, STAT_NUM_THREADS, STAT_STARTTIME
+
+
+__all__ = [ 'ProcessTree' ]
+
+
+# Field index in /proc/<pid>/stat counted after the closing parenthesis of the comm field
+STAT_PPID           = 1
+STAT_RSS            = 21
+
+
+class ProcessTree( object ):
+    """The process trees of the tasks, for the tasks that fork workers and run without cgroup.
+
+    One scan of /proc/*/stat per sweep builds the parent to children index of all processes,
+    the trees of all tasks are taken from that index. CPU times, resident memory and threads
+    come from the scan; the cpu percentage and the open files from a psutil handle, that is
+    only created for a process that is new in a tree and kept while the process lives.
+    """
+    def __init__( self ):
+        self._ticks     = float( os.sysconf( 'SC_CLK_TCK' ) )
+        self._pagesize  = os.sysconf( 'SC_PAGE_SIZE' )
+        # pid -> ( starttime, psutil handle ) of the processes in the trees
+        self._handles   = {}
+        return
+
+    @staticmethod
+    def scan() -> t.Dict[ int, t.List[ bytes ] ]:
+        """The fields of /proc/<pid>/stat after the comm field of all processes"""
+        result = {}
+        for name in os.listdir( '/proc' ):
+            if not name.isdigit():
+                continue
+
+            try:
+                fd = os.open( f'/proc/{ name }/stat', os.O_RDONLY | os.O_CLOEXEC )
+                try:
+                    data = os.read( fd, 4096 )
+
+                finally:
+                    os.close( fd )
+
+            except ( FileNotFoundError, ProcessLookupError ):
+                # Exited during the scan
+                continue
+
+            # The comm field may contain spaces and parenthesis, skip to the last one
+            result[ int( name ) ] = data[ data.rfind( b')' ) + 2: ].split()
+
+        return result
+
+    def _handle( self, pid: int, starttime: bytes ) -> Process:
+        handle = self._handles.get( pid )
+        if handle is None or handle[ 0 ] != starttime:
+            # New process, or the PID was reused
+            handle = ( starttime, Process( pid ) )
+            self._handles[ pid ] = handle
+
+        return handle[ 1 ]
+
+    def collect( self, pids: t.Iterable[ int ] ) -> t.Dict[ int, IProcessTreeInfo ]:
+        """Returns per PID the totals of the process and its descendants, PIDs that do not exist are left out"""
+        stats = self.scan()
+        children = {}
+        for pid, fields in stats.items():
+            children.setdefault( int( fields[ STAT_PPID ] ), [] ).append( pid )
+
+        # Forget the handles of the processes that exited
+        self._handles = { pid: handle for pid, handle in self._handles.items()
+                          if pid in stats and stats[ pid ][ STAT_STARTTIME ] == handle[ 0 ] }
+        result = {}
+        for root in pids:
+            if root not in stats:
+                continue
+
+            info = IProcessTreeInfo( processes = 0, cpu_percent = 0.0, cpu_user = 0.0, cpu_system = 0.0,
+                                     rss = 0, num_threads = 0, num_fds = 0 )
+            tree = [ root ]
+            while tree:
+                pid = tree.pop()
+                tree.extend( children.get( pid, () ) )
+                fields = stats[ pid ]
+                info.processes      += 1
+                info.cpu_user       += int( fields[ STAT_UTIME ] ) / self._ticks
+                info.cpu_system     += int( fields[ STAT_STIME ] ) / self._ticks
+                info.rss            += int( fields[ STAT_RSS ] ) * self._pagesize
+                info.num_threads    += int( fields[ STAT_NUM_THREADS ] )
+                try:
+                    handle = self._handle( pid, fields[ STAT_STARTTIME ] )
+                    with handle.oneshot():
+                        info.cpu_percent    += handle.cpu_percent()
+                        info.num_fds        += handle.num_fds()
+
+                except ( NoSuchProcess, AccessDenied ):
+                    # Exited since the scan, or of an other user
+                    self._handles.pop( pid, None )
+
+            result[ root ] = info
+
+        return result
@@ -0,0 +1,218 @@
+import typing as t
+import os
+import errno
+import signal
+import logging
+import selectors
+import threading
+from psutil import Process, NoSuchProcess
+
+
+__all__ = [ 'ExitWatcher' ]
+
+
+logger = logging.getLogger( 'OSMON.WATCHER' )
+# Seconds between the reaps of the children when there is no SIGCHLD handler
+REAP_INTERVAL   = 1.0
+
+
+class ExitWatcher( object ):
+    """Event driven detection of exiting processes.
+
+    Every watched PID gets a pidfd (pidfd_open) that is registered in a single
+    selector (epoll), the descriptor becomes readable the moment the process
+    terminates. When the kernel or Python has no pidfd support, direct children
+    are detected via SIGCHLD and waitpid(). The SIGCHLD handler can only be installed
+    when the watcher is created on the main thread, otherwise the children are reaped
+    every REAP_INTERVAL seconds. Processes that can be watched by neither are left to
+    the monitor sweep.
+
+    The callback is called from the watcher thread with the PID that exited.
+    """
+    def __init__( self ):
+        self._selector      = selectors.DefaultSelector()
+        self._lock          = threading.Lock()
+        self._pidfds        = {}
+        self._children      = {}
+        self._thread        = None
+        self._running       = False
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking( self._wakeup_r, False )
+        os.set_blocking( self._wakeup_w, False )
+        self._selector.register( self._wakeup_r, selectors.EVENT_READ, None )
+        # Signal handlers can only be installed from the main thread
+        self._signalled     = threading.current_thread() is threading.main_thread()
+        self._previous      = None
+        if self._signalled:
+            self._previous  = signal.signal( signal.SIGCHLD, self._sigchld )
+
+        return
+
+    def start( self ):
+        self._running = True
+        self._thread = threading.Thread( target = self._run, name = 'exit-watcher', daemon = True )
+        self._thread.start()
+        return
+
+    def stop( self ):
+        self._running = False
+        self._wakeup()
+        if isinstance( self._thread, threading.Thread ):
+            self._thread.join()
+            self._thread = None
+
+        with self._lock:
+            for fd in self._pidfds.values():
+                self._selector.unregister( fd )
+                os.close( fd )
+
+            self._pidfds.clear()
+            self._children.clear()
+
+        if self._signalled and threading.current_thread() is threading.main_thread():
+            signal.signal( signal.SIGCHLD, self._previous if self._previous is not None else signal.SIG_DFL )
+            self._signalled = False
+
+        self._selector.close()
+        os.close( self._wakeup_r )
+        os.close( self._wakeup_w )
+        return
+
+    def watch( self, pid: int, callback: t.Callable[ [ int ], None ] ) -> bool:
+        """Register the PID, returns False when the exit cannot be detected event driven"""
+        try:
+            fd = os.pidfd_open( pid )
+
+        except AttributeError:
+            return self._watch_child( pid, callback )
+
+        except OSError as exc:
+            if exc.errno == errno.ESRCH:
+                # Already gone, report it right away from the watcher thread
+                with self._lock:
+                    self._children[ pid ] = callback
+
+                self._wakeup()
+                return True
+
+            if exc.errno in ( errno.ENOSYS, errno.EPERM ):
+                return self._watch_child( pid, callback )
+
+            raise
+
+        with self._lock:
+            self.unwatch( pid, locked = True )
+            self._pidfds[ pid ] = fd
+            self._selector.register( fd, selectors.EVENT_READ, ( pid, callback ) )
+
+        logger.debug( f"Watching PID { pid } via pidfd { fd }" )
+        return True
+
+    def unwatch( self, pid: int, locked: bool = False ):
+        if not locked:
+            with self._lock:
+                return self.unwatch( pid, True )
+
+        fd = self._pidfds.pop( pid, None )
+        if fd is not None:
+            self._selector.unregister( fd )
+            os.close( fd )
+
+        self._children.pop( pid, None )
+        return
+
+    def _watch_child( self, pid: int, callback: t.Callable[ [ int ], None ] ) -> bool:
+        try:
+            if Process( pid ).ppid() != os.getpid():
+                return False
+
+        except NoSuchProcess:
+            pass
+
+        with self._lock:
+            self._children[ pid ] = callback
+
+        logger.debug( f"Watching child PID { pid } via SIGCHLD" )
+        return True
+
+    def _sigchld( self, signum, frame ):
+        self._wakeup()
+        return
+
+    def _wakeup( self ):
+        try:
+            os.write( self._wakeup_w, b'\0' )
+
+        except ( BlockingIOError, OSError ):
+            # Pipe full or closed, the watcher is awake anyway
+            pass
+
+        return
+
+    def _reap_children( self ) -> t.List[ t.Tuple[ int, t.Callable ] ]:
+        exited = []
+        with self._lock:
+            for pid, callback in list( self._children.items() ):
+                try:
+                    if os.waitpid( pid, os.WNOHANG )[ 0 ] == 0:
+                        # Still running
+                        continue
+
+                except ChildProcessError:
+                    # Reaped elsewhere or not our child (anymore)
+                    pass
+
+                del self._children[ pid ]
+                exited.append( ( pid, callback ) )
+
+        return exited
+
+    def _run( self ):
+        while self._running:
+            exited = []
+            events = self._selector.select( None if self._signalled else REAP_INTERVAL )
+            if not self._signalled and self._children:
+                # No SIGCHLD handler to wake the thread
+                exited.extend( self._reap_children() )
+
+            for key, _ in events:
+                if key.fd == self._wakeup_r:
+                    try:
+                        while os.read( self._wakeup_r, 512 ):
+                            pass
+
+                    except BlockingIOError:
+                        pass
+
+                    exited.extend( self._reap_children() )
+                    continue
+
+                pid, callback = key.data
+                with self._lock:
+                    if self._pidfds.get( pid ) != key.fd:
+                        # Unwatched while we were waiting
+                        continue
+
+                    self.unwatch( pid, locked = True )
+
+                try:
+                    # The exited process may be our own child, don't leave a zombie behind
+                    os.waitpid( pid, os.WNOHANG )
+
+                except ChildProcessError:
+                    pass
+
+                exited.append( ( pid, callback ) )
+
+            if not self._running:
+                break
+
+            for pid, callback in exited:
+                logger.info( f"PID { pid } exited" )
+                try:
+                    callback( pid )
+
+                except Exception:   # noqa
+                    logger.exception( f"During exit handling of PID { pid }" )
+
+        return
@@ -1,8 +1,9 @@
 import logging
 import os.path
-import time
 from osmon.common.exc import ProcessNotFound
 from osmon.common.interfaces import ITaskConfig
+from osmon.common.metrics import timed
+from osmon.common.pidfile import wait_for_pidfile
 from osmon.common.process import ProcessMonitorAbc
 from psutil import Process, Popen, NoSuchProcess
 
@@ -11,14 +12,18 @@ __all__ = [ 'ProcessMonitorWindows', 'NoSuchProcess' ]
 
 
 logger = logging.getLogger( 'osmon.process' )
+# Seconds a started daemon has to write its PID file
+PIDFILE_TIMEOUT = 10.0
 
 
 class ProcessMonitorWindows( ProcessMonitorAbc ):
-    def __init__( self, descriptor: ITaskConfig ):
-        super().__init__( descriptor )
+    def __init__( self, descriptor: ITaskConfig, watcher = None, scheduler = None, store = None ):
+        super().__init__( descriptor, watcher, scheduler, store )
         return
 
+    @timed( 'task.start' )
     def start( self ):
+        self._adopted = False
         # TODO: Needs to be tested
         args = self._build_process_argument()
         if isinstance( self._descriptor.pidfile, str ):
@@ -31,6 +36,8 @@ class ProcessMonitorWindows( ProcessMonitorAbc ):
                     # This is for when the process runs in the pyCharm debugger
                     prc_args = [ prc_args[ 0 ] ] + prc_args[ -args_len: ]
                     if set( args ) == set( prc_args ):
+                        self._adopted = True
+                        self._watch()
                         self.monitor()
                         logger.info( "Found existing process" )
                         return
@@ -49,28 +56,14 @@ class ProcessMonitorWindows( ProcessMonitorAbc ):
         self._process.wait( 5 )
         pid = -1
         if isinstance( self._descriptor.pidfile, str ):
-            tries = 10
-            while True:
-                try:
-                    if os.path.exists( self._descriptor.pidfile ):
-                        pid = self._get_pid_child()
-
-                    break
-
-                except ValueError:
-                    logger.debug( "Waiting on PID file" )
-                    time.sleep( 1 )
-                    tries -= 1
-                    if tries == 0:
-                        raise ProcessNotFound( f"PID file not found, process did not create the file: { self._descriptor.process }" )
-
-                except Exception:
-                    raise
+            # No inotify on Windows, the file is polled at a fine interval
+            pid = wait_for_pidfile( self._descriptor.pidfile, PIDFILE_TIMEOUT )
 
         if pid == -1:
             raise ProcessNotFound( f"PID file not found { self._descriptor.process }" )
 
         # Now pickup the daemonized process
         self._process = Process( pid )
+        self._watch()
         self.monitor()
         return
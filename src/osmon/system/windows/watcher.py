@@ -0,0 +1,19 @@
+import typing as t
+
+
+__all__ = [ 'ExitWatcher' ]
+
+
+class ExitWatcher( object ):
+    """Windows has no pidfd, the exit of a process is detected by the monitor sweep"""
+    def start( self ):
+        return
+
+    def stop( self ):
+        return
+
+    def watch( self, pid: int, callback: t.Callable[ [ int ], None ] ) -> bool:
+        return False
+
+    def unwatch( self, pid: int ):
+        return